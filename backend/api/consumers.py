@@ -1,10 +1,21 @@
 import json
-from channels.generic.websocket import WebsocketConsumer
-import cv2
-from .utils.encoding.encoding import b64str_to_opencvimg, opencvimg_to_b64_str
-from bsproject.settings import CLASSIFIER
-from .utils.user_info.user_info import get_user_info, get_profile_pic
-import numpy as np
+import asyncio
+from urllib.parse import parse_qs
+from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
+from bsproject.settings import INFERENCE_WORKERS
+from .utils.session.FrameSession import FrameSession
+from .utils.inference.InferencePool import InferencePool
+from .utils.recognition.ClassifierRegistry import get_classifier
+
+# Shared by all the async connections of this process
+inference_pool = InferencePool(max_workers=INFERENCE_WORKERS)
+
+def is_metadata_only(scope):
+    """
+    The client asks for replies without frames connecting with ?mode=meta
+    """
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query.get("mode", [""])[0] == "meta"
 
 class FrameConsumer(WebsocketConsumer):
     def connect(self):
@@ -13,76 +24,71 @@ class FrameConsumer(WebsocketConsumer):
         "type": "connection_established",
         "message": "Your are now connected"
        }))
-       self.count = 0
-       self.classifier = CLASSIFIER
-       self.DELTA_RECOGNITION = 5
+       self.session = FrameSession(get_classifier(), is_metadata_only(self.scope)) # Its frames don't go through the inference pool, so its load says nothing
+
+    def disconnect(self, close_code):
+        print(f"Recognition scheduling: {self.session.scheduler.stats()}")
+
+    def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            self.send(bytes_data=self.session.process_bytes(bytes_data))
+            return
+        identity_data = self.session.process(text_data)
+        if identity_data is not None:
+            self.send(text_data=identity_data)
+
+class AsyncFrameConsumer(AsyncWebsocketConsumer):
+    """
+    Same protocol of FrameConsumer (text and binary messages), but the frames are processed by the shared inference pool instead of blocking a thread per message.
+    Only the newest frame is kept while the previous one is being processed: older frames are dropped, so the latency stays bounded.
+    """
+    RETRY_DELAY = 0.01 # Seconds to wait before retrying when the inference pool is saturated
+
+    async def connect(self):
+        await self.accept()
+        await self.send(text_data=json.dumps({
+            "type": "connection_established",
+            "message": "Your are now connected"
+        }))
+        self.latest_frame = None # Newest frame waiting to be processed, as (text_data, bytes_data)
+        self.dropped_frames = 0
+        self.worker = None
+        # Building the classifier (the first time) and loading the model are slow, so they don't run in the event loop
+        self.session = await asyncio.get_running_loop().run_in_executor(None, self.create_session)
+
+    def create_session(self):
+        return FrameSession(get_classifier(), is_metadata_only(self.scope), load=inference_pool.load)
 
-    #TODO: this switch can be avoided if the load_labels and load_recognizer are defined, even abstractly, inside the generic Classifier
-       # reload labels and classifier
-       if self.classifier.name == "LBPHF":
-        #LBPH
-        self.classifier.labels = self.classifier.load_labels()
-        self.classifier.load_recognizer()
-       elif self.classifier.name == "SVC":
-        #SVC
-        self.classifier.labels = self.classifier.load_labels()
-        self.classifier.classifier = self.classifier.load_classifier()
-       elif self.classifier.name == "VGGFACE":
-        #VGGFACE
-        pass
-    
-    def receive(self, text_data):
-        self.count += 1
-        identity_data = {}
-        # {
-        #   STATE: "UNKNOWN", "KNOWN", "NO FACE" 
-        #   FRAME: str
-        #   RECOGNITION_PHASE: boolean (Is time for the recognition because of the delta or not)
-        #   USER_INFO: None | 
-        # {
-        #     ID: int,
-        #     NAME: str,
-        #     SURNAME: str,
-        #     CF: str,
-        #     COST: int
-        #     PROFILE_IMG: str
-        # }
-        #   SIMILARITY: str
-        #     
-        # }
+    async def disconnect(self, close_code):
+        if self.worker is not None:
+            self.worker.cancel()
+        print(f"Recognition scheduling: {self.session.scheduler.stats()}, dropped frames: {self.dropped_frames}")
 
-        # If ID is None, then it means there is no face
-        # If ID is "unknown", then the face isn't recognized
-        # Otherwise the ID will be the ID of the recognized user
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is None and (text_data is None or text_data == "null"):
+            return
+        if self.latest_frame is not None:
+            self.dropped_frames += 1 # Replaced by a newer one before being processed
+        self.latest_frame = (text_data, bytes_data)
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.process_frames())
 
-        if text_data == "null":
-            return 
-        img = b64str_to_opencvimg(text_data)
-        processed_frame = None
-        if self.count % self.DELTA_RECOGNITION == 0:
-            processed_frame, id, similarity = self.classifier.recognize(img)
-            identity_data["RECOGNITION_PHASE"] = True
-            identity_data["FACE_PRESENT"] = id is not None
-            if id is None:
-                identity_data["STATE"] = "NO FACE"
-                identity_data["FRAME"] = text_data
-                identity_data = json.dumps(identity_data)
-                self.send(text_data=identity_data)
-                return
-            if id.lower() == "unknown":
-                identity_data["STATE"] = "UNKNOWN"
-                identity_data = json.dumps(identity_data)
-                self.send(text_data=identity_data)
-                return
-            identity_data["STATE"] = "KNOWN"
-            identity_data["USER_INFO"] = get_user_info(id)
-            identity_data["SIMILARITY"] = np.float64(similarity)
-            identity_data["USER_INFO"]["PROFILE_IMG"] = get_profile_pic(id)
-        else:
-            processed_frame, roi, face_present = self.classifier.detect_faces(img)
-            identity_data["RECOGNITION_PHASE"] = False
-            identity_data["FACE_PRESENT"] = face_present
-        b64_img = opencvimg_to_b64_str(processed_frame)
-        identity_data["FRAME"] = b64_img
-        identity_data = json.dumps(identity_data)
-        self.send(text_data=identity_data)
\ No newline at end of file
+    async def process_frames(self):
+        """
+        Processes the newest frame until there aren't new ones.
+        """
+        while self.latest_frame is not None:
+            text_data, bytes_data = self.latest_frame
+            if bytes_data is not None:
+                future = inference_pool.try_submit(self.session.process_bytes, bytes_data)
+            else:
+                future = inference_pool.try_submit(self.session.process, text_data)
+            if future is None: # Backpressure: wait for a free slot, meanwhile newer frames replace this one
+                await asyncio.sleep(self.RETRY_DELAY)
+                continue
+            self.latest_frame = None
+            reply = await asyncio.wrap_future(future)
+            if bytes_data is not None:
+                await self.send(bytes_data=reply)
+            elif reply is not None:
+                await self.send(text_data=reply)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.utils.recognition.classifiers.LBPHF import LBPHF
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the LBPHF model from scratch with the current samples, removing duplicated or stale histograms."
+
+    def handle(self, *args, **options):
+        LBPHF().compact()
+        self.stdout.write(self.style.SUCCESS("LBPHF model compacted"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.utils.recognition.ClassifierRegistry import get_classifier
+
+
+class Command(BaseCommand):
+    help = "Preprocesses the sample images that aren't preprocessed yet (e.g. after a bulk enrollment), using a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: the classifier's PREPROCESSING_WORKERS).")
+
+    def handle(self, *args, **options):
+        def progress(metrics):
+            self.stdout.write(f"\r{metrics['done']}/{metrics['total']} images ({metrics['elapsed']:.1f}s)", ending="")
+
+        metrics = get_classifier().preprocess_images(workers=options["workers"], progress=progress)
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS(
+            f"{metrics['processed']} preprocessed, {metrics['no_face']} without faces, {metrics['unreadable']} unreadable, {metrics['errors']} errors in {metrics['elapsed']:.1f}s"
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bsproject import settings
+from api.utils.recognition.ClassifierRegistry import registry
+from api.utils.inference.InferenceServer import InferenceServer, check_connection_settings
+
+
+class Command(BaseCommand):
+    help = "Runs the inference server: it loads the classifier once and serves the recognition to all the ASGI workers (see settings.INFERENCE_SERVER)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--address", default=None, help="host:port or path of the Unix socket to listen on (default: settings.INFERENCE_SERVER).")
+        parser.add_argument("--classifier", default=None, help="Classifier to serve (default: settings.CLASSIFIER_NAME).")
+        parser.add_argument("--batch-size", type=int, default=settings.INFERENCE_BATCH_SIZE, help="Maximum number of requests in a batch.")
+        parser.add_argument("--batch-wait", type=float, default=settings.INFERENCE_BATCH_WAIT, help="Seconds a batch waits for more requests.")
+
+    def handle(self, *args, **options):
+        address = options["address"] or settings.INFERENCE_SERVER
+        if not address:
+            raise CommandError("Set INFERENCE_SERVER or pass --address")
+        try:
+            check_connection_settings(address, settings.INFERENCE_SERVER_AUTHKEY, settings.INFERENCE_SERVER_ALLOW_REMOTE)
+        except ValueError as e: # Checked before loading the classifier
+            raise CommandError(str(e))
+        name = options["classifier"] or settings.CLASSIFIER_NAME
+        if name.upper() == "REMOTE":
+            raise CommandError("The inference server can't serve the remote classifier")
+        classifier = registry.get(name)
+        classifier.current_model() # Loaded before accepting the workers
+        server = InferenceServer(classifier, address, settings.INFERENCE_SERVER_AUTHKEY, options["batch_size"], options["batch_wait"], settings.INFERENCE_SERVER_ALLOW_REMOTE)
+        server.serve_forever()
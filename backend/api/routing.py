@@ -2,5 +2,6 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
-    re_path(r'ws/socket-server/', consumers.FrameConsumer.as_asgi())
+    re_path(r'ws/socket-server/', consumers.FrameConsumer.as_asgi()),
+    re_path(r'ws/async-socket-server/', consumers.AsyncFrameConsumer.as_asgi())
 ]
\ No newline at end of file
@@ -1,3 +1,1269 @@
-from django.test import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, wait
+from unittest import mock
+import cv2
+import numpy as np
+from django.test import SimpleTestCase, RequestFactory, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-# Create your tests here.
+from .utils.dbconnector.dbconnector import ConnectionPool, PoolTimeout
+from .utils.encoding.encoding import pack_frame_message, unpack_frame_message, opencvimg_to_jpeg_bytes, jpeg_bytes_to_opencvimg
+from .utils.recognition.matchers.GalleryMatcher import GalleryMatcher
+from .utils.recognition.matchers.IVFMatcher import IVFMatcher
+from .utils.recognition.matchers.NearestClassMean import NearestClassMean
+from .utils.tracking.FaceTracker import FaceTracker, iou
+from .utils.session.VoteAggregator import VoteAggregator
+from .utils.user_info.UserCache import UserCache
+from .utils.user_info.PhotoStore import PhotoStore
+from .utils.recognition.stores.FeatureStore import FeatureTable
+from .utils.recognition.stores.GalleryFile import GalleryFile
+from .utils.inference.InferenceServer import InferenceServer
+from .utils.recognition.ModelRegistry import ModelRegistry
+from .utils.recognition.Classifier import Classifier
+from .utils.recognition.classifiers.LBPHF import LBPHF
+from .utils.recognition.Detection import Detection
+from .utils.scheduling.RecognitionPolicy import AdaptivePolicy, FixedIntervalPolicy, RecognitionScheduler
+from .utils.session.FrameSession import FrameSession
+from .utils.tracking.FaceTracker import Track
+from .utils.training.TrainingScheduler import TrainingScheduler
+from .utils.enrollment.SampleWriter import SampleWriter, SampleCounter
+from .utils.enrollment.SamplePreprocessor import SamplePreprocessor
+from . import views
+
+
+class BrokenRollbackConnection:
+    """
+    sqlite3 connection whose rollback fails, like a MySQL connection dropped by the server.
+    """
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.closed = False
+
+    def cursor(self, **options):
+        return self.connection.cursor(**options)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        raise sqlite3.OperationalError("connection lost")
+
+    def close(self):
+        self.closed = True
+        self.connection.close()
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.dir, "pool.sqlite3")
+        self.connects = 0
+        with sqlite3.connect(self.db_path) as connection:
+            connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def connect(self):
+        self.connects += 1
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def pool(self, **options):
+        return ConnectionPool(self.connect, paramstyle="qmark", **options)
+
+    def test_connection_is_released_and_reused(self):
+        pool = self.pool(size=2)
+        with pool.connection() as first:
+            self.assertEqual(pool.open_connections, 1)
+        self.assertEqual(pool.idle.qsize(), 1)
+        with pool.connection() as second:
+            self.assertIs(second, first)
+        self.assertEqual(self.connects, 1)
+
+    def test_parameterized_queries(self):
+        pool = self.pool()
+        user_id = pool.execute("INSERT INTO users (name) VALUES (%s)", ("ada",))
+        self.assertEqual(pool.query("SELECT name FROM users WHERE id = %s", (user_id,)), (("ada",),))
+
+    def test_checkout_times_out_when_exhausted(self):
+        pool = self.pool(size=1, timeout=0.05)
+        with pool.connection():
+            with self.assertRaises(PoolTimeout):
+                with pool.connection():
+                    pass
+        with pool.connection(): # Available again once released
+            pass
+
+    def test_exhausted_pool_waits_for_a_release(self):
+        pool = self.pool(size=1, timeout=5.)
+        checked_out = threading.Event()
+
+        def hold():
+            with pool.connection():
+                checked_out.set()
+                threading.Event().wait(0.1)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        checked_out.wait()
+        with pool.connection(): # Blocks until the other thread releases the only connection
+            pass
+        holder.join()
+        self.assertEqual(self.connects, 1)
+
+    def test_failed_block_is_rolled_back(self):
+        pool = self.pool()
+        with self.assertRaises(ValueError):
+            with pool.cursor() as cursor:
+                cursor.execute("INSERT INTO users (name) VALUES (?)", ("grace",))
+                raise ValueError("failure after the insert")
+        self.assertEqual(pool.query("SELECT COUNT(*) FROM users"), ((0,),))
+        self.assertEqual(pool.open_connections, 1) # The connection is still good, so it's kept
+        self.assertEqual(pool.idle.qsize(), 1)
+
+    def test_broken_connection_is_discarded(self):
+        connections = []
+
+        def connect():
+            connections.append(BrokenRollbackConnection(self.connect()))
+            return connections[-1]
+
+        pool = ConnectionPool(connect, paramstyle="qmark")
+        with self.assertRaises(ValueError):
+            with pool.connection():
+                raise ValueError("failure")
+        self.assertTrue(connections[0].closed)
+        self.assertEqual(pool.open_connections, 0)
+        self.assertEqual(pool.idle.qsize(), 0)
+        with pool.connection() as connection:
+            self.assertIs(connection, connections[1])
+
+    def test_dead_idle_connection_is_replaced(self):
+        pool = self.pool(health_check_after=0.)
+        with pool.connection() as first:
+            pass
+        first.close() # e.g. closed by the server after wait_timeout
+        with pool.connection() as second:
+            self.assertIsNot(second, first)
+            second.execute("SELECT 1")
+        self.assertEqual(self.connects, 2)
+        self.assertEqual(pool.open_connections, 1)
+
+    def test_recently_used_connection_is_not_checked(self):
+        pool = self.pool(health_check_after=60., health_query="SELECT * FROM missing_table")
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second: # The failing health query isn't run
+            self.assertIs(second, first)
+
+
+def random_gallery(rng, n_templates=200, dim=32, n_labels=20):
+    labels = np.array([f"user{i % n_labels}" for i in range(n_templates)])
+    return labels, rng.standard_normal((n_templates, dim)).astype(np.float32)
+
+def brute_force_search(labels, vectors, probe, k):
+    """
+    Cosine similarity of the probe with each template, computed one by one.
+    """
+    scores = [float(np.dot(vector, probe) / (np.linalg.norm(vector) * np.linalg.norm(probe))) for vector in vectors]
+    best = sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+    return [(labels[i], scores[i]) for i in best]
+
+
+class FrameMessageTests(SimpleTestCase):
+    def test_round_trip(self):
+        header = {"ID": "42", "NAME": "Mario", "CONFIDENCE": 0.75, "FACES": [[1, 2, 3, 4]], "NOTE": "caffè"}
+        jpeg = opencvimg_to_jpeg_bytes(np.full((16, 16, 3), 128, np.uint8))
+        message = pack_frame_message(header, jpeg)
+        self.assertEqual(unpack_frame_message(message), (header, jpeg))
+        self.assertEqual(unpack_frame_message(memoryview(message)), (header, jpeg))
+        self.assertEqual(jpeg_bytes_to_opencvimg(unpack_frame_message(message)[1]).shape, (16, 16, 3))
+
+    def test_round_trip_without_frame(self):
+        self.assertEqual(unpack_frame_message(pack_frame_message({})), ({}, None))
+        self.assertEqual(unpack_frame_message(pack_frame_message({"ID": None}, b"")), ({"ID": None}, None))
+
+    def test_header_length_is_big_endian(self):
+        message = pack_frame_message({"a": 1}, b"jpeg")
+        self.assertEqual(message[:4], len(b'{"a":1}').to_bytes(4, "big"))
+        self.assertEqual(message[4:], b'{"a":1}jpeg')
+
+    def test_malformed_messages_are_rejected(self):
+        header = b'{"ID":"42"}'
+        for message in [
+            b"",
+            b"\x00\x00", # Truncated header length
+            (len(header) + 1).to_bytes(4, "big") + header, # Header longer than the message
+            (4).to_bytes(4, "big") + b"\xff\xfe\xfd\xfc", # Not UTF-8
+            (5).to_bytes(4, "big") + b'{"ID"', # Truncated JSON
+            (2).to_bytes(4, "big") + b"[]", # Not an object
+        ]:
+            with self.assertRaises(ValueError, msg=message):
+                unpack_frame_message(message)
+
+
+class GalleryMatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.labels, self.vectors = random_gallery(self.rng)
+        self.matcher = GalleryMatcher(self.labels, self.vectors)
+
+    def assertSameResults(self, results, expected):
+        self.assertEqual([label for label, _ in results], [label for label, _ in expected])
+        np.testing.assert_allclose([score for _, score in results], [score for _, score in expected], atol=1e-5)
+
+    def test_search_matches_brute_force(self):
+        for probe in self.rng.standard_normal((10, 32)):
+            for k in (1, 5):
+                self.assertSameResults(self.matcher.search(probe, k), brute_force_search(self.labels, self.vectors, probe, k))
+
+    def test_k_larger_than_gallery(self):
+        probe = self.rng.standard_normal(32)
+        results = self.matcher.search(probe, k=500)
+        self.assertSameResults(results, brute_force_search(self.labels, self.vectors, probe, 500))
+        self.assertEqual(len(results), len(self.labels))
+
+    def test_add_extends_the_gallery(self):
+        matcher = GalleryMatcher(self.labels[:100], self.vectors[:100])
+        matcher.add(self.labels[100:], self.vectors[100:])
+        probe = self.rng.standard_normal(32)
+        self.assertSameResults(matcher.search(probe, 5), brute_force_search(self.labels, self.vectors, probe, 5))
+
+    def test_empty_gallery(self):
+        self.assertEqual(GalleryMatcher().search(np.ones(32)), [])
+        self.assertEqual(len(GalleryMatcher.from_pairs([])), 0)
+
+    def test_labels_must_match_vectors(self):
+        with self.assertRaises(ValueError):
+            GalleryMatcher(self.labels[:10], self.vectors)
+
+
+class IVFMatcherTests(SimpleTestCase):
+    def setUp(self):
+        # Clustered templates, like the faces of the same people
+        self.rng = np.random.default_rng(0)
+        centers = self.rng.standard_normal((40, 32))
+        self.vectors = (centers[self.rng.integers(0, 40, 2000)] + 0.3 * self.rng.standard_normal((2000, 32))).astype(np.float32)
+        self.labels = np.array([f"user{i}" for i in range(2000)])
+        self.probes = centers[self.rng.integers(0, 40, 100)] + 0.3 * self.rng.standard_normal((100, 32))
+        self.exact = GalleryMatcher(self.labels, self.vectors)
+        self.dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.dir, "index.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def recall(self, matcher, k=10):
+        """
+        Fraction of the exact top-k found by the matcher.
+        """
+        found = 0
+        for probe in self.probes:
+            expected = {label for label, _ in self.exact.search(probe, k)}
+            found += len(expected & {label for label, _ in matcher.search(probe, k)})
+        return found / (k * len(self.probes))
+
+    def test_recall(self):
+        self.assertGreaterEqual(self.recall(IVFMatcher(self.labels, self.vectors, n_lists=32, n_probe=8)), 0.9)
+
+    def test_probing_every_list_is_exact(self):
+        self.assertEqual(self.recall(IVFMatcher(self.labels, self.vectors, n_lists=16, n_probe=16)), 1.)
+
+    def test_saved_index_is_reused(self):
+        ivf = IVFMatcher.from_gallery(self.exact, self.index_path, n_lists=16, n_probe=4)
+        loaded = IVFMatcher(n_lists=16, n_probe=4)
+        GalleryMatcher.set_normalized(loaded, self.exact.labels, self.exact.matrix)
+        self.assertTrue(loaded.load_index(self.index_path))
+        np.testing.assert_array_equal(loaded.assignments, ivf.assignments)
+        for probe in self.probes[:10]:
+            self.assertEqual(loaded.search(probe, 5), ivf.search(probe, 5))
+
+    def test_index_of_another_gallery_is_rejected(self):
+        IVFMatcher.from_gallery(self.exact, self.index_path, n_lists=16)
+        smaller = IVFMatcher(n_lists=16)
+        GalleryMatcher.set_normalized(smaller, self.labels[:1000], self.exact.matrix[:1000])
+        self.assertFalse(smaller.load_index(self.index_path))
+        other_dim = IVFMatcher(n_lists=16)
+        GalleryMatcher.set_normalized(other_dim, self.labels, GalleryMatcher.normalize(self.rng.standard_normal((2000, 16))))
+        self.assertFalse(other_dim.load_index(self.index_path))
+        self.assertFalse(IVFMatcher().load_index(os.path.join(self.dir, "missing.npz")))
+
+    def test_index_of_a_gallery_with_the_same_shape_is_rejected(self):
+        IVFMatcher.from_gallery(self.exact, self.index_path, n_lists=16)
+        relabeled = IVFMatcher(n_lists=16)
+        GalleryMatcher.set_normalized(relabeled, self.labels[::-1], self.exact.matrix)
+        self.assertFalse(relabeled.load_index(self.index_path))
+        changed = IVFMatcher(n_lists=16)
+        GalleryMatcher.set_normalized(changed, self.labels, GalleryMatcher.normalize(self.rng.standard_normal((2000, 32))))
+        self.assertFalse(changed.load_index(self.index_path))
+        self.assertEqual([name for name in os.listdir(self.dir) if name.endswith(".tmp")], [])
+
+    def test_index_is_rebuilt_for_a_new_gallery(self):
+        IVFMatcher.from_gallery(self.exact, self.index_path, n_lists=16)
+        smaller = GalleryMatcher(self.labels[:1000], self.vectors[:1000])
+        ivf = IVFMatcher.from_gallery(smaller, self.index_path, n_lists=16)
+        self.assertEqual(len(ivf.assignments), 1000)
+        reloaded = IVFMatcher(n_lists=16)
+        GalleryMatcher.set_normalized(reloaded, smaller.labels, smaller.matrix)
+        self.assertTrue(reloaded.load_index(self.index_path)) # Saved again for the new gallery
+
+
+class NearestClassMeanTests(SimpleTestCase):
+    def setUp(self):
+        self.X = np.array([[0., 0.], [0.2, 0.], [1., 1.], [1., 1.2], [3., 0.]])
+        self.y = np.array(["ada", "ada", "bob", "bob", "eve"])
+
+    def test_means_and_prediction(self):
+        head = NearestClassMean().fit(self.X, self.y)
+        self.assertEqual(head.classes_.tolist(), ["ada", "bob", "eve"])
+        np.testing.assert_allclose(head.means, [[0.1, 0.], [1., 1.1], [3., 0.]])
+        self.assertEqual(head.predict([[0.1, 0.1], [0.9, 1.], [2.9, 0.1]]).tolist(), ["ada", "bob", "eve"])
+
+    def test_partial_fit_matches_fit(self):
+        head = NearestClassMean().fit(self.X[:3], self.y[:3])
+        head.partial_fit(self.X[3:], self.y[3:])
+        refit = NearestClassMean().fit(self.X, self.y)
+        self.assertEqual(head.classes_.tolist(), refit.classes_.tolist())
+        np.testing.assert_allclose(head.means, refit.means)
+
+    def test_far_faces_are_rejected(self):
+        head = NearestClassMean(reject_distance=0.6).fit(self.X, self.y)
+        near, far = head.predict_proba([[0.1, 0.], [10., 10.]])
+        self.assertEqual(near.shape, (3,))
+        self.assertGreater(near[0], 0.9)
+        self.assertLess(far.sum(), 0.01) # Almost all the probability goes to the dropped "nobody" class
+
+
+class FaceTrackerTests(SimpleTestCase):
+    def setUp(self):
+        self.gray = np.random.default_rng(0).integers(0, 255, (240, 320), dtype=np.uint8)
+        self.tracker = FaceTracker()
+
+    def test_iou(self):
+        self.assertEqual(iou((0, 0, 10, 10), (0, 0, 10, 10)), 1.)
+        self.assertEqual(iou((0, 0, 10, 10), (20, 20, 10, 10)), 0.)
+        self.assertAlmostEqual(iou((0, 0, 10, 10), (5, 0, 10, 10)), 50 / 150)
+
+    def test_overlapping_detection_keeps_the_track(self):
+        self.tracker.match_detections(self.gray, [(10, 10, 50, 50)])
+        track = self.tracker.tracks[0]
+        track.label = "42"
+        track.confidence = 0.2
+        self.tracker.match_detections(self.gray, [(15, 12, 50, 50)])
+        self.assertEqual(len(self.tracker.tracks), 1)
+        self.assertIs(self.tracker.tracks[0], track)
+        self.assertEqual((track.box, track.label, track.confidence), ((15, 12, 50, 50), "42", 1.))
+        self.assertEqual(track.template.shape, (50, 50))
+
+    def test_new_and_lost_faces(self):
+        self.tracker.match_detections(self.gray, [(10, 10, 50, 50), (200, 100, 60, 60)])
+        first, second = self.tracker.tracks
+        self.tracker.match_detections(self.gray, [(205, 100, 60, 60), (100, 150, 40, 40)])
+        self.assertIs(self.tracker.tracks[0], second)
+        self.assertNotIn(first, self.tracker.tracks) # Not detected anymore
+        new = self.tracker.tracks[1]
+        self.assertNotIn(new.id, (first.id, second.id))
+        self.assertIsNone(new.label)
+
+    def test_a_track_matches_one_detection(self):
+        self.tracker.match_detections(self.gray, [(10, 10, 50, 50)])
+        track = self.tracker.tracks[0]
+        self.tracker.match_detections(self.gray, [(12, 10, 50, 50), (10, 12, 50, 50)])
+        self.assertIs(self.tracker.tracks[0], track)
+        self.assertIsNot(self.tracker.tracks[1], track)
+
+    def test_find(self):
+        self.tracker.match_detections(self.gray, [(10, 10, 50, 50)])
+        self.assertIs(self.tracker.find((12, 12, 50, 50)), self.tracker.tracks[0])
+        self.assertIsNone(self.tracker.find((150, 150, 50, 50)))
+
+
+class VoteAggregatorTests(SimpleTestCase):
+    def test_two_confident_results_decide(self):
+        votes = VoteAggregator()
+        votes.add("42", 0.9)
+        self.assertIsNone(votes.identity()) # 0.9 < THRESHOLD
+        votes.add("42", 0.9)
+        label, score = votes.identity()
+        self.assertEqual(label, "42")
+        self.assertAlmostEqual(score, 0.9 + 0.9 * 0.8)
+        self.assertEqual(votes.decided_after, 2)
+
+    def test_older_results_decay(self):
+        votes = VoteAggregator()
+        votes.add("42", 1.)
+        votes.add("7", 1.)
+        votes.add("7", 1.)
+        scores = votes.scores()
+        self.assertAlmostEqual(scores["7"], 1. + 0.8)
+        self.assertAlmostEqual(scores["42"], 0.8 ** 2)
+
+    def test_margin_over_the_runner_up(self):
+        votes = VoteAggregator(decay=1., margin=1.5) # The scores of alternating results never differ by more than 1
+        for label in ["42", "7", "42", "7", "42", "7"]:
+            votes.add(label, 1.)
+        self.assertGreaterEqual(max(votes.scores().values()), votes.THRESHOLD)
+        self.assertIsNone(votes.identity()) # Too close to each other
+        self.assertIsNone(votes.decided_after)
+
+    def test_unknown_is_decided_as_fast_as_a_known_face(self):
+        votes = VoteAggregator()
+        votes.add("Unknown", 0.99)
+        self.assertIsNone(votes.identity()) # A single result is never enough
+        votes.add("unknown", None)
+        label, score = votes.identity()
+        self.assertEqual(label, "unknown")
+        self.assertAlmostEqual(score, 0.5 + 0.5 * 0.8)
+        self.assertEqual(votes.decided_after, 2)
+
+    def test_unknown_results_hardly_outvote_a_known_label(self):
+        votes = VoteAggregator()
+        for _ in range(3):
+            votes.add("42", 0.9)
+        votes.add("unknown", None)
+        votes.add("unknown", None)
+        self.assertGreater(votes.scores()["42"], votes.scores()["unknown"])
+        self.assertIsNone(votes.identity()) # The track keeps its identity until one of them is clear
+
+    def test_unknown_path_latency(self):
+        _, known = stream_session("42", frames=30)
+        _, unknown = stream_session("Unknown", frames=30)
+        self.assertEqual(unknown[0], known[0]) # First reported at the same frame
+
+    def test_missing_faces_and_old_results_are_ignored(self):
+        votes = VoteAggregator(window=3)
+        votes.add(None, None)
+        self.assertEqual(votes.count, 0)
+        for label in ["42", "42", "42", "7", "7", "7"]:
+            votes.add(label, 1.)
+        self.assertEqual(set(votes.scores()), {"7"}) # Out of the window
+        self.assertEqual(votes.identity()[0], "7")
+        self.assertEqual(votes.decided_after, 2) # Still the first decision
+
+
+class UserCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.loads = 0
+        self.now = 1000.
+        patcher = mock.patch("api.utils.user_info.UserCache.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load(self, value="profile"):
+        def load():
+            self.loads += 1
+            return value
+        return load
+
+    def test_hit_until_expired(self):
+        cache = UserCache(ttl=10.)
+        self.assertEqual(cache.get(42, "profile", self.load()), "profile")
+        self.now += 9.
+        self.assertEqual(cache.get("42", "profile", self.load()), "profile") # Same user, as a string
+        self.assertEqual(self.loads, 1)
+        self.now += 2.
+        cache.get(42, "profile", self.load())
+        self.assertEqual(self.loads, 2)
+        stats = cache.stats()
+        self.assertEqual((stats["HITS"], stats["MISSES"], stats["EXPIRATIONS"]), (1, 2, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = UserCache(max_size=2)
+        cache.get(1, "profile", self.load())
+        cache.get(2, "profile", self.load())
+        cache.get(1, "profile", self.load()) # 2 is now the least recently used
+        cache.get(3, "profile", self.load())
+        self.assertEqual(self.loads, 3)
+        cache.get(1, "profile", self.load())
+        self.assertEqual(self.loads, 3)
+        cache.get(2, "profile", self.load())
+        self.assertEqual(self.loads, 4)
+        self.assertEqual(cache.stats()["EVICTIONS"], 2)
+
+    def test_invalidate_drops_every_kind_of_the_user(self):
+        cache = UserCache()
+        cache.get(1, "profile", self.load())
+        cache.get(1, "picture", self.load())
+        cache.get(2, "profile", self.load())
+        cache.invalidate("1")
+        cache.get(1, "profile", self.load())
+        cache.get(1, "picture", self.load())
+        cache.get(2, "profile", self.load())
+        self.assertEqual(self.loads, 5)
+
+    def test_errors_are_not_cached(self):
+        cache = UserCache()
+        error = ValueError("user not found")
+        self.assertIs(cache.get(1, "profile", self.load(error)), error)
+        cache.get(1, "profile", self.load(error))
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(cache.stats()["SIZE"], 0)
+
+
+class PhotoStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.samples_root = os.path.join(self.dir, "samples")
+        os.makedirs(os.path.join(self.samples_root, "1"))
+        for name in ["image_0.jpg", "notes.txt"]:
+            with open(os.path.join(self.samples_root, "1", name), "wb") as f:
+                f.write(b"data")
+        with open(os.path.join(self.dir, "secret.jpg"), "wb") as f:
+            f.write(b"secret")
+        self.store = PhotoStore(self.samples_root, os.path.join(self.dir, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_photo_of_the_user(self):
+        self.assertEqual(self.store.source_path(1, "image_0.jpg"), os.path.join(self.samples_root, "1", "image_0.jpg"))
+        self.assertEqual(self.store.list(1), ["image_0.jpg"])
+        self.assertIsNone(self.store.list(2))
+
+    def test_path_traversal_is_rejected(self):
+        for name in ["../../secret.jpg", "../1/image_0.jpg", os.path.join(self.dir, "secret.jpg"), "sub/image_0.jpg"]:
+            self.assertIsNone(self.store.source_path(1, name), name)
+            self.assertIsNone(self.store.get(1, name), name)
+
+    def test_unsupported_or_missing_photos(self):
+        self.assertIsNone(self.store.source_path(1, "notes.txt"))
+        self.assertIsNone(self.store.source_path(1, "image_1.jpg"))
+        self.assertIsNone(self.store.source_path(2, "image_0.jpg"))
+
+
+class DeletePhotoTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.samples_root = os.path.join(self.dir, "samples")
+        os.makedirs(os.path.join(self.samples_root, "1"))
+        self.photo = os.path.join(self.samples_root, "1", "image_0.jpg")
+        with open(self.photo, "wb") as f:
+            f.write(b"data")
+        self.secret = os.path.join(self.samples_root, "secret.jpg")
+        with open(self.secret, "wb") as f:
+            f.write(b"secret")
+        self.scheduler = mock.Mock()
+        self.patches = [
+            mock.patch.object(views, "photo_store", PhotoStore(self.samples_root, os.path.join(self.dir, "cache"))),
+            mock.patch.object(views, "training_scheduler", self.scheduler),
+            mock.patch.object(views.user_info, "refresh_user"),
+        ]
+        for patch in self.patches: patch.start()
+
+    def tearDown(self):
+        for patch in self.patches: patch.stop()
+        shutil.rmtree(self.dir)
+
+    def delete(self, query):
+        return views.delete_photo(RequestFactory().delete("/api/delete_photo", QUERY_STRING=query))
+
+    def test_photo_is_deleted(self):
+        response = self.delete("id=1&name=image_0.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(self.photo))
+        self.scheduler.remove_samples.assert_called_once_with([self.photo])
+        views.user_info.refresh_user.assert_called_once_with("1")
+
+    def test_path_traversal_is_rejected(self):
+        for name in ["../secret.jpg", "..%2Fsecret.jpg", self.secret, ".."]:
+            response = self.delete(f"id=1&name={name}")
+            self.assertEqual(response.status_code, 400, name)
+        self.assertTrue(os.path.exists(self.secret))
+        self.scheduler.remove_samples.assert_not_called()
+
+    def test_missing_photo(self):
+        self.assertEqual(self.delete("id=1&name=image_1.jpg").status_code, 404)
+        self.assertEqual(self.delete("id=2&name=image_0.jpg").status_code, 404)
+        self.assertTrue(os.path.exists(self.photo))
+        self.scheduler.remove_samples.assert_not_called()
+
+    def test_samples_are_removed_from_the_model_in_background(self):
+        classifier = mock.Mock()
+        removed = threading.Event()
+        classifier.remove_samples.side_effect = lambda paths: removed.set()
+        scheduler = TrainingScheduler(classifier=classifier)
+        scheduler.remove_samples([self.photo])
+        self.assertTrue(removed.wait(5))
+        classifier.remove_samples.assert_called_once_with([self.photo])
+
+
+class SampleCounterTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.samples_root = os.path.join(self.dir, "samples")
+        os.makedirs(os.path.join(self.samples_root, "1"))
+        for name in ["image_3.jpeg", "image_7_processed.jpg", "notes.txt"]:
+            open(os.path.join(self.samples_root, "1", name), "wb").close()
+        self.counters = os.path.join(self.dir, "counters")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_counter_starts_after_the_existing_samples(self):
+        counter = SampleCounter(self.counters, self.samples_root)
+        self.assertEqual([counter.next(1), counter.next(1)], [8, 9])
+        self.assertEqual(counter.next(2), 0)
+
+    def test_counter_is_kept_on_disk(self):
+        SampleCounter(self.counters, self.samples_root).next(1)
+        self.assertEqual(SampleCounter(self.counters, self.samples_root).next(1), 9)
+
+    def test_indices_are_unique_across_threads(self):
+        counter = SampleCounter(self.counters, self.samples_root)
+        indices = []
+        threads = [threading.Thread(target=lambda: indices.extend(counter.next(1) for _ in range(50))) for _ in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(sorted(indices), list(range(8, 208)))
+
+
+class SampleWriterTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.samples_root = os.path.join(self.dir, "samples")
+        self.tmp_root = os.path.join(self.dir, "tmp")
+        self.counter = SampleCounter(os.path.join(self.dir, "counters"), self.samples_root)
+        self.saved = []
+        self.writer = SampleWriter(1, self.counter, self.samples_root, self.tmp_root, on_sample=self.saved.append)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_photo_is_written_in_chunks(self):
+        self.writer.open("png")
+        for chunk in [b"ab", b"cd"]:
+            self.writer.write(chunk)
+        path = self.writer.close()
+        self.assertEqual(path, os.path.join(self.samples_root, "1", "image_0.png"))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"abcd")
+        self.assertEqual(self.saved, [path])
+        self.assertEqual(os.listdir(self.tmp_root), [])
+
+    def test_empty_or_discarded_photos_are_not_saved(self):
+        self.writer.open()
+        self.assertIsNone(self.writer.close())
+        self.writer.open()
+        self.writer.write(b"data")
+        self.writer.discard()
+        self.assertEqual(self.writer.saved, [])
+        self.assertEqual(os.listdir(os.path.join(self.samples_root, "1")), [])
+        self.assertEqual(os.listdir(self.tmp_root), [])
+
+    def test_name_taken_in_the_meantime_is_skipped(self):
+        open(os.path.join(self.samples_root, "1", "image_0.jpeg"), "wb").close() # Saved after the counter was initialized
+        self.counter.save(1, 0)
+        self.assertEqual(self.writer.save(b"data"), os.path.join(self.samples_root, "1", "image_1.jpeg"))
+
+    def test_saved_samples_and_their_crops_are_removed(self):
+        path = self.writer.save(b"data")
+        os.rename(path, os.path.join(self.samples_root, "1", "image_0_processed.jpg"))
+        self.writer.save(b"data")
+        self.writer.remove_saved()
+        self.assertEqual(os.listdir(os.path.join(self.samples_root, "1")), [])
+
+
+class LBPHFTrainingTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.classifier = LBPHF()
+        self.classifier.image_dir = os.path.join(self.dir, "samples")
+        self.classifier.models_root = os.path.join(self.dir, "models")
+        self.classifier.labels_root = os.path.join(self.dir, "labels")
+        self.classifier.create_necessary_folders()
+        self.random = np.random.default_rng(0)
+        self.rebuild = mock.patch.object(self.classifier, "rebuild", wraps=self.classifier.rebuild).start()
+        # No face is detected, so each sample adds one histogram (the whole image)
+        mock.patch.object(self.classifier, "face_cascade", return_value=mock.Mock(**{"detectMultiScale.return_value": ()})).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.dir)
+
+    def add_sample(self, user, name):
+        path = os.path.join(self.classifier.image_dir, user, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, self.random.integers(0, 256, (64, 64), dtype=np.uint8))
+        return path
+
+    def histograms(self):
+        _, model = self.classifier.current_model()
+        return len(model["recognizer"].getHistograms())
+
+    def test_update_remove_rebuild(self):
+        for user in ["1", "2"]:
+            for i in range(2): self.add_sample(user, f"image_{i}_processed.jpg")
+        self.classifier.train()
+        self.assertEqual(self.rebuild.call_count, 1) # No model yet
+        self.assertEqual(self.histograms(), 4)
+        self.assertEqual(sorted(self.classifier.current_model()[1]["labels"].values()), ["1", "2"])
+
+        # A new sample only updates the model
+        self.add_sample("3", "image_0_processed.jpg")
+        self.classifier.train()
+        self.assertEqual(self.rebuild.call_count, 1)
+        self.assertEqual(self.histograms(), 5)
+        self.assertEqual(len(self.classifier.load_manifest()), 5)
+        self.assertIn("3", self.classifier.current_model()[1]["labels"].values())
+
+        # Nothing new, nothing to do
+        version = self.classifier.latest_version()
+        self.classifier.train()
+        self.assertEqual(self.classifier.latest_version(), version)
+
+        # A removed sample can't be taken out of the model, so it's rebuilt without it
+        label_ids = self.classifier.load_label_ids()
+        os.remove(os.path.join(self.classifier.image_dir, "1", "image_0_processed.jpg"))
+        self.classifier.train()
+        self.assertEqual(self.rebuild.call_count, 2)
+        self.assertEqual(self.histograms(), 4)
+        self.assertNotIn(os.path.join("1", "image_0_processed.jpg"), self.classifier.load_manifest())
+        self.assertEqual(self.classifier.load_label_ids(), label_ids) # The ids don't change
+
+    def test_histograms_outside_the_manifest_are_compacted(self):
+        self.add_sample("1", "image_0_processed.jpg")
+        self.classifier.train()
+        os.remove(os.path.join(self.classifier.models_root, self.classifier.manifest_file_name)) # e.g. a model trained before the manifest
+        self.classifier.save_manifest({})
+        self.add_sample("1", "image_1_processed.jpg")
+        self.classifier.train()
+        self.assertEqual(self.rebuild.call_count, 2)
+        self.assertEqual(self.histograms(), 2)
+
+
+class TrainingSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.classifier = mock.Mock()
+        self.release = threading.Event()
+        self.training = threading.Event()
+        self.classifier.train.side_effect = lambda: (self.training.set(), self.release.wait(5))
+        self.trained = []
+        self.scheduler = TrainingScheduler(classifier=self.classifier, coalesce_delay=0.1, max_history=3, on_trained=self.trained.append)
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_enrollments_are_coalesced_into_one_job(self):
+        jobs = [self.scheduler.submit(f"samples/{id}") for id in [2, 1, 2]]
+        self.assertEqual({job.id for job in jobs}, {1})
+        self.assertEqual(self.scheduler.get(1)["STATE"], "queued")
+        self.assertEqual(self.scheduler.get(1)["ENROLLMENTS"], 3)
+        self.release.set()
+        self.assertEqual(jobs[0].future.result(5), "done")
+        self.classifier.preprocess_images.assert_called_once_with(dirs=["samples/1", "samples/2"])
+        self.assertEqual(self.classifier.train.call_count, 1)
+        self.assertEqual(self.trained, [["samples/1", "samples/2"]])
+
+    def test_enrollments_during_a_run_go_into_a_new_job(self):
+        first = self.scheduler.submit("samples/1")
+        self.assertTrue(self.training.wait(5))
+        self.assertEqual(self.scheduler.get(first.id)["STATE"], "running")
+        second = self.scheduler.submit("samples/2")
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(self.scheduler.latest()["ID"], second.id)
+        self.release.set()
+        self.assertEqual(second.future.result(5), "done")
+        self.assertEqual(self.trained, [["samples/1"], ["samples/2"]])
+
+    def test_job_starts_after_its_futures(self):
+        preprocessing = Future()
+        job = self.scheduler.submit("samples/1", after=[preprocessing])
+        time.sleep(0.3)
+        self.assertEqual(self.scheduler.get(job.id)["STATE"], "queued")
+        self.classifier.train.assert_not_called()
+        preprocessing.set_exception(RuntimeError("no face")) # The failed preprocessing doesn't stop the training
+        self.release.set()
+        self.assertEqual(job.future.result(5), "done")
+
+    def test_failed_job(self):
+        self.classifier.train.side_effect = RuntimeError("broken model")
+        job = self.scheduler.submit()
+        self.assertEqual(job.future.result(5), "failed")
+        status = self.scheduler.get(job.id)
+        self.assertEqual(status["ERROR"], "broken model")
+        self.assertIsNotNone(status["FINISHED_AT"])
+        self.assertEqual(self.trained, [])
+        self.classifier.preprocess_images.assert_called_once_with(dirs=None) # Every directory with new images
+
+    def test_status_history_is_bounded(self):
+        self.assertIsNone(self.scheduler.latest())
+        self.release.set()
+        for _ in range(5):
+            self.scheduler.submit().future.result(5)
+        self.assertIsNone(self.scheduler.get(1))
+        self.assertEqual([self.scheduler.get(id)["STATE"] for id in [3, 4, 5]], ["done"] * 3)
+        self.assertEqual(self.scheduler.latest()["ID"], 5)
+
+
+class PreprocessingOrderTests(SimpleTestCase):
+    def setUp(self):
+        self.classifier = mock.Mock()
+        self.training = threading.Event()
+        self.release = threading.Event()
+        self.classifier.train.side_effect = lambda: (self.training.set(), self.release.wait(5))
+        self.scheduler = TrainingScheduler(classifier=self.classifier, coalesce_delay=0.)
+        self.preprocessor = SamplePreprocessor()
+        self.preprocessor.preprocess = mock.Mock(side_effect=lambda path, size, after: (wait(after), "processed")[1])
+
+    def tearDown(self):
+        self.release.set()
+
+    def submit(self, path):
+        return self.scheduler.order_preprocessing(lambda after: self.preprocessor.submit(path, (10, 10), after))
+
+    def test_samples_wait_for_the_running_job(self):
+        job = self.scheduler.submit()
+        self.assertTrue(self.training.wait(5))
+        future = self.submit("image_0.jpeg")
+        time.sleep(0.05)
+        self.assertFalse(future.done())
+        self.release.set()
+        self.assertEqual(future.result(5), "processed")
+        self.assertEqual(job.future.result(5), "done")
+
+    def test_job_waits_for_the_samples_in_progress(self):
+        started = threading.Event()
+        self.preprocessor.preprocess.side_effect = lambda path, size, after: (started.set(), self.release.wait(5), "processed")[2]
+        future = self.submit("image_0.jpeg")
+        self.assertTrue(started.wait(5))
+        job = self.scheduler.submit()
+        time.sleep(0.05)
+        self.classifier.preprocess_images.assert_not_called()
+        self.release.set()
+        self.assertEqual(job.future.result(5), "done")
+        self.assertTrue(future.done())
+
+
+@override_settings(DATA_UPLOAD_MAX_NUMBER_FILES=2)
+class UploadEnrollmentTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.samples_root = os.path.join(self.dir, "samples")
+        self.scheduler = mock.Mock()
+        self.scheduler.order_preprocessing.side_effect = lambda submit: submit([])
+        self.scheduler.submit.return_value.id = 1
+        classifier = mock.Mock(image_width=10, image_height=10)
+        self.patches = [
+            mock.patch.object(views, "SampleWriter", lambda id, **options: SampleWriter(id, samples_root=self.samples_root, tmp_root=os.path.join(self.dir, "tmp"), **options)),
+            mock.patch.object(views, "sample_counter", SampleCounter(os.path.join(self.dir, "counters"), self.samples_root)),
+            mock.patch.object(views, "training_scheduler", self.scheduler),
+            mock.patch.object(views, "get_classifier", lambda: classifier),
+            mock.patch.object(views.user_info, "invalidate_user"),
+        ]
+        for patch in self.patches: patch.start()
+
+    def tearDown(self):
+        views.sample_preprocessor.then(lambda: None).result(5)
+        for patch in self.patches: patch.stop()
+        shutil.rmtree(self.dir)
+
+    def upload(self, files):
+        photos = [SimpleUploadedFile(f"photo_{i}.jpg", b"not an image", content_type="image/jpeg") for i in range(files)]
+        return views.upload_photo_enrollment(RequestFactory().post("/api/upload_photo_enrollment?id=1", {"photo": photos}))
+
+    def samples(self):
+        views.sample_preprocessor.then(lambda: None).result(5) # The removal runs after the preprocessing
+        return sorted(os.listdir(os.path.join(self.samples_root, "1")))
+
+    def test_photos_are_saved(self):
+        response = self.upload(2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.samples(), ["image_0.jpeg", "image_1.jpeg"]) # Unreadable, left to the training
+        self.scheduler.submit.assert_called_once()
+        self.assertEqual(len(self.scheduler.submit.call_args.kwargs["after"]), 2)
+
+    def test_too_many_files_are_rejected(self):
+        with mock.patch.object(views.sample_preprocessor, "preprocess", return_value="processed"):
+            response = self.upload(3)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(self.samples(), [])
+        self.scheduler.submit.assert_not_called()
+
+    def test_malformed_body_is_rejected(self):
+        request = RequestFactory().post("/api/upload_photo_enrollment?id=1", b"--x\r\nnot a part", content_type="multipart/form-data; boundary=y")
+        self.assertEqual(views.upload_photo_enrollment(request).status_code, 400)
+        self.scheduler.submit.assert_not_called()
+
+
+class FeatureTableTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def table(self):
+        return FeatureTable(self.dir, "VGG-Face", {"detector_backend": "opencv"})
+
+    def test_saved_features_are_read_by_another_instance(self):
+        writer = self.table()
+        writer.put("a", [1., 2., 3.])
+        writer.put("no-face", None)
+        self.assertNotIn("a", self.table()) # Not saved yet
+        writer.save()
+        reader = self.table()
+        np.testing.assert_array_equal(reader.get("a"), [1., 2., 3.])
+        self.assertIn("no-face", reader)
+        self.assertIsNone(reader.get("no-face"))
+        self.assertIsNone(reader.get("missing"))
+        self.assertEqual(len(reader), 2)
+
+    def test_both_instances_append(self):
+        first, second = self.table(), self.table()
+        first.put("a", [1., 1.])
+        first.save()
+        second.put("b", [2., 2.])
+        second.save() # Reloads the rows saved by first before appending
+        first.reload()
+        for table in (first, second, self.table()):
+            np.testing.assert_array_equal(table.get("a"), [1., 1.])
+            np.testing.assert_array_equal(table.get("b"), [2., 2.])
+
+    def test_compute_only_missing_features(self):
+        table = self.table()
+        computed = []
+        compute = lambda: computed.append(1) or [0.5, 0.5]
+        table.get_or_compute("a", compute)
+        table.save()
+        self.table().get_or_compute("a", compute)
+        self.assertEqual(len(computed), 1)
+
+    def test_dimension_mismatch(self):
+        table = self.table()
+        table.put("a", [1., 1.])
+        table.save()
+        table.put("b", [1., 1., 1.])
+        with self.assertRaises(ValueError):
+            table.save()
+
+    def test_prune(self):
+        writer, reader = self.table(), self.table()
+        for i in range(5):
+            writer.put(str(i), [float(i)] * 4)
+        writer.put("no-face", None)
+        writer.prune([str(i) for i in range(5)] + ["no-face"], owner="SVC")
+        reader.reload()
+        writer.put("new", [9.] * 4)
+        writer.prune(["1", "3", "no-face", "new"], owner="SVC")
+        self.assertEqual(set(writer.rows), {"1", "3", "no-face", "new"})
+        self.assertEqual(writer.count, 3)
+        reader.reload()
+        for table in (writer, reader, self.table()):
+            np.testing.assert_array_equal(table.get("3"), [3.] * 4)
+            np.testing.assert_array_equal(table.get("new"), [9.] * 4)
+            self.assertIn("no-face", table)
+            self.assertNotIn("0", table)
+        self.assertEqual(len([name for name in os.listdir(self.dir) if name.startswith("vectors")]), 1) # The old rows are removed
+
+    def test_prune_keeps_the_features_of_the_other_consumers(self):
+        training, evaluation = self.table(), self.table()
+        training.put("sample", [1.] * 4)
+        training.prune(["sample"], owner="SVC")
+        evaluation.put("lfw", [2.] * 4) # Never declared by an owner
+        evaluation.put("shared", [3.] * 4)
+        evaluation.prune(["shared"], owner="other")
+        training.put("new-sample", [4.] * 4)
+        training.prune(["new-sample", "shared"], owner="SVC") # "sample" was deleted
+        training.prune(["new-sample"], owner="SVC") # "shared" is still used by the other owner
+        for table in (training, self.table()):
+            self.assertNotIn("sample", table)
+            np.testing.assert_array_equal(table.get("lfw"), [2.] * 4)
+            np.testing.assert_array_equal(table.get("shared"), [3.] * 4)
+            np.testing.assert_array_equal(table.get("new-sample"), [4.] * 4)
+
+
+class GalleryFileTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "gallery.bin")
+        self.vectors = np.random.default_rng(0).standard_normal((5, 7)).astype(np.float32)
+        self.labels = ["1", "1", "2", "3", "3"]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        GalleryFile(self.path).write(self.labels, self.vectors, columns={"source": ["a", "b", "c", "d", "e"]})
+        labels, matrix, columns = GalleryFile(self.path).read()
+        self.assertEqual(labels.tolist(), self.labels)
+        self.assertIsInstance(matrix, np.memmap)
+        np.testing.assert_array_equal(matrix, self.vectors)
+        self.assertEqual(columns, {"source": ["a", "b", "c", "d", "e"]})
+
+    def test_empty_gallery(self):
+        GalleryFile(self.path).write([], [])
+        labels, matrix, columns = GalleryFile(self.path).read()
+        self.assertEqual((len(labels), len(matrix), columns), (0, 0, {}))
+
+    def test_each_save_is_a_new_version(self):
+        gallery = GalleryFile(self.path)
+        self.assertFalse(gallery.exists())
+        for i in range(4):
+            gallery.write(self.labels, self.vectors + i)
+            _, matrix, _ = gallery.read()
+            np.testing.assert_array_equal(matrix, self.vectors + i)
+        self.assertTrue(gallery.exists())
+        self.assertEqual(len(gallery.versions()), 1 + GalleryFile.KEEP_VERSIONS)
+        self.assertEqual(gallery.current_path(), gallery.versions()[-1])
+
+    def test_unversioned_file_is_read_and_replaced(self):
+        gallery = GalleryFile(self.path)
+        gallery.write(self.labels, self.vectors)
+        os.replace(gallery.current_path(), self.path) # As saved before the versions
+        os.remove(gallery.pointer_path)
+        np.testing.assert_array_equal(gallery.read()[1], self.vectors)
+        gallery.write(self.labels[:2], self.vectors[:2])
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(gallery.read()[0].tolist(), self.labels[:2])
+
+    def test_newer_versions_and_other_files_are_rejected(self):
+        gallery = GalleryFile(self.path)
+        gallery.write(self.labels, self.vectors)
+        with open(gallery.current_path(), "r+b") as f:
+            f.seek(8)
+            f.write((GalleryFile.VERSION + 1).to_bytes(4, "little"))
+        with self.assertRaises(ValueError):
+            gallery.read()
+        with open(gallery.current_path(), "r+b") as f:
+            f.write(b"NOTAGAL\0")
+        with self.assertRaises(ValueError):
+            gallery.read()
+
+
+class BatchClassifier:
+    """
+    Classifier of the inference server tests: the label of a frame is its first pixel, and a frame which isn't an image fails.
+    """
+    def __init__(self) -> None:
+        self.batches = []
+
+    def current_model(self):
+        return 1, {"version": 1}
+
+    def identify(self, frame, model=None, detection=None):
+        if not isinstance(frame, np.ndarray):
+            raise ValueError("not an image")
+        return list(detection.faces), str(frame[0, 0]), model["version"]
+
+    def identify_batch(self, detections, model=None):
+        self.batches.append(len(detections))
+        return [self.identify(detection.frame, model, detection) for detection in detections]
+
+
+class InferenceServerBatchTests(SimpleTestCase):
+    def setUp(self):
+        self.classifier = BatchClassifier()
+        self.server = InferenceServer(self.classifier, "127.0.0.1:0", "secret")
+        self.replies = {}
+
+    def reply(self, request_id, ok, result):
+        self.replies[request_id] = (ok, result)
+
+    def request(self, request_id, frame, faces=((0, 0, 1, 1),)):
+        return (self.reply, request_id, "identify", (frame, faces))
+
+    def test_requests_are_identified_in_one_batch(self):
+        self.server.run_batch([self.request(i, np.full((2, 2), i)) for i in range(3)] + [(self.reply, 3, "config", ())])
+        self.assertEqual(self.classifier.batches, [3])
+        for i in range(3):
+            self.assertEqual(self.replies[i], (True, ([(0, 0, 1, 1)], str(i), 1)))
+        self.assertFalse(self.replies[3][0]) # config isn't an attribute of the fake classifier
+
+    def test_bad_frame_only_fails_its_request(self):
+        self.server.run_batch([self.request(0, np.zeros((2, 2))), self.request(1, "not a frame"), self.request(2, np.ones((2, 2)))])
+        self.assertEqual(self.replies[0][:1] + self.replies[2][:1], (True, True))
+        self.assertEqual(self.replies[2][1][1], "1.0")
+        ok, error = self.replies[1]
+        self.assertFalse(ok)
+        self.assertIn("not an image", error)
+
+    def test_malformed_request_only_fails_itself(self):
+        self.server.run_batch([self.request(0, np.zeros((2, 2))), self.request(1, np.zeros((2, 2)), faces=None)])
+        self.assertTrue(self.replies[0][0])
+        self.assertFalse(self.replies[1][0])
+        self.assertEqual(self.classifier.batches, [1])
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def test_versions(self):
+        registry = ModelRegistry(max_versions=2)
+        self.assertIsNone(registry.get())
+        self.assertEqual(registry.publish("a"), 1)
+        self.assertEqual(registry.publish("b"), 2)
+        self.assertEqual(registry.publish("c"), 3)
+        self.assertEqual(registry.get(), (3, "c"))
+        self.assertEqual(registry.get(2), (2, "b"))
+        self.assertIsNone(registry.get(1)) # Beyond max_versions
+
+    def test_first_model_is_loaded_once(self):
+        registry = ModelRegistry()
+        loads = []
+        loader = lambda: loads.append(1) or "model"
+        self.assertEqual(registry.get_or_load(loader, lambda: ("saved",)), (1, "model"))
+        self.assertEqual(registry.get_or_load(loader), (1, "model"))
+        self.assertEqual(len(loads), 1)
+        self.assertFalse(registry.is_stale(("saved",)))
+        self.assertTrue(registry.is_stale(("saved again",)))
+
+    def test_nothing_published_is_not_stale(self):
+        self.assertFalse(ModelRegistry().is_stale(("saved",)))
+
+
+class FileClassifier(Classifier):
+    """
+    Classifier whose model is the content of a file, saved by the tests as another process would.
+    """
+    def __init__(self, path) -> None:
+        super().__init__()
+        self.path = path
+        self.MODEL_CHECK_INTERVAL = 0.
+
+    def create_necessary_folders(self):
+        pass
+
+    def model_files(self):
+        return [self.path]
+
+    def load_model(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def identify(self, frame, model=None, detection=None):
+        return [], None, None
+
+    def train(self):
+        pass
+
+
+class ModelRefreshTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "model.txt")
+        self.save("first")
+        self.classifier = FileClassifier(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def save(self, content, mtime=1):
+        with open(self.path, "w") as f:
+            f.write(content)
+        os.utime(self.path, ns=(mtime, mtime))
+
+    def test_model_saved_by_another_process_is_reloaded(self):
+        self.assertEqual(self.classifier.current_model(), (1, "first"))
+        self.assertEqual(self.classifier.latest_version(), 1) # Unchanged
+        self.save("second", mtime=2)
+        self.assertEqual(self.classifier.latest_version(), 2)
+        self.assertEqual(self.classifier.current_model(), (2, "second"))
+
+    def test_model_published_here_is_not_reloaded(self):
+        self.classifier.current_model()
+        self.save("trained here", mtime=2)
+        self.classifier.publish("trained here")
+        self.assertEqual(self.classifier.current_model(), (2, "trained here"))
+
+    def test_checks_are_throttled(self):
+        self.classifier.MODEL_CHECK_INTERVAL = 60.
+        self.classifier.current_model()
+        self.save("second", mtime=2)
+        self.assertEqual(self.classifier.current_model(), (1, "first"))
+
+
+class StreamClassifier:
+    """
+    Classifier of the session tests: it always finds the face at box, recognized as label.
+    """
+    def __init__(self, label, box=(100, 60, 80, 80)) -> None:
+        self.label = label
+        self.box = box
+
+    def current_model(self):
+        return 1, {}
+
+    def latest_version(self):
+        return 1
+
+    def detect(self, frame, around=None):
+        detection = Detection(frame)
+        detection.faces = [self.box]
+        return detection
+
+    def identify(self, frame, model=None, detection=None):
+        return [self.box], self.label, 0.95
+
+    def annotate(self, frame, faces, label=None):
+        return frame
+
+
+def stream_session(label, frames=60):
+    """
+    Runs a session on a still stream, returns (scheduler stats, frame numbers where the identity was reported).
+    """
+    session = FrameSession(StreamClassifier(label), metadata_only=True)
+    frame = np.random.default_rng(0).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    reported = []
+    with mock.patch("api.utils.session.FrameSession.get_user_info", lambda label: {"ID": label}), \
+            mock.patch("api.utils.session.FrameSession.get_profile_pic", lambda label: None):
+        for number in range(1, frames + 1):
+            identity_data, _ = session.analyze(frame)
+            if identity_data["RECOGNITION_PHASE"]: reported.append(number)
+    return session.scheduler.stats(), reported
+
+
+class RecognitionPolicyTests(SimpleTestCase):
+    def track(self, label=None, stability=0, motion=0.):
+        track = Track(1, (0, 0, 10, 10), None)
+        track.label, track.stability, track.motion = label, stability, motion
+        return track
+
+    def simulate(self, policy, label, motion, frames=60):
+        """
+        Inferences made for a track whose identity is already decided, with every recognition confirming it.
+        """
+        track = self.track(label, motion=motion)
+        scheduler = RecognitionScheduler(policy)
+        for number in range(1, frames + 1):
+            if scheduler.due([track], number):
+                scheduler.recognized()
+                if track.last_recognition is not None: track.stability += 1
+                track.last_recognition = number
+        return scheduler
+
+    def test_fixed_interval(self):
+        policy = FixedIntervalPolicy(5)
+        track = self.track()
+        self.assertTrue(policy.should_recognize(track, 1, 0.))
+        track.last_recognition = 1
+        self.assertFalse(policy.should_recognize(track, 5, 0.))
+        self.assertTrue(policy.should_recognize(track, 6, 0.))
+
+    def test_intervals(self):
+        policy = AdaptivePolicy()
+        self.assertEqual(policy.interval(self.track(), 0.), policy.MIN_INTERVAL)
+        self.assertEqual(policy.interval(self.track("42", stability=2), 0.), policy.BASE_INTERVAL * 4)
+        self.assertEqual(policy.interval(self.track("42", stability=10), 0.), policy.MAX_INTERVAL)
+        self.assertEqual(policy.interval(self.track("42", stability=2, motion=1.), 0.), policy.BASE_INTERVAL)
+        self.assertEqual(policy.interval(self.track("unknown", stability=2), 0.), policy.BASE_INTERVAL * 4)
+        self.assertEqual(policy.interval(self.track("Unknown", stability=2, motion=1.), 0.), policy.BASE_INTERVAL * 2)
+        self.assertEqual(policy.interval(self.track("unknown", motion=1.), 0.), policy.BASE_INTERVAL)
+        self.assertEqual(policy.interval(self.track("42"), 1.), policy.BASE_INTERVAL * (1 + policy.LOAD_FACTOR))
+
+    def test_decided_tracks_save_inferences(self):
+        for label in ("42", "unknown"):
+            for motion in (0., 1.):
+                scheduler = self.simulate(AdaptivePolicy(), label, motion)
+                if label == "42" and motion:
+                    self.assertGreaterEqual(scheduler.saved_inferences(), 0, (label, motion)) # Verified at the baseline interval
+                else:
+                    self.assertGreater(scheduler.saved_inferences(), 0, (label, motion))
+
+    def test_sessions_save_inferences(self):
+        for label in ("42", "Unknown"):
+            stats, _ = stream_session(label)
+            self.assertGreater(stats["SAVED_INFERENCES"], 0, label)
@@ -10,6 +10,9 @@ urlpatterns = [
     path('get_attendance_list', views.get_attendance_list),
     path('add_attendance', views.add_attendance),
     path('get_photo_list', views.get_photo_list),
+    path('get_photo', views.get_photo),
     path('delete_photo', views.delete_photo),
-    path('upload_photo_enrollment', views.upload_photo_enrollment)
+    path('upload_photo_enrollment', views.upload_photo_enrollment),
+    path('get_training_status', views.get_training_status),
+    path('get_user_cache_stats', views.get_user_cache_stats)
 ]
\ No newline at end of file
@@ -1,7 +1,174 @@
+import time
+import queue
+import threading
+from contextlib import contextmanager
 import mysql.connector as sql
 from bsproject import settings
 
 def dbconnector():
+    """
+    Opens a new connection to the MySQL database. Use the pool (get_pool, query, execute) instead of calling it directly.
+    """
     DBconf = settings.DATABASES.get("mysql")
     return sql.connect(host=DBconf.get("DB_HOST"), username=DBconf.get("DB_USERNAME"), passwd=DBconf.get("DB_PASSWORD"), database=DBconf.get("DB_NAME"))
 
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of database connections, reused across the requests (and the WebSocket frames) instead of opening a new one each time.
+    connect - factory of the connections (e.g. dbconnector, or sqlite3.connect for a local stand-in)
+    size - maximum number of open connections, further checkouts wait up to timeout seconds for a free one
+    health_check_after - connections idle for longer than these seconds are checked with health_query before being reused
+    paramstyle - "format" if the driver uses %s placeholders (mysql.connector), "qmark" if it uses ? (sqlite3): the queries are always written with %s
+    cursor_options - passed to connection.cursor(), e.g. {"prepared": True} for server side prepared statements with mysql.connector
+    """
+    def __init__(self, connect, size=5, timeout=10., health_check_after=30., health_query="SELECT 1", paramstyle="format", cursor_options=None) -> None:
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.health_query = health_query
+        self.paramstyle = paramstyle
+        self.cursor_options = cursor_options or {}
+        self.idle = queue.LifoQueue() # (connection, last use time), the most recently used first since it's likely still alive
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.open_connections = 0
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the with block, it's always given back to the pool at the end (rolled back if the block failed).
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        connection = None
+        try:
+            connection = self.checkout()
+            yield connection
+        except Exception:
+            if connection is not None:
+                connection = self.rollback(connection)
+            raise
+        finally:
+            if connection is not None:
+                self.idle.put((connection, time.monotonic()))
+            self.slots.release()
+
+    @contextmanager
+    def cursor(self):
+        """
+        Checks out a connection and yields a cursor on it, committing at the end of the with block.
+        """
+        with self.connection() as connection:
+            cursor = connection.cursor(**self.cursor_options)
+            try:
+                yield cursor
+                connection.commit()
+            finally:
+                cursor.close()
+
+    def checkout(self):
+        """
+        Returns an idle connection (checked if it's been idle for long), or a new one.
+        """
+        while True:
+            try:
+                connection, last_use = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if time.monotonic() - last_use < self.health_check_after or self.is_healthy(connection):
+                return connection
+            self.discard(connection)
+        connection = self.connect()
+        with self.lock:
+            self.open_connections += 1
+        return connection
+
+    def is_healthy(self, connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute(self.health_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def rollback(self, connection):
+        """
+        Rolls back the connection after a failure, returns None if the connection itself is broken (and discards it).
+        """
+        try:
+            connection.rollback()
+            return connection
+        except Exception:
+            self.discard(connection)
+            return None
+
+    def discard(self, connection):
+        with self.lock:
+            self.open_connections -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        while True:
+            try:
+                connection, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(connection)
+
+    def prepare(self, statement):
+        """
+        Converts the %s placeholders of the statement to the ones of the driver.
+        """
+        if self.paramstyle == "qmark":
+            return statement.replace("%s", "?")
+        return statement
+
+    def query(self, statement, params=()):
+        """
+        Runs a parameterized SELECT and returns all the rows.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(self.prepare(statement), tuple(params))
+            return tuple(cursor.fetchall())
+
+    def execute(self, statement, params=()):
+        """
+        Runs a parameterized INSERT/UPDATE/DELETE, committing it, and returns the id of the last inserted row.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(self.prepare(statement), tuple(params))
+            return cursor.lastrowid
+
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the pool of the MySQL connections, shared by the whole process.
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ConnectionPool(dbconnector, size=settings.DB_POOL_SIZE, cursor_options={"prepared": True})
+        return pool
+
+def query(statement, params=()):
+    return get_pool().query(statement, params)
+
+def execute(statement, params=()):
+    return get_pool().execute(statement, params)
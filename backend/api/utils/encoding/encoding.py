@@ -1,5 +1,7 @@
 import numpy as np
 import base64
+import struct
+import json
 import cv2
 
 def b64str_to_opencvimg(b64_str):
@@ -15,4 +17,42 @@ def opencvimg_to_b64_str(opencvimg):
     im_b64 = base64.b64encode(im_bytes)
     string = im_b64.decode('utf-8')
     string = "data:image/jpeg;base64," + string
-    return string
\ No newline at end of file
+    return string
+
+# Binary WebSocket messages
+# Client -> server: the raw JPEG bytes of the frame.
+# Server -> client: a 4 bytes big-endian unsigned integer with the length of the header, the header (a UTF-8 JSON object,
+# the same fields of the text replies except FRAME) and then, if the reply contains a frame, its raw JPEG bytes until the end of the message.
+HEADER_LENGTH = struct.Struct(">I")
+
+def jpeg_bytes_to_opencvimg(jpeg_bytes):
+    jpg_as_np = np.frombuffer(jpeg_bytes, dtype=np.uint8)
+    return cv2.imdecode(jpg_as_np, flags=1)
+
+def opencvimg_to_jpeg_bytes(opencvimg):
+    _, encoded_im_arr = cv2.imencode('.jpeg', opencvimg)
+    return encoded_im_arr.tobytes()
+
+def pack_frame_message(header, jpeg_bytes=None):
+    """
+    Builds a binary reply from its header (a dictionary) and the optional JPEG bytes of the frame.
+    """
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return b"".join([HEADER_LENGTH.pack(len(header_bytes)), header_bytes, jpeg_bytes or b""])
+
+def unpack_frame_message(message):
+    """
+    Splits a binary reply into its header (a dictionary) and the JPEG bytes of the frame (None if there isn't a frame).
+    Raises ValueError if the message is malformed (truncated, or the header isn't a JSON object).
+    """
+    if len(message) < HEADER_LENGTH.size:
+        raise ValueError("Message shorter than the header length")
+    (header_length,) = HEADER_LENGTH.unpack_from(message)
+    start = HEADER_LENGTH.size
+    if start + header_length > len(message):
+        raise ValueError(f"Header of {header_length} bytes longer than the message")
+    header = json.loads(bytes(message[start:start + header_length]).decode("utf-8")) # Invalid UTF-8 or JSON raise a ValueError too
+    if not isinstance(header, dict):
+        raise ValueError("Header is not a JSON object")
+    jpeg_bytes = bytes(message[start + header_length:])
+    return header, jpeg_bytes or None
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from ..recognition import preprocessing
+
+
+class SamplePreprocessor:
+    """
+    Preprocesses the uploaded samples one by one as soon as they're saved, while the rest of the upload is still arriving,
+    so the training job finds them already cropped.
+    It runs on a single thread with its own cascades, since the ones of the classifier are used by the recognition at the same time.
+    The samples are processed in order, so a task submitted with then() runs after the preprocessing queued before it.
+    """
+    def __init__(self) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sample-preprocessing")
+        self.cascades = None # Only used by the thread of the executor
+
+    def submit(self, path, size, after=()):
+        """
+        Queues the preprocessing of the sample, returns a future with its outcome (see preprocessing.preprocess_image).
+        after - futures to wait for before touching the sample (e.g. the running training job, see TrainingScheduler.order_preprocessing)
+        """
+        return self.executor.submit(self.preprocess, path, size, list(after))
+
+    def then(self, fn):
+        """
+        Runs fn once the preprocessing queued so far is over, without waiting for it here. Returns its future.
+        """
+        return self.executor.submit(fn)
+
+    def preprocess(self, path, size, after=()):
+        wait(after)
+        if self.cascades is None:
+            self.cascades = preprocessing.load_cascades()
+        return preprocessing.preprocess_image(path, *self.cascades, size)
+
+    def wait(self, futures):
+        """
+        Waits for the given preprocessing and returns the number of samples for each outcome.
+        """
+        outcomes = {}
+        for future in futures:
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"---Sample preprocessing failed: {e}---\n")
+                outcome = "errors"
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        return outcomes
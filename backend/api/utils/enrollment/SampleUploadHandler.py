@@ -0,0 +1,41 @@
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class SampleUploadHandler(FileUploadHandler):
+    """
+    Django upload handler which streams the photos of a multipart request straight into the samples of the user (through a SampleWriter),
+    instead of keeping them in memory or in a temporary upload file and copying them afterwards.
+    The files whose content type isn't in CONTENT_TYPES are dropped.
+    The saved samples are tracked by the writer (writer.saved), so nothing is added to request.FILES.
+    Install it before the request body is read: request.upload_handlers = [SampleUploadHandler(writer, request)]
+    """
+    CONTENT_TYPES = {"image/jpeg": "jpeg", "image/jpg": "jpeg", "image/png": "png"}
+
+    def __init__(self, writer, request=None) -> None:
+        super().__init__(request)
+        self.writer = writer
+        self.skipped = []
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        extension = self.CONTENT_TYPES.get(content_type)
+        if extension is None:
+            self.skipped.append(file_name)
+            self.writer.discard()
+            return
+        self.writer.open(extension)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer.file is not None:
+            self.writer.write(raw_data)
+        return None # The chunk is consumed here
+
+    def file_complete(self, file_size):
+        if self.writer.file is None: # Dropped
+            return None
+        if self.writer.close() is None:
+            self.skipped.append(self.file_name)
+        return None # An UploadedFile without a file would fail when Django closes the request files
+
+    def upload_interrupted(self):
+        self.writer.discard()
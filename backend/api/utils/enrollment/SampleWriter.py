@@ -0,0 +1,138 @@
+import os
+import re
+import uuid
+import threading
+from bsproject.paths import SAMPLES_ROOT, ENROLLMENT_ROOT
+from ..recognition.preprocessing import processed_path
+
+
+class SampleCounter:
+    """
+    Next free index of the samples of each user (image_<index>.<extension>), kept in a small file per user (root/<user id>)
+    so a new sample gets its name without listing the directory.
+    The counter of a user is initialized from the highest index among their samples the first time it's used.
+    """
+    SAMPLE_NAME = re.compile(r"^image_(\d+)")
+
+    def __init__(self, root=os.path.join(ENROLLMENT_ROOT, "counters"), samples_root=SAMPLES_ROOT) -> None:
+        self.root = root
+        self.samples_root = samples_root
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, user_id):
+        return os.path.join(self.root, str(user_id))
+
+    def next(self, user_id):
+        """
+        Reserves and returns the next index of the user.
+        """
+        with self.lock:
+            try:
+                with open(self.path(user_id)) as f:
+                    index = int(f.read())
+            except (FileNotFoundError, ValueError):
+                index = self.first_free(user_id)
+            self.save(user_id, index + 1)
+            return index
+
+    def first_free(self, user_id):
+        """
+        Returns the index after the highest one among the samples of the user (0 if they have none).
+        """
+        sample_dir = os.path.join(self.samples_root, str(user_id))
+        if not os.path.isdir(sample_dir):
+            return 0
+        indices = [int(match.group(1)) for match in (self.SAMPLE_NAME.match(entry.name) for entry in os.scandir(sample_dir)) if match]
+        return max(indices) + 1 if indices else 0
+
+    def save(self, user_id, index):
+        path = self.path(user_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(index))
+        os.replace(tmp_path, path)
+
+
+class SampleWriter:
+    """
+    Writes the photos uploaded by a user into their samples directory while they arrive, a chunk at a time.
+    Each photo is written to a temporary file (tmp_root) and moved to samples_root/<user id>/image_<index>.<extension> once complete,
+    so the training never reads a half-written sample.
+    on_sample - optional callable, called with the path of each sample once it's saved (e.g. to preprocess it right away)
+    """
+    def __init__(self, user_id, counter=None, samples_root=SAMPLES_ROOT, tmp_root=os.path.join(ENROLLMENT_ROOT, "tmp"), on_sample=None) -> None:
+        self.user_id = str(user_id)
+        self.counter = counter or SampleCounter(samples_root=samples_root)
+        self.sample_dir = os.path.join(samples_root, self.user_id)
+        self.tmp_root = tmp_root
+        self.on_sample = on_sample
+        self.file = None
+        self.tmp_path = None
+        self.extension = None
+        self.size = 0
+        self.saved = []
+        os.makedirs(self.sample_dir, exist_ok=True)
+        os.makedirs(self.tmp_root, exist_ok=True)
+
+    def open(self, extension="jpeg"):
+        """
+        Starts a new photo, discarding the one still open (if any).
+        """
+        self.discard()
+        self.extension = extension
+        self.size = 0
+        self.tmp_path = os.path.join(self.tmp_root, f"{self.user_id}_{uuid.uuid4().hex}.part")
+        self.file = open(self.tmp_path, "wb")
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        """
+        Completes the current photo and returns the path of the sample, None if the photo was empty.
+        """
+        self.file.close()
+        self.file = None
+        if self.size == 0:
+            self.discard()
+            return None
+        while True:
+            path = os.path.join(self.sample_dir, f"image_{self.counter.next(self.user_id)}.{self.extension}")
+            try:
+                os.link(self.tmp_path, path) # Fails if the name was taken in the meantime (e.g. by another process), unlike os.replace
+                break
+            except FileExistsError:
+                continue
+        os.remove(self.tmp_path)
+        self.tmp_path = None
+        self.saved.append(path)
+        if self.on_sample is not None:
+            self.on_sample(path)
+        return path
+
+    def save(self, data, extension="jpeg"):
+        """
+        Saves a whole photo at once (bytes), returns the path of the sample.
+        """
+        self.open(extension)
+        self.write(data)
+        return self.close()
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.tmp_path is not None and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.tmp_path = None
+
+    def remove_saved(self):
+        """
+        Removes the samples saved so far, and their preprocessed crops (so their preprocessing must be over), e.g. when the upload fails.
+        """
+        for path in self.saved:
+            for sample in (path, processed_path(path)):
+                if os.path.exists(sample): os.remove(sample)
+        self.saved = []
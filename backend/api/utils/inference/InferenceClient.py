@@ -0,0 +1,85 @@
+import time
+import itertools
+import threading
+from concurrent import futures
+from multiprocessing.connection import Client
+from .InferenceServer import parse_address, check_connection_settings
+
+
+class InferenceError(Exception):
+    pass
+
+
+class InferenceClient:
+    """
+    Connection of a worker to the inference server, shared by all its threads: each call is sent with an id, and a receiver thread
+    hands every reply to the call waiting for it, so the calls of different kiosks are in flight (and batched by the server) together.
+    The connection is opened on the first call, and opened again on the next call if it's lost.
+    """
+    def __init__(self, address, authkey, connect_timeout=60., timeout=30., allow_remote=False) -> None:
+        check_connection_settings(address, authkey, allow_remote)
+        self.address = parse_address(address)
+        self.authkey = authkey.encode("utf-8") if isinstance(authkey, str) else authkey
+        self.connect_timeout = connect_timeout # The server may still be loading the model when the workers start
+        self.timeout = timeout # Default timeout of the calls, in seconds
+        self.connection = None
+        self.lock = threading.Lock()
+        self.pending = {} # request id -> Future
+        self.ids = itertools.count()
+
+    def connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                connection = Client(self.address, authkey=self.authkey)
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.monotonic() > deadline:
+                    raise InferenceError(f"Inference server not reachable at {self.address}")
+                time.sleep(0.5)
+        threading.Thread(target=self.receive, args=(connection,), name="inference-client", daemon=True).start()
+        return connection
+
+    def receive(self, connection):
+        try:
+            while True:
+                request_id, ok, result = connection.recv()
+                with self.lock:
+                    future = self.pending.pop(request_id, None)
+                if future is None: continue # The call timed out
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(InferenceError(result))
+        except (EOFError, OSError):
+            with self.lock:
+                if self.connection is connection:
+                    self.connection = None
+                lost = list(self.pending.values())
+                self.pending.clear()
+            for future in lost:
+                future.set_exception(InferenceError("Connection to the inference server lost"))
+
+    def call(self, method, *args, timeout=-1):
+        """
+        Calls the method on the server and returns its result, raising InferenceError if it failed there.
+        timeout - seconds to wait for the result, -1 (default) for the client's timeout, None to wait until it ends (e.g. a training)
+        """
+        future = futures.Future()
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.connect()
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+            try:
+                self.connection.send((request_id, method, args))
+            except (OSError, ValueError):
+                self.pending.pop(request_id, None)
+                self.connection = None
+                raise InferenceError("Connection to the inference server lost")
+        try:
+            return future.result(timeout=self.timeout if timeout == -1 else timeout)
+        except futures.TimeoutError:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise InferenceError(f"No reply from the inference server to {method} after {self.timeout if timeout == -1 else timeout}s")
@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InferencePool:
+    """
+    Bounded pool of threads, shared by all the connections, which runs the CPU-bound frame processing (decoding, detection, recognition)
+    outside of the event loop. OpenCV, TensorFlow and dlib release the GIL, so the threads run in parallel on different cores
+    while sharing the same models.
+    Backpressure: at most max_pending tasks can be running or waiting, further submissions are refused until a task ends.
+    """
+    def __init__(self, max_workers=4, max_pending=None) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.refused = 0
+
+    def try_submit(self, fn, *args):
+        """
+        Submits fn(*args) and returns its Future, or None if the pool is saturated.
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.refused += 1
+                return None
+            self.pending += 1
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self.task_done)
+        return future
+
+    def task_done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def load(self):
+        """
+        Returns the fraction of the pool in use, between 0 and 1.
+        """
+        with self.lock:
+            return self.pending / self.max_pending
@@ -0,0 +1,220 @@
+import cv2
+import time
+import socket
+import ipaddress
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener, AuthenticationError
+from ..recognition.Classifier import Classifier
+from ..recognition.Detection import Detection
+
+
+def parse_address(address):
+    """
+    Returns the address for multiprocessing.connection: (host, port) for "host:port", otherwise the path of a Unix socket (or a Windows named pipe).
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+def check_connection_settings(address, authkey, allow_remote=False):
+    """
+    Validates the settings of the connections between the server and the workers, raising ValueError if they aren't safe:
+    the messages are pickled, so anyone who can connect with the authkey can run arbitrary code in the receiving process.
+    The authkey is required, and TCP addresses must be on the loopback interface unless allow_remote is set.
+    """
+    if not authkey:
+        raise ValueError("The inference server needs a secret authkey (INFERENCE_SERVER_AUTHKEY)")
+    address = parse_address(address)
+    if isinstance(address, tuple) and not allow_remote and not is_loopback(address[0]):
+        raise ValueError(f"{address[0]} isn't a loopback address: set INFERENCE_SERVER_ALLOW_REMOTE=1 to serve over the network")
+
+
+class InferenceServer:
+    """
+    Serves a classifier to the ASGI workers (see RemoteClassifier), so its models and galleries are loaded in a single process
+    instead of once per worker, and the kiosks can be spread over several workers without multiplying the memory.
+    The workers send their requests over a multiprocessing connection (see parse_address), each one as (request id, method, arguments),
+    and receive (request id, ok, result or error) back.
+    The recognition requests of all the connections are processed in batches: a batch starts with the first waiting request and takes
+    the ones arriving within batch_wait seconds, up to batch_size, and runs them on the model thread with a single model version
+    (see Classifier.identify_batch: DeepFace embeds the faces of a batch in a single forward pass, while the other classifiers gain little
+    from it). The maintenance calls (training, preprocessing...) run on another thread, so the recognition
+    goes on with the published model while a new one is trained.
+    """
+    MAINTENANCE = {"train", "preprocess_images", "remove_samples", "reload"}
+    BATCHED = {"identify", "find_faces", "config", "stats"}
+    CONFIG = ["name", "image_width", "image_height", "DETECTION_SCALE", "DETECTION_MAX_WIDTH", "DETECTION_REGION_MARGIN", "scaleFactor", "minNeighbors", "minSize"]
+
+    def __init__(self, classifier, address, authkey, batch_size=8, batch_wait=0.005, allow_remote=False) -> None:
+        check_connection_settings(address, authkey, allow_remote)
+        self.classifier = classifier
+        self.address = parse_address(address)
+        self.authkey = authkey.encode("utf-8") if isinstance(authkey, str) else authkey
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.requests = queue.Queue() # (reply, request id, method, arguments)
+        self.maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference-maintenance")
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.served = 0
+        self.batches = 0
+        self.max_batch = 0
+
+    def serve_forever(self):
+        threading.Thread(target=self.process_batches, name="inference-batches", daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"Inference server of {self.classifier.name} listening on {self.address}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    print(f"Connection refused: {e}")
+                    continue
+                threading.Thread(target=self.serve_connection, args=(connection,), daemon=True).start()
+
+    def serve_connection(self, connection):
+        """
+        Reads the requests of a worker, the replies are sent back on the same connection as soon as each one is ready.
+        """
+        send_lock = threading.Lock()
+
+        def reply(request_id, ok, result):
+            with send_lock:
+                try:
+                    connection.send((request_id, ok, result))
+                except (OSError, EOFError): # The worker went away
+                    pass
+
+        with self.lock:
+            self.connections += 1
+        try:
+            while True:
+                request_id, method, args = connection.recv()
+                if method in self.MAINTENANCE:
+                    self.maintenance.submit(self.run, reply, request_id, method, args)
+                elif method in self.BATCHED:
+                    self.requests.put((reply, request_id, method, args))
+                else:
+                    reply(request_id, False, f"Unknown method {method}")
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self.lock:
+                self.connections -= 1
+            connection.close()
+
+    def process_batches(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        with self.lock:
+            self.served += len(batch)
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(batch))
+        identify = []
+        for request in batch:
+            if request[2] != "identify": continue
+            reply, request_id, _, args = request
+            try:
+                identify.append((reply, request_id, self.detection(*args)))
+            except Exception: # A malformed request only fails itself
+                reply(request_id, False, traceback.format_exc())
+        if identify:
+            self.identify(identify)
+        for request in batch:
+            if request[2] != "identify":
+                self.run(*request)
+
+    def identify(self, requests):
+        """
+        Identifies the frames of a batch, [(reply, request id, detection)], with a single model version. If the batch fails
+        (e.g. because of a bad frame), the frames are identified one at a time, so only the requests which fail get an error.
+        """
+        _, model = self.classifier.current_model()
+        try:
+            results = self.classifier.identify_batch([detection for (_, _, detection) in requests], model)
+        except Exception:
+            results = None
+        for index, (reply, request_id, detection) in enumerate(requests):
+            if results is not None:
+                reply(request_id, True, results[index])
+                continue
+            try:
+                reply(request_id, True, self.classifier.identify(detection.frame, model, detection))
+            except Exception:
+                reply(request_id, False, traceback.format_exc())
+
+    def run(self, reply, request_id, method, args):
+        try:
+            reply(request_id, True, getattr(self, f"do_{method}")(*args))
+        except Exception:
+            reply(request_id, False, traceback.format_exc())
+
+    def detection(self, frame, faces):
+        """
+        Returns the Detection of a frame whose faces were found by the worker.
+        """
+        detection = Detection(frame)
+        detection.faces = list(faces)
+        return detection
+
+    def do_config(self):
+        """
+        Returns the settings the workers need to detect the faces like the served classifier. REMOTE_DETECTION tells if the classifier
+        has its own detector (e.g. the HOG detector of SVC), so the workers ask the server to find the faces instead of using the Haar cascade.
+        """
+        config = {name: getattr(self.classifier, name) for name in self.CONFIG}
+        config["REMOTE_DETECTION"] = type(self.classifier).find_faces is not Classifier.find_faces
+        return config
+
+    def do_find_faces(self, image, scale):
+        """
+        Finds the faces in the image scanned by a worker (the frame region, scaled by scale), in the coordinates of the region at full size.
+        """
+        detection = Detection(image, scale)
+        detection.small_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) # The image is already scaled
+        detection.small_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return [tuple(int(v) for v in box) for box in self.classifier.find_faces(detection)]
+
+    def do_stats(self):
+        with self.lock:
+            return {
+                "CLASSIFIER": self.classifier.name,
+                "CONNECTIONS": self.connections,
+                "REQUESTS": self.served,
+                "BATCHES": self.batches,
+                "MEAN_BATCH": self.served / self.batches if self.batches else None,
+                "MAX_BATCH": self.max_batch,
+                "MODEL_VERSION": self.classifier.latest_version(),
+            }
+
+    def do_train(self):
+        self.classifier.train()
+
+    def do_preprocess_images(self, dirs=None, workers=None):
+        return self.classifier.preprocess_images(dirs=dirs, workers=workers)
+
+    def do_remove_samples(self, paths):
+        self.classifier.remove_samples(paths)
+
+    def do_reload(self):
+        return self.classifier.reload()
@@ -0,0 +1,56 @@
+from bsproject import settings
+from ..recognition.Classifier import Classifier
+from .InferenceClient import InferenceClient
+
+
+class RemoteClassifier(Classifier):
+    """
+    Classifier of the ASGI workers in the serving mode (settings.INFERENCE_SERVER): the recognition, the training and the other
+    operations on the model run in the inference server (see InferenceServer), so the workers don't load TensorFlow, the models or the galleries.
+    The faces are detected here, with the detection settings of the served classifier, unless it has its own detector
+    (e.g. the HOG detector of SVC): then the scanned image is sent to the server to find them.
+    The model lives in the server, which always recognizes with its latest version, so the model of the workers is empty.
+    """
+    def __init__(self, address=None, authkey=None) -> None:
+        super().__init__()
+        self.client = InferenceClient(address or settings.INFERENCE_SERVER, authkey or settings.INFERENCE_SERVER_AUTHKEY, allow_remote=settings.INFERENCE_SERVER_ALLOW_REMOTE)
+        self.REMOTE_DETECTION = False
+        for name, value in self.client.call("config").items():
+            setattr(self, name, value)
+
+    def load_model(self):
+        return {}
+
+    def find_faces(self, detection):
+        if not self.REMOTE_DETECTION:
+            return super().find_faces(detection)
+        boxes = self.client.call("find_faces", detection.scan(detection.frame), detection.scale)
+        offset_x, offset_y = detection.region[:2] if detection.region is not None else (0, 0)
+        return [(x + offset_x, y + offset_y, w, h) for (x, y, w, h) in boxes]
+
+    def identify(self, frame, model=None, detection=None):
+        if detection is None: detection = self.detect(frame)
+        return self.client.call("identify", frame, list(detection.faces))
+
+    def train(self):
+        self.client.call("train", timeout=None)
+
+    def preprocess_images(self, dirs=None, workers=None, progress=None):
+        """
+        The samples are preprocessed by the server, progress is only called at the end.
+        """
+        metrics = self.client.call("preprocess_images", dirs, workers, timeout=None)
+        if progress is not None: progress(metrics)
+        return metrics
+
+    def remove_samples(self, paths):
+        self.client.call("remove_samples", paths, timeout=None)
+
+    def reload(self):
+        return self.client.call("reload", timeout=None)
+
+    def stats(self):
+        """
+        Returns the statistics of the inference server (connections, requests, batches...).
+        """
+        return self.client.call("stats")
@@ -1,10 +1,16 @@
 import os
 import cv2
+import time
 import pickle
-import tensorflow as tf
+import threading
+import multiprocessing
 import numpy as np
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from bsproject.paths import SAMPLES_ROOT, LABELS_ROOT, MODELS_ROOT
+from . import preprocessing
+from .ModelRegistry import ModelRegistry
+from .Detection import Detection
+from .stores.FeatureStore import get_feature_store
 from abc import ABC, abstractmethod
 
 
@@ -13,23 +19,148 @@ class Classifier(ABC):
     Abstract class, this shouldn't be instanced, but it describes the common fields and methods that a classifier have.
     """
     def __init__(self) -> None:
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-        self.side_face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_profileface.xml')
+        self.cascades = threading.local() # Haar cascades of each thread (see face_cascade), a CascadeClassifier isn't thread-safe
         self.image_dir = SAMPLES_ROOT
         self.models_root = MODELS_ROOT
         self.labels_root = LABELS_ROOT
         self.image_width = 224
         self.image_height = 224
+        # Detection stage (see detect), the classifiers can configure it differently
+        self.DETECTION_SCALE = 1. # The detector runs on the frame scaled by this factor, lower is faster but misses the small faces
+        self.DETECTION_MAX_WIDTH = 640 # The frame is scaled down further if needed so the detector never scans more than this width, None for no limit
+        self.DETECTION_REGION_MARGIN = 1. # Margin around the last known face when the search is limited to it, as a fraction of its size
+        self.scaleFactor = 1.1
+        self.minNeighbors = 5
+        self.minSize = None # Minimum face size (in the original frame), None for no limit
+        self.PREPROCESSING_WORKERS = 1 # Number of processes used by preprocess_images, more than 1 is useful for bulk enrollments
+        self.registry = ModelRegistry()
+        self.training_lock = threading.RLock() # Serializes the operations which modify the saved model
+        self.MODEL_CHECK_INTERVAL = 2. # Seconds between the checks for a model saved by another process (see refresh)
+        self.model_checked_at = None
+        self.refresh_lock = threading.Lock()
         self.create_necessary_folders()
     
     @abstractmethod
-    def recognize(self, frame: str):
+    def identify(self, frame, model=None, detection=None):
+        """
+        Finds the faces in the frame (without modifying it) and recognizes them, returning:
+        faces - the face boxes as (x, y, w, h), the one the label refers to comes first
+        label - None if there isn't any face, "unknown" if the person isn't recognized, otherwise the recognized label
+        confidence - the confidence (or similarity) of the recognition
+        model - the trained model to use, by default the latest published one
+        detection - the result of detect for this frame if already available, otherwise the frame is detected here
+        """
         pass
+
+    def identify_batch(self, detections, model=None):
+        """
+        Identifies the faces of several detected frames (see identify) with the same model version, e.g. a batch of the inference server.
+        By default they're identified one at a time: the classifiers whose model can embed many faces at once override it.
+        """
+        if model is None: _, model = self.current_model()
+        return [self.identify(detection.frame, model, detection) for detection in detections]
+
+    def recognize(self, frame, model=None):
+        """
+        Same as identify, but it returns the frame with the faces (and the recognized label) drawn on it instead of the face boxes.
+        """
+        faces, label, confidence = self.identify(frame, model)
+        return self.annotate(frame, faces, label), label, confidence
     
     @abstractmethod
     def train(self):
         pass
 
+    @abstractmethod
+    def load_model(self):
+        """
+        Loads the trained model (everything recognize needs, e.g. recognizer and labels) from the file system and returns it.
+        """
+        pass
+
+    def current_model(self):
+        """
+        Returns (version, model) of the latest published model. The saved model is loaded the first time,
+        and again when another process saved a new one (see refresh).
+        """
+        self.refresh()
+        return self.registry.get_or_load(self.load_model, self.saved_signature)
+
+    def latest_version(self):
+        self.refresh()
+        return self.registry.latest_version
+
+    def publish(self, model):
+        """
+        Publishes a new trained model: the following recognitions use it, while the ones which pinned an older version aren't affected.
+        The published model must not be modified anymore, and it must be the one just saved on the file system.
+        """
+        return self.registry.publish(model, self.saved_signature())
+
+    def reload(self):
+        """
+        Loads the trained model from the file system and publishes it as a new version (e.g. after a training run in another process).
+        """
+        signature = self.saved_signature() # Before loading, so a model saved in the meantime is loaded again at the next refresh
+        return self.registry.publish(self.load_model(), signature)
+
+    def model_files(self):
+        """
+        Returns the paths of the files of the saved model, whose changes tell that another process saved a new model (see refresh).
+        By default there aren't any, and the model is never reloaded by itself.
+        """
+        return []
+
+    def saved_signature(self):
+        """
+        Returns the (modification time, size) of each file of the saved model, None for the missing ones.
+        """
+        signature = []
+        for path in self.model_files():
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self):
+        """
+        Reloads the saved model if it changed since the latest version was published, e.g. because the training ran in another worker.
+        It's checked at most every MODEL_CHECK_INTERVAL seconds, and by one thread at a time: the others keep the current version meanwhile.
+        """
+        now = time.monotonic()
+        if self.model_checked_at is not None and now - self.model_checked_at < self.MODEL_CHECK_INTERVAL:
+            return
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.model_checked_at = now
+            signature = self.saved_signature()
+            if signature and self.registry.is_stale(signature):
+                self.registry.publish(self.load_model(), signature)
+        except Exception as e: # e.g. the files of a model still being saved, tried again at the next check
+            print(f"---The saved model can't be reloaded: {e}---\n")
+        finally:
+            self.refresh_lock.release()
+
+    def face_cascade(self):
+        """
+        Returns the frontal face cascade of the calling thread, loaded on its first use there:
+        the inference threads (see InferencePool) detect in parallel, so they can't share one.
+        """
+        if not hasattr(self.cascades, "face"):
+            self.cascades.face = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        return self.cascades.face
+
+    def side_face_cascade(self):
+        """
+        Returns the profile face cascade of the calling thread (see face_cascade).
+        """
+        if not hasattr(self.cascades, "side_face"):
+            self.cascades.side_face = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_profileface.xml")
+        return self.cascades.side_face
+
     def create_necessary_folders(self):
         """
         It creates labels and models folders if they don't already exist.
@@ -39,11 +170,43 @@ class Classifier(ABC):
         if not os.path.exists(self.models_root):
             os.makedirs(self.models_root)
 
+    def list_samples(self):
+        """
+        Returns the path of each image in the samples directory, together with its label (the name of the folder that contains it).
+        """
+        samples = []
+        for root, _, files in os.walk(self.image_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                label = os.path.basename(os.path.dirname(path)).replace(" ", "-").lower()
+                samples.append((path, label))
+        return samples
+
+    def sample_signature(self, path):
+        """
+        Returns (modification time, size) of a sample image, used to tell if it changed since it was used for training.
+        """
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def feature_table(self, extractor, params=None):
+        """
+        Returns the table of the shared feature store (in the models directory) with the features of the given extractor and parameters.
+        """
+        return get_feature_store(os.path.join(self.models_root, "features")).table(extractor, params)
+
+    def remove_samples(self, paths):
+        """
+        Drops the given sample images (already deleted from the samples directory) from the trained model.
+        By default nothing is done, and they are dropped at the next training.
+        """
+        pass
+
     def is_image_preprocessed(self, file_name):
         """
         Check if the image is already preprocessed.
         """
-        return "processed" in file_name
+        return preprocessing.is_image_preprocessed(file_name)
     
     def draw_label(self, frame, label, x, y):
         """
@@ -55,93 +218,142 @@ class Classifier(ABC):
         cv2.putText(frame, label, (x,y), font, 1, color, stroke, cv2.LINE_AA)
         return frame
 
-    def preprocess_images(self):
+    def pending_sample_dirs(self):
+        """
+        Returns the directories of the samples directory which contain at least one image that isn't preprocessed yet.
+        """
+        pending_dirs = []
+        for root, _, files in os.walk(self.image_dir):
+            if any(not self.is_image_preprocessed(file) for file in files):
+                pending_dirs.append(root)
+        return pending_dirs
+
+    def preprocess_images(self, dirs=None, workers=None, progress=None):
         """
         Detect frontal and profile faces inside the image, crops them and saves them in the same directory, deleting the original images.
         If the image is already preprocessed, it is skipped.
+        dirs - the directories to preprocess (e.g. the folder of the user who is enrolling), by default the ones with unprocessed images
+        workers - number of worker processes, each with its own cascades (by default PREPROCESSING_WORKERS); with 1 the images are processed here
+        progress - optional callable, called after each image with the metrics of the run so far
         """
-        image_width = self.image_width
-        image_height = self.image_height
+        workers = workers or self.PREPROCESSING_WORKERS
+        if dirs is None:
+            dirs = self.pending_sample_dirs()
+        paths = []
+        for dir in dirs:
+            if not os.path.isdir(dir): continue
+            paths.extend(entry.path for entry in os.scandir(dir) if entry.is_file() and not self.is_image_preprocessed(entry.name))
 
-        # for detecting faces
-        frontal_face_cascade = self.face_cascade
-        side_face_cascade = self.side_face_cascade
+        size = (self.image_width, self.image_height)
+        metrics = {"total": len(paths), "done": 0, "elapsed": 0.0, preprocessing.PROCESSED: 0, preprocessing.NO_FACE: 0, preprocessing.UNREADABLE: 0, preprocessing.SKIPPED: 0, "errors": 0}
+        start = time.perf_counter()
 
-        current_id = 0
-        label_ids = {}
+        def update_metrics(outcome):
+            metrics["done"] += 1
+            metrics[outcome] += 1
+            metrics["elapsed"] = time.perf_counter() - start
+            if progress is not None: progress(dict(metrics))
 
-        # iterates through all the files in each subdirectories
-        for root, _, files in os.walk(self.image_dir):
-            for file in files:
-                if self.is_image_preprocessed(file):
-                    print(f"---Photo {file} skipped because it is already preprocessed---\n")
-                    continue
-                # path of the image
-                path = os.path.join(root, file)
+        if workers <= 1 or len(paths) <= 1:
+            for path in paths:
+                try:
+                    update_metrics(preprocessing.preprocess_image(path, self.face_cascade(), self.side_face_cascade(), size))
+                except Exception as e:
+                    print(f"---Photo {path} skipped because of an error: {e}---\n")
+                    update_metrics("errors")
+            return metrics
 
-                # get the label name (name of the person)
-                label = os.path.basename(root).replace(" ", ".").lower()
+        # Spawned workers don't inherit the models loaded in this process, they only import the preprocessing module
+        context = multiprocessing.get_context("spawn")
+        max_pending = workers * 2 # Bounded work queue: the paths are submitted as the workers free up
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths)), mp_context=context, initializer=preprocessing.init_worker) as executor:
+            pending = set()
+            for path in paths:
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done: update_metrics(self.preprocessing_outcome(future))
+                pending.add(executor.submit(preprocessing.preprocess_image_in_worker, path, size))
+            for future in as_completed(pending):
+                update_metrics(self.preprocessing_outcome(future))
+        return metrics
 
-                # add the label (key) and its number (value)
-                if not label in label_ids:
-                    label_ids[label] = current_id
-                    current_id += 1
+    def preprocessing_outcome(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"---Photo skipped because of an error: {e}---\n")
+            return "errors"
+
+    def detect(self, frame, around=None):
+        """
+        Detection stage, shared by all the classifiers: it returns a Detection with the faces of the frame and its grayscale/RGB views,
+        which the recognition step reuses instead of converting and scanning the frame again.
+        around - the box (x, y, w, h) of the last known face: only the region around it is scanned, and the whole frame only if it's not found there
+        """
+        detection = Detection(frame, self.detection_scale(frame), self.search_region(frame, around))
+        detection.faces = self.find_faces(detection)
+        if len(detection.faces) == 0 and detection.region is not None:
+            detection.set_region(None)
+            detection.faces = self.find_faces(detection)
+        return detection
+
+    def detection_scale(self, frame):
+        """
+        Returns the scale of the frame for the detector: DETECTION_SCALE, reduced for the frames wider than DETECTION_MAX_WIDTH,
+        so the detection time doesn't grow with the camera resolution.
+        """
+        scale = self.DETECTION_SCALE
+        if self.DETECTION_MAX_WIDTH is not None:
+            scale = min(scale, self.DETECTION_MAX_WIDTH / frame.shape[1])
+        return scale
+
+    def search_region(self, frame, around):
+        """
+        Returns the region of the frame to scan around the given box (expanded by DETECTION_REGION_MARGIN), None for the whole frame.
+        """
+        if around is None:
+            return None
+        x, y, w, h = around
+        margin_x, margin_y = int(w * self.DETECTION_REGION_MARGIN), int(h * self.DETECTION_REGION_MARGIN)
+        x0, y0 = max(x - margin_x, 0), max(y - margin_y, 0)
+        x1, y1 = min(x + w + margin_x, frame.shape[1]), min(y + h + margin_y, frame.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def find_faces(self, detection):
+        """
+        Returns the boxes (x, y, w, h) of the frontal faces, scanning the scaled grayscale frame with the Haar cascade.
+        """
+        params = {"scaleFactor": self.scaleFactor, "minNeighbors": self.minNeighbors}
+        if self.minSize is not None:
+            params["minSize"] = tuple(max(1, int(v * detection.scale)) for v in self.minSize)
+        return detection.to_frame(self.face_cascade().detectMultiScale(detection.small_gray, **params))
+
+    def locate_faces(self, frame):
+        """
+        Returns the boxes (x, y, w, h) of the faces in the frame.
+        """
+        return self.detect(frame).faces
+
+    def annotate(self, frame, faces, label=None):
+        """
+        Draws the faces on the frame, and the recognized label (if any) on the first one.
+        """
+        for (x_, y_, w, h) in faces:
+            # draw the face detected
+            cv2.rectangle(frame, (x_, y_), (x_+w, y_+h), (255, 0, 0), 2)
+        if len(faces) != 0 and label is not None and label.lower() != "unknown":
+            (x_, y_, _, _) = faces[0]
+            self.draw_label(frame, label, x_, y_)
+        return frame
 
-                # load the image
-                imgtest = cv2.imread(path, cv2.IMREAD_COLOR)
-                try:
-                    img_gray = cv2.cvtColor(imgtest, cv2.COLOR_BGR2GRAY)
-                except:
-                    print(f"---Photo {file} skipped because there is no face---\n")
-                    continue
-                image_array = np.array(imgtest, "uint8")
-
-                # get the faces detected in the image
-                frontal_faces = frontal_face_cascade.detectMultiScale(img_gray, scaleFactor=1.1, minNeighbors=5)
-                profile_faces = np.array([])
-
-                if len(frontal_faces) == 0:
-                    profile_faces = side_face_cascade.detectMultiScale(img_gray, scaleFactor=1.1, minNeighbors=5)
-                    if len(profile_faces) == 0:
-                        print(f"---Photo {file} skipped because it doesn't contain any face---\n")
-                        os.remove(path)
-                        continue
-                    else:
-                        faces = profile_faces
-                else:
-                    faces = frontal_faces
-                
-                # save the detected face(s) and associate
-                # them with the label
-                for (x_, y_, w, h) in faces:
-                    # resize the detected face to 224x224
-                    size = (image_width, image_height)
-
-                    # detected face region
-                    roi = image_array[y_: y_ + h, x_: x_ + w]
-
-                    # resize the detected head to target size
-                    resized_image = cv2.resize(roi, size)
-                    image_array = np.array(resized_image, "uint8")
-
-                    # remove the original image
-                    if os.path.exists(path): os.remove(path)
-
-                    # replace the image with only the face
-                    im = Image.fromarray(image_array)
-                    new_file_name = f"{file.split('.')[0]}_processed.jpg"
-                    new_path = os.path.join(root, new_file_name)
-                    im.save(new_path)          
-                
     def detect_faces(self, frame):
-        gray  = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+        faces = self.locate_faces(frame)
         face_present = len(faces) != 0
         if not face_present:
             return frame, frame, False
-        for (x_, y_, w, h) in faces:
-            # draw the face detected
-            cv2.rectangle(frame, (x_, y_), (x_+w, y_+h), (255, 0, 0), 2)
+        self.annotate(frame, faces)
         (x_, y_, w, h) = faces[0]
         roi = frame[y_:y_+h, x_:x_+w]
         return frame, roi, True
\ No newline at end of file
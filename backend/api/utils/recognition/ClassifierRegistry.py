@@ -0,0 +1,65 @@
+import time
+import importlib
+import threading
+from bsproject import settings
+
+# Available classifiers: name -> (module, class). The module is imported only when the classifier is used,
+# since each one pulls in heavy dependencies (TensorFlow and deepface, dlib, sklearn...)
+CLASSIFIERS = {
+    "LBPHF": ("api.utils.recognition.classifiers.LBPHF", "LBPHF"),
+    "SVC": ("api.utils.recognition.classifiers.SVC", "SVC"),
+    "VGGFACE": ("api.utils.recognition.classifiers.DeepFace", "DeepFaceClassifier"),
+    "REMOTE": ("api.utils.inference.RemoteClassifier", "RemoteClassifier"), # Proxy of the classifier served by the inference server
+}
+
+
+class ClassifierRegistry:
+    """
+    Builds the classifiers by name on first use, and then always returns the same instance.
+    It also records how long importing and building each classifier took.
+    """
+    def __init__(self, classifiers=CLASSIFIERS) -> None:
+        self.classifiers = classifiers
+        self.instances = {}
+        self.timings = {} # name -> {"IMPORT_S": float, "BUILD_S": float}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Returns the classifier with the given name, importing and building it if it's the first time.
+        """
+        name = name.upper()
+        if name not in self.classifiers:
+            raise ValueError(f"Unknown classifier {name}, choose between {', '.join(self.classifiers)}")
+        with self.lock: # A single build, even if many requests need the classifier at the same time
+            if name not in self.instances:
+                self.instances[name] = self.build(name)
+            return self.instances[name]
+
+    def get_class(self, name):
+        """
+        Returns the class of the classifier, importing its module but without building it.
+        """
+        module_name, class_name = self.classifiers[name.upper()]
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def build(self, name):
+        start = time.perf_counter()
+        classifier_class = self.get_class(name)
+        imported = time.perf_counter()
+        classifier = classifier_class()
+        built = time.perf_counter()
+        self.timings[name] = {"IMPORT_S": imported - start, "BUILD_S": built - imported}
+        print(f"Classifier {name} ready: imported in {imported - start:.2f}s, built in {built - imported:.2f}s")
+        return classifier
+
+
+registry = ClassifierRegistry()
+
+def get_classifier(name=None):
+    """
+    Returns the classifier in use, built on first use: settings.CLASSIFIER_NAME by default, or its proxy if the inference server is used.
+    """
+    if name is None and settings.INFERENCE_SERVER:
+        name = "REMOTE"
+    return registry.get(name or settings.CLASSIFIER_NAME)
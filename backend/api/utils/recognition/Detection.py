@@ -0,0 +1,66 @@
+import cv2
+from functools import cached_property
+
+
+class Detection:
+    """
+    Result of the detection stage of a frame (see Classifier.detect), shared by the following recognition step so the frame
+    is converted and scanned only once.
+    The color conversions are computed lazily, the first time they're used, and then reused.
+    The detector can run on a copy of the frame scaled by scale, and only inside region (x, y, w, h) if given,
+    while faces are always in the coordinates of the original frame, so the recognition crops them at full resolution.
+    """
+    def __init__(self, frame, scale=1., region=None) -> None:
+        self.frame = frame # BGR, as received
+        self.scale = scale
+        self.region = region
+        self.faces = [] # (x, y, w, h) boxes
+
+    def set_region(self, region):
+        """
+        Changes the region to scan (None for the whole frame), the full frame views are kept.
+        """
+        self.region = region
+        self.__dict__.pop("small_gray", None)
+        self.__dict__.pop("small_rgb", None)
+
+    def scan(self, image):
+        """
+        Crops the region from a full frame view and scales it.
+        """
+        if self.region is not None:
+            x, y, w, h = self.region
+            image = image[y:y+h, x:x+w]
+        if self.scale == 1.:
+            return image
+        return cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+
+    @cached_property
+    def rgb(self):
+        return cv2.cvtColor(self.frame, cv2.COLOR_BGR2RGB)
+
+    @cached_property
+    def small_gray(self):
+        """
+        The grayscale image the detector runs on.
+        """
+        return self.scan(self.gray)
+
+    @cached_property
+    def small_rgb(self):
+        return self.scan(self.rgb)
+
+    def to_frame(self, boxes):
+        """
+        Converts boxes found on the scanned image to the coordinates of the original frame.
+        """
+        offset_x, offset_y = self.region[:2] if self.region is not None else (0, 0)
+        frame_boxes = []
+        for box in boxes:
+            x, y, w, h = (int(round(v / self.scale)) for v in box)
+            frame_boxes.append((x + offset_x, y + offset_y, w, h))
+        return frame_boxes
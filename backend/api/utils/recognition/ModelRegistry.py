@@ -0,0 +1,64 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class ModelRegistry:
+    """
+    Keeps the published versions of the trained model of a classifier.
+    A published model is never modified: a training builds a new model and publishes it as a new version (copy-on-write),
+    so the users of an older version (e.g. a consumer which pinned it) can keep using it safely while the swap happens.
+    Each version can record the signature of the saved model it matches (see Classifier.saved_signature), so a model saved
+    by another process is noticed (see is_stale).
+    """
+    def __init__(self, max_versions=3) -> None:
+        self.max_versions = max_versions # Old versions kept available to get(version)
+        self.lock = threading.RLock()
+        self.versions = OrderedDict()
+        self.latest_version = 0 # 0 means that nothing has been published yet
+        self.published_at = None
+        self.signature = None # Signature of the saved model of the latest version
+
+    def publish(self, model, signature=None):
+        """
+        Publishes a new version of the model, which becomes the latest one, and returns its version number.
+        """
+        with self.lock:
+            self.signature = signature
+            self.latest_version += 1
+            self.versions[self.latest_version] = model
+            self.published_at = time.time()
+            while len(self.versions) > self.max_versions:
+                self.versions.popitem(last=False)
+            return self.latest_version
+
+    def get(self, version=None):
+        """
+        Returns (version, model) for the given version (the latest one if None), None if it isn't available.
+        """
+        with self.lock:
+            version = version or self.latest_version
+            if version not in self.versions:
+                return None
+            return version, self.versions[version]
+
+    def get_or_load(self, loader, signature=None):
+        """
+        Returns (version, model) of the latest version; if nothing has been published yet, loader() is called once to build the first model.
+        signature - optional callable returning the signature of the saved model, called before loading it
+        """
+        current = self.get()
+        if current is not None:
+            return current
+        with self.lock:
+            if self.latest_version == 0:
+                loaded_signature = signature() if signature is not None else None
+                self.publish(loader(), loaded_signature)
+            return self.get()
+
+    def is_stale(self, signature):
+        """
+        Tells if the saved model has another signature than the latest version, e.g. because another process trained a new one.
+        """
+        with self.lock:
+            return self.latest_version != 0 and signature != self.signature
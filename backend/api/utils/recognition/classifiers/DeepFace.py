@@ -1,73 +1,196 @@
 from deepface import DeepFace
+from deepface.commons import functions
 from ..Classifier import Classifier
+from ..matchers.GalleryMatcher import GalleryMatcher
+from ..matchers.IVFMatcher import IVFMatcher
+from ..stores.FeatureStore import file_hash
+from ..stores.GalleryFile import GalleryFile
 import cv2
 import pandas as pd
-from scipy.spatial.distance import cosine
 import os
 import numpy as np
 
 class DeepFaceClassifier(Classifier):
     def __init__(self) -> None:
         super().__init__()
-        self.GALLERY_PATH = os.path.join(self.models_root, "vggface_gallery.npy")
+        self.GALLERY_PATH = os.path.join(self.models_root, "vggface_gallery.bin")
+        self.PICKLED_GALLERY_PATH = os.path.join(self.models_root, "vggface_gallery.npy")
+        self.INDEX_PATH = os.path.join(self.models_root, "vggface_gallery_ivf.npz")
         self.THRESHOLD = 0.8
-        self.gallery = self.load_gallery()
+        self.INDEX_MODE = "exact" # "exact" scans the whole gallery, "ivf" uses the approximate inverted file index (for very large galleries)
+        self.IVF_LISTS = None # Number of clusters of the IVF index, None means about sqrt(gallery size)
+        self.IVF_PROBES = 8 # Number of clusters scanned for each probe: the higher, the better the recall but the slower the search
         self.model = DeepFace.build_model("VGG-Face") #Otherwise it would build it on every call for every operation, this is more efficient
-        self.name = "VGGFACE" #TODO: remove it once the switch from in the consumer.py file is removed
+        self.name = "VGGFACE"
+        self.FEATURE_EXTRACTOR = ("VGG-Face", {"detector_backend": "opencv"}) # Name and parameters of the feature vectors in the feature store
 
     def load_gallery(self):
         """
-        Loads the gallery array from the file system, if exists
+        Loads the gallery from the file system, returning (gallery, matcher of its feature vectors).
+        The gallery is a dictionary {sample path (relative to the samples directory): (label, sample signature, feature vector)}
+        The pickled gallery of the older versions is converted to the current format the first time it's loaded.
         """
-        if os.path.exists(self.GALLERY_PATH):
-            return np.load(self.GALLERY_PATH, allow_pickle=True)
-        return np.array([])
+        if not GalleryFile(self.GALLERY_PATH).exists():
+            legacy_gallery = self.load_legacy_gallery()
+            if legacy_gallery is not None:
+                self.write_gallery(legacy_gallery)
+            elif not GalleryFile(self.GALLERY_PATH).exists(): # It wasn't converted by another worker in the meantime either
+                return {}, GalleryMatcher()
+        labels, matrix, columns = GalleryFile(self.GALLERY_PATH).read()
+        entries = zip(columns["sources"], labels.tolist(), columns["signatures"], matrix)
+        gallery = {source: (label, tuple(signature), vector) for source, label, signature, vector in entries}
+        matcher = GalleryMatcher()
+        matcher.set_normalized(labels, matrix) # The vectors are saved normalized, so the matcher searches the memory-mapped file directly
+        return gallery, matcher
+
+    def load_legacy_gallery(self):
+        """
+        Returns the gallery saved by the older versions (None if there isn't any): the .npy of pickled (label, vector) tuples.
+        """
+        if os.path.exists(self.PICKLED_GALLERY_PATH):
+            # The old gallery doesn't say which file each vector comes from, so it's only used until the next training rebuilds it
+            legacy_gallery = np.load(self.PICKLED_GALLERY_PATH, allow_pickle=True)
+            return {f"legacy/{i}": (label, (-1, -1), np.asarray(vector, dtype=np.float32)) for i, (label, vector) in enumerate(legacy_gallery)}
+        return None
+
+    def model_files(self):
+        return [GalleryFile(self.GALLERY_PATH).pointer_path]
+
+    def load_model(self):
+        gallery, matcher = self.load_gallery()
+        return {"gallery": gallery, "matcher": self.build_matcher(matcher)}
+
+    def write_gallery(self, gallery):
+        """
+        Saves the gallery atomically on the file system (see GalleryFile), with its feature vectors normalized, and removes the older files.
+        """
+        sources = list(gallery.keys())
+        vectors = GalleryMatcher.normalize([gallery[source][2] for source in sources]) if sources else []
+        columns = {"sources": sources, "signatures": [list(gallery[source][1]) for source in sources]}
+        GalleryFile(self.GALLERY_PATH).write([gallery[source][0] for source in sources], vectors, columns)
+        for path in (self.PICKLED_GALLERY_PATH, self.INDEX_PATH): # The old index doesn't describe the new gallery
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def save_gallery(self, gallery):
+        """
+        Replaces the gallery, saving it on the file system, and publishes it with its new matcher.
+        """
+        self.write_gallery(gallery)
+        self.publish(self.load_model())
+
+    def build_matcher(self, matcher):
+        """
+        Returns the matcher used to search the gallery according to INDEX_MODE: the given exact matcher,
+        or in "ivf" mode an index on top of it (the one saved next to the gallery is reused if it was built for it).
+        """
+        if self.INDEX_MODE == "ivf":
+            return IVFMatcher.from_gallery(matcher, self.INDEX_PATH, n_lists=self.IVF_LISTS, n_probe=self.IVF_PROBES)
+        return matcher
 
     def build_gallery(self):
         """
-        For each image in the samples directory, it builds the feature vector using VGG Face model, and adds it to the gallery
-        then the gallery is saved on the file system, replacing an old one if exists.
-        """
-        gallery = []
-        for root, dirs, files in os.walk(self.image_dir):
-            for file in files:
-                path = os.path.join(root, file) # Save the path of each image
-                name = os.path.basename(os.path.dirname(path)).replace(" ", "-").lower() # Save the label of each image
-                image = cv2.imread(path)
-                #TODO: in this way, each time the whole gallery is converted to feature vectors, and not only the newest photos
-                try:
-                    feature_vector = DeepFace.represent(image)
-                    gallery.append((name, feature_vector))
-                except:
-                    pass
-        self.gallery = np.array(gallery)
-        np.save(self.GALLERY_PATH, self.gallery)
+        Updates the gallery with the images in the samples directory: only the new (or modified) images are converted to feature vectors
+        using VGG Face model (unless the feature store already has them), while the vectors of the images that don't exist anymore are dropped. Then the gallery is saved on the file system.
+        """
+        _, model = self.current_model()
+        features = self.feature_table(*self.FEATURE_EXTRACTOR)
+        gallery = {}
+        keys = []
+        for path, label in self.list_samples():
+            source = os.path.relpath(path, self.image_dir)
+            signature = self.sample_signature(path)
+            key = file_hash(path)
+            keys.append(key)
+            entry = model["gallery"].get(source)
+            if entry is not None and entry[0] == label and entry[1] == signature: # Already in the gallery
+                gallery[source] = entry
+                continue
+            feature_vector = features.get_or_compute(key, lambda: self.represent_sample(path))
+            if feature_vector is not None:
+                gallery[source] = (label, signature, feature_vector)
+        features.prune(keys, owner=self.name) # Saves the new vectors and drops the ones of the deleted images
+        self.save_gallery(gallery)
+
+    def represent_sample(self, path):
+        """
+        Returns the feature vector of the face in the sample image, None if there isn't any face (or it isn't an image).
+        The other errors are raised, so they aren't stored in the feature store as images without faces.
+        """
+        image = cv2.imread(path)
+        if image is None:
+            return None
+        try:
+            return DeepFace.represent(image, model=self.model)
+        except ValueError: # Raised by DeepFace when the face can't be detected
+            return None
+
+    def remove_samples(self, paths):
+        """
+        Drops the feature vectors of the given sample images from the gallery.
+        """
+        removed = {os.path.relpath(path, self.image_dir) for path in paths}
+        with self.training_lock:
+            _, model = self.current_model()
+            if removed.isdisjoint(model["gallery"]): return
+            self.save_gallery({source: entry for source, entry in model["gallery"].items() if source not in removed})
 
     def train(self):
         """
         Trains the model, in this case this means to build the gallery from the enrolling images' feature vectors. 
         """
-        self.build_gallery()
-        
-    def recognize(self, frame: str):
+        with self.training_lock:
+            self.build_gallery()
+
+    def identify(self, frame, model=None, detection=None):
         """
-        Given in input a frame, it returns:
-        frame - the modified frame, with the rectangle drawn on the face location
+        Given in input a frame (and optionally the trained model to use, by default the latest published one), it returns:
+        faces - the face locations as (x, y, w, h), the first one is the recognized face
         best_label - the best label (None if the face is not present, "unknwon" if the person isn't recognized)
         confidence - the similarity from the best match (None if not recognized or the face isn't present)
         """
-        similarities = []
-        frame, roi, face_present = self.detect_faces(frame)
-        if not face_present: return frame, None, None
-        probe_feature_vector = DeepFace.represent(roi, model=self.model, detector_backend='skip')
+        if detection is None: detection = self.detect(frame)
+        return self.identify_batch([detection], model)[0]
 
-        for (label, feature_vector) in self.gallery:
-            similarity = 1 - cosine(feature_vector, probe_feature_vector)
-            similarities.append((label, similarity))
-        best_label, best_similarity = max(similarities, key=lambda x: x[1])
+    def identify_batch(self, detections, model=None):
+        """
+        Same as identify for several detected frames: the faces of all the frames are embedded with a single forward pass of VGG Face.
+        """
+        if model is None: _, model = self.current_model()
+        results = [(list(detection.faces), None, None) for detection in detections]
+        with_faces = [index for index, detection in enumerate(detections) if detection.faces]
+        if not with_faces: return results
+        rois = []
+        for index in with_faces:
+            (x_, y_, w, h) = detections[index].faces[0]
+            rois.append(detections[index].frame[y_:y_+h, x_:x_+w])
+        for index, probe_feature_vector in zip(with_faces, self.embed(rois)):
+            results[index] = (results[index][0], *self.match(probe_feature_vector, model))
+        return results
+
+    def embed(self, faces):
+        """
+        Returns the feature vectors of the face crops (BGR), preprocessed like DeepFace.represent without detection, in a single batch.
+        """
+        input_x, input_y = functions.find_input_shape(self.model)
+        batch = [
+            functions.normalize_input(functions.preprocess_face(img=face, target_size=(input_y, input_x), enforce_detection=False, detector_backend="skip"))
+            for face in faces
+        ]
+        return self.model.predict(np.vstack(batch), verbose=0)
+
+    def match(self, probe_feature_vector, model):
+        """
+        Returns (label, similarity) of the best match in the gallery, ("Unknown", None) if it isn't similar enough.
+        """
+        matches = model["matcher"].search(probe_feature_vector, k=1)
+        if not matches: return "Unknown", None
+        best_label, best_similarity = matches[0]
         if best_similarity >= self.THRESHOLD:
-            return frame, best_label, best_similarity
-        return frame, "Unknown", None
+            return best_label, best_similarity
+        return "Unknown", None
 
 if __name__ == "__main__":
     def test_with_cam():
@@ -1,5 +1,6 @@
 import os
 import cv2
+import json
 import pickle
 
 from PIL import Image
@@ -11,125 +12,227 @@ class LBPHF(Classifier):
     def __init__(self):
         super().__init__()
         self.name = "LBPHF"
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create(
-                            radius = 1, # The radius used for building the Circular Local Binary Pattern. The greater the radius, the smoother the image but more spatial information you can get
-                            neighbors = 8, # The number of sample points to build a Circular Local Binary Pattern. An appropriate value is to use 8 sample points. Keep in mind: the more sample points you include, the higher the computational cost
-                            grid_x = 8, # The number of cells in the horizontal direction, 8 is a common value used in publications. The more cells, the finer the grid, the higher the dimensionality of the resulting feature vector
-                            grid_y = 8, # The number of cells in the vertical direction, 8 is a common value used in publications. The more cells, the finer the grid, the higher the dimensionality of the resulting feature vector
-                        )         
-        self.labels_file_name = "face_labels_lbphf.pickle"
+        self.labels_file_name = "face_labels_lbphf.json" # Label table {label: id}, with a version
+        self.legacy_labels_file_name = "face_labels_lbphf.pickle"
         self.model_file_name = "lbphf_model.yml"
-        self.labels = self.load_labels()
+        self.manifest_file_name = "lbphf_manifest.json"
         self.scaleFactor = 1.1 # Parameter specifying how much the image size is reduced at each image scale. It is used to create the scale pyramid.
         self.minNeighbors = 3 # Parameter specifying how many neighbors each candidate rectangle should have, to retain it. A higher number gives lower false positives. 
         self.minSize = (30, 30) # Minimum rectangle size to be considered a face.
 
-    def load_labels(self):
+    def create_recognizer(self):
+        return cv2.face.LBPHFaceRecognizer_create(
+                    radius = 1, # The radius used for building the Circular Local Binary Pattern. The greater the radius, the smoother the image but more spatial information you can get
+                    neighbors = 8, # The number of sample points to build a Circular Local Binary Pattern. An appropriate value is to use 8 sample points. Keep in mind: the more sample points you include, the higher the computational cost
+                    grid_x = 8, # The number of cells in the horizontal direction, 8 is a common value used in publications. The more cells, the finer the grid, the higher the dimensionality of the resulting feature vector
+                    grid_y = 8, # The number of cells in the vertical direction, 8 is a common value used in publications. The more cells, the finer the grid, the higher the dimensionality of the resulting feature vector
+                )
+
+    def load_label_ids(self):
+        """
+        Returns the saved labels as {label: id}. The pickled labels of the older versions are read until the next training replaces them.
+        """
         labels_path = os.path.join(self.labels_root, self.labels_file_name)
-        if not os.path.exists(labels_path): 
-            return {}
-        with open(labels_path, "rb") as f:
-            og_labels = pickle.load(f) 
-            labels = {v:k for k,v in og_labels.items()} # Inverting key with value
+        if os.path.exists(labels_path):
+            with open(labels_path, "r") as f:
+                return json.load(f)["labels"]
+        legacy_path = os.path.join(self.labels_root, self.legacy_labels_file_name)
+        if os.path.exists(legacy_path):
+            with open(legacy_path, "rb") as f:
+                return pickle.load(f)
+        return {}
+
+    def load_labels(self):
+        labels = {v:k for k,v in self.load_label_ids().items()} # Inverting key with value
         return labels
 
     def load_recognizer(self):
+        """
+        Returns a new recognizer, with the saved model loaded into it if exists.
+        """
+        recognizer = self.create_recognizer()
         recognizer_path = os.path.join(self.models_root, self.model_file_name)
         if os.path.exists(recognizer_path):
-            self.recognizer.read(recognizer_path)  
-    
-    def train(self):
-        current_id = 0
-        label_ids = self.load_labels()
+            recognizer.read(recognizer_path)  
+        return recognizer
+
+    def model_files(self):
+        return [os.path.join(self.models_root, self.model_file_name), os.path.join(self.labels_root, self.labels_file_name)]
+
+    def load_model(self):
+        return {"recognizer": self.load_recognizer(), "labels": self.load_labels()}
+
+    def load_manifest(self):
+        """
+        Returns the training manifest: {sample path (relative to the samples directory): {"signature": [mtime, size], "histograms": int}}
+        It records which samples are already inside the saved model, and how many histograms each of them added.
+        """
+        manifest_path = os.path.join(self.models_root, self.manifest_file_name)
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        manifest_path = os.path.join(self.models_root, self.manifest_file_name)
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    def save_training(self, recognizer, label_ids, manifest):
+        """
+        Saves the labels, the recognizer and the manifest on the file system, then publishes the new model.
+        """
+        label_path = os.path.join(self.labels_root, self.labels_file_name)
+        tmp_path = f"{label_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": 1, "labels": label_ids}, f)
+        os.replace(tmp_path, label_path)
+        legacy_path = os.path.join(self.labels_root, self.legacy_labels_file_name)
+        if os.path.exists(legacy_path): os.remove(legacy_path)
+        train_path = os.path.join(self.models_root, self.model_file_name)
+        tmp_path = os.path.join(self.models_root, f"tmp_{self.model_file_name}") # The extension tells OpenCV the format to use
+        recognizer.save(tmp_path)
+        os.replace(tmp_path, train_path)
+        self.save_manifest(manifest)
+        self.publish({"recognizer": recognizer, "labels": {v:k for k,v in label_ids.items()}})
+
+    def extract_faces(self, path):
+        """
+        Returns the training images of a sample: the whole grayscale image and each face detected inside it.
+        """
+        # Turn image into grayscale
+        image = Image.open(path).convert("L")
+
+        # Turn the image into a numpy array
+        image_array = np.array(image, "uint8") 
+        faces_images = [image_array]
+
+        # Face recognition
+        faces = self.face_cascade().detectMultiScale(
+            image_array, # Input grayscale image.
+            scaleFactor = self.scaleFactor,
+            minNeighbors = self.minNeighbors, 
+            minSize = self.minSize 
+        )
+
+        # Append the detected faces
+        for (x, y, w, h) in faces:
+            faces_images.append(image_array[y:y+h, x:x+w])
+        return faces_images
+
+    def collect_samples(self, samples, label_ids, manifest):
+        """
+        Extracts the training images of the given samples, assigning a new id to the new labels.
+        label_ids and manifest are updated in place, and the images are returned with their ids.
+        """
+        next_id = max(label_ids.values(), default=-1) + 1
         y_lables = [] # Number related to labels
         x_train = [] # Numbers of the pixel values
+        for path, label in samples:
+            # Assign id to labels
+            if not label in label_ids:
+                label_ids[label] = next_id
+                next_id += 1
+            id_ = label_ids[label]
+
+            faces_images = self.extract_faces(path)
+            x_train.extend(faces_images)
+            y_lables.extend([id_] * len(faces_images))
+            manifest[os.path.relpath(path, self.image_dir)] = {"signature": list(self.sample_signature(path)), "histograms": len(faces_images)}
+        return x_train, y_lables
+
+    def needs_compaction(self, manifest, samples):
+        """
+        The model has to be rebuilt if some samples inside it were modified or removed, since their histograms can't be taken out of it.
+        """
+        signatures = {os.path.relpath(path, self.image_dir): list(self.sample_signature(path)) for path, _ in samples}
+        return any(signatures.get(source) != entry["signature"] for source, entry in manifest.items())
+
+    def compact(self):
+        """
+        Rebuilds the model from scratch with the samples currently in the samples directory, removing duplicated or stale histograms.
+        """
+        with self.training_lock:
+            self.rebuild()
+
+    def rebuild(self):
+        print("Compacting the LBPHF model...")
+        label_ids = self.load_label_ids()
+        manifest = {}
+        x_train, y_lables = self.collect_samples(self.list_samples(), label_ids, manifest)
+        recognizer = self.create_recognizer()
+        if x_train:
+            recognizer.train(x_train, np.array(y_lables))
+        self.save_training(recognizer, label_ids, manifest)
+        print("Model compacted")
+    
+    def train(self):
+        with self.training_lock:
+            self.train_new_samples()
 
+    def train_new_samples(self):
+        """
+        Updates the saved model with the samples which aren't in it yet, or rebuilds it if needed.
+        """
         print("Inizio training...")
 
-        # For each file in the image directory
-        for root, dirs, files in os.walk(self.image_dir):
-            for file in files:
-                path = os.path.join(root, file) # Save the path of each image
-                label = os.path.basename(os.path.dirname(path)).replace(" ", "-").lower() # Save the label of each image
-                
-                # Assign id to labels
-                if not label in label_ids:
-                    label_ids[label] = current_id
-                    current_id += 1
-                id_ = label_ids[label]
-
-                # Turn image into grayscale
-                image = Image.open(path).convert("L")
-
-                # Turn the image into a numpy array
-                image_array = np.array(image, "uint8") 
-
-                x_train.append(image_array)
-                y_lables.append(id_)
-
-                # Face recognition
-                faces = self.face_cascade.detectMultiScale(
-                    image_array, # Input grayscale image.
-                    scaleFactor = self.scaleFactor,
-                    minNeighbors = self.minNeighbors, 
-                    minSize = self.minSize 
-                )
-
-                # Append the detected faces into x_train and their id into y_labels
-                for (x, y, w, h) in faces:
-                    roi = image_array[y:y+h, x:x+w]
-                    x_train.append(roi)
-                    y_lables.append(id_)
-
-        # Save labels into file
-        label_path = os.path.join(self.labels_root, self.labels_file_name)
-        with open(label_path, "wb") as f:
-            pickle.dump(label_ids, f)
-
-        # Train items
+        label_ids = self.load_label_ids()
+        manifest = self.load_manifest()
+        samples = self.list_samples()
         train_path = os.path.join(self.models_root, self.model_file_name)
-        if os.path.exists(train_path):
-            self.recognizer.read(train_path)
-        self.recognizer.update(x_train, np.array(y_lables))
-        self.recognizer.save(train_path)
+        if not os.path.exists(train_path) or self.needs_compaction(manifest, samples):
+            self.rebuild()
+            print("Fine training")
+            return
+
+        # Only the samples that aren't in the model yet are used to update it
+        new_samples = [(path, label) for path, label in samples if os.path.relpath(path, self.image_dir) not in manifest]
+        if not new_samples:
+            print("Fine training, no new samples")
+            return
+        recognizer = self.load_recognizer() # A new recognizer, the published one is still used for recognition
+        if len(recognizer.getHistograms()) != sum(entry["histograms"] for entry in manifest.values()):
+            # The model contains histograms which aren't in the manifest (e.g. duplicated by older trainings)
+            self.rebuild()
+            print("Fine training")
+            return
+        x_train, y_lables = self.collect_samples(new_samples, label_ids, manifest)
+        recognizer.update(x_train, np.array(y_lables))
+        self.save_training(recognizer, label_ids, manifest)
 
         print("Fine training")
 
-    def recognize(self, frame):
-        # Turn captured frame into gray scale
-        gray  = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    def identify(self, frame, model=None, detection=None):
+        if model is None: _, model = self.current_model()
+        recognizer, labels = model["recognizer"], model["labels"]
+        if detection is None: detection = self.detect(frame)
 
-        # Face recognition
-        faces = self.face_cascade.detectMultiScale(
-                    gray, # Input grayscale image.
-                    scaleFactor = self.scaleFactor,
-                    minNeighbors = self.minNeighbors, 
-                    minSize = self.minSize 
-                )
+        # The grayscale frame and the faces come from the detection stage
+        gray = detection.gray
+        faces = list(detection.faces)
         if len(faces) == 0:
             name = None
         else:
             name = "unknown"
         conf = 1
+        recognized = None # Face the label refers to
         # For each face...
         for (x, y, w, h) in faces:
             roi_gray = gray[y:y+h, x:x+w] # ...pick its Region of Intrest (from eyes to mouth)
 
             # Use deep learned model to identify the person
-            id_, conf = self.recognizer.predict(roi_gray)
+            id_, conf = recognizer.predict(roi_gray)
             conf /= 100.
             print(conf)
 
             # If confidence is good...
             if conf >= .70:
-                # ... write who he think he recognized
-                name = self.labels[id_]
-                super().draw_label(frame, name, x, y)
-            # Draw a rectangle around the face
-            color = (255, 0, 0) #BGR 0-255 
-            stroke = 2
-            end_cord_x = x + w
-            end_cord_y = y + h
-            cv2.rectangle(frame, (x, y), (end_cord_x, end_cord_y), color, stroke)
-                        
-        return frame, name, conf
\ No newline at end of file
+                # ... keep who he think he recognized
+                name = labels[id_]
+                recognized = (x, y, w, h)
+        if recognized is not None:
+            faces.remove(recognized)
+            faces.insert(0, recognized)
+        return faces, name, conf
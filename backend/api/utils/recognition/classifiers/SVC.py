@@ -7,24 +7,41 @@ import numpy as np
 from sklearn.svm import SVC as sklearn_SVC
 
 from api.utils.recognition.Classifier import Classifier
+from api.utils.recognition.matchers.NearestClassMean import NearestClassMean
+from api.utils.recognition.stores.FeatureStore import file_hash
+from api.utils.recognition.stores.GalleryFile import GalleryFile
 
 class SVC(Classifier):
     def __init__(self) -> None:
         super().__init__()
         self.name = "SVC"
-        self.labels_file_name = "face_labels_svc.pickle"
+        self.labels_file_name = "face_labels_svc.bin" # Encodings and names of the training samples (see GalleryFile)
+        self.legacy_labels_file_name = "face_labels_svc.pickle"
         self.model_file_name = "svc_model.pickle"
-        self.classifier = sklearn_SVC(C=1, kernel='linear', probability=True)
+        self.FEATURE_EXTRACTOR = ("face_recognition", {"model": "hog", "num_jitters": 1}) # Name and parameters of the encodings in the feature store
+        self.HEAD = "svc" # "svc" refits a linear SVM from scratch, "ncm" uses a nearest class mean head, which is much faster to refit as the users grow
         self.THRESHOLD = 0.8
 
     def load_labels(self):
-        pickle_path = os.path.join(self.labels_root, self.labels_file_name)
-        if not os.path.exists(pickle_path):
-            with open(pickle_path, "wb") as picle_file:
-                picle_file.write(pickle.dumps({}))
-        with open(pickle_path, 'rb') as pickle_file:
-            labels = pickle.load(pickle_file)
-        return labels
+        """
+        Returns the encodings and the names of the training samples, the encodings are memory-mapped from the labels file.
+        The pickled labels file of the older versions is converted the first time it's loaded.
+        """
+        labels_file = GalleryFile(os.path.join(self.labels_root, self.labels_file_name))
+        legacy_path = os.path.join(self.labels_root, self.legacy_labels_file_name)
+        if not labels_file.exists() and os.path.exists(legacy_path):
+            with open(legacy_path, 'rb') as pickle_file:
+                legacy_labels = pickle.load(pickle_file)
+            if legacy_labels:
+                labels_file.write(legacy_labels["names"], legacy_labels["encodings"])
+            try:
+                os.remove(legacy_path)
+            except FileNotFoundError: # Converted by another worker in the meantime
+                pass
+        if not labels_file.exists():
+            return {"encodings": np.empty((0, 0), dtype=np.float32), "names": np.array([], dtype=str)}
+        names, encodings, _ = labels_file.read()
+        return {"encodings": encodings, "names": names}
     
     def load_classifier(self):
         classifier_path = os.path.join(self.models_root, self.model_file_name)
@@ -33,74 +50,114 @@ class SVC(Classifier):
             classifier = pickle.load(pickle_file)
         return classifier
     
+    def model_files(self):
+        return [os.path.join(self.models_root, self.model_file_name), GalleryFile(os.path.join(self.labels_root, self.labels_file_name)).pointer_path]
+
+    def load_model(self):
+        return {"classifier": self.load_classifier(), "labels": self.load_labels()}
+
+    def build_head(self):
+        """
+        Returns a new, untrained, classification head according to HEAD.
+        """
+        if self.HEAD == "ncm":
+            return NearestClassMean()
+        return sklearn_SVC(C=1, kernel='linear', probability=True)
+
+    def encode_sample(self, path):
+        """
+        Returns the face encoding of the first face found in the sample image, None if there isn't any face.
+        """
+        image = cv2.imread(path)
+        try:
+            rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        except:
+            return None
+        boxes = face_recognition.face_locations(img=rgb, model="hog")
+        frame_encodings = face_recognition.face_encodings(face_image=rgb, known_face_locations=boxes)
+        return frame_encodings[0] if frame_encodings else None
+
     def train(self):
-        knownEncodings = []
-        knownNames = []
-
-        for root, dirs, files in os.walk(self.image_dir):
-            count = 0
-            for file in files:
-                print("[INFO] processing image {}/{}".format(count + 1, len(files)))
-                path = os.path.join(root, file) # Save the path of each image
-                name = os.path.basename(os.path.dirname(path)).replace(" ", "-").lower() # Save the label of each image
-                image = cv2.imread(path)
-                try:
-                    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                except:
-                    continue
-                boxes = face_recognition.face_locations(img=rgb, model="hog")
-
-                frame_encodings = face_recognition.face_encodings(face_image=rgb, known_face_locations=boxes)
-
-                if frame_encodings:
-                    knownEncodings.append(frame_encodings[0])
+        with self.training_lock:
+            knownEncodings = []
+            knownNames = []
+
+            # Only the photos that aren't in the feature store yet are encoded
+            encodings = self.feature_table(*self.FEATURE_EXTRACTOR)
+            samples = self.list_samples()
+            keys = []
+            for count, (path, name) in enumerate(samples):
+                key = file_hash(path)
+                keys.append(key)
+                if key not in encodings:
+                    print("[INFO] encoding image {}/{}".format(count + 1, len(samples)))
+                    encodings.put(key, self.encode_sample(path))
+                encoding = encodings.get(key)
+                if encoding is not None:
+                    knownEncodings.append(encoding)
                     knownNames.append(name)
-                count += 1
+            encodings.prune(keys, owner=self.name) # Saves the new encodings and drops the ones of the deleted photos
         
-        print("Stiamo generando il tuo file di encodings..")
-        data = {"encodings": np.array(knownEncodings), "names": np.array(knownNames)}
+            print("Stiamo generando il tuo file di encodings..")
+            data = {"encodings": np.array(knownEncodings), "names": np.array(knownNames)}
 
-        f = open(os.path.join(self.labels_root, self.labels_file_name), "wb")
-        f.write(pickle.dumps(data))
-        f.close()
+            GalleryFile(os.path.join(self.labels_root, self.labels_file_name)).write(data["names"], data["encodings"])
 
-        print("[INFO] start training face_encodings..")
-        X = data['encodings']
-        y = data['names']
+            print("[INFO] start training face_encodings..")
+            X = data['encodings']
+            y = data['names']
 
-        print(f"X shape: {X.shape}")
+            print(f"X shape: {X.shape}")
 
-        self.classifier.fit(X, y)
+            classifier = self.build_head() # A new head, the published one is still used for recognition
+            classifier.fit(X, y)
 
-        print("Saving classifier to local folder")
-        f = open(os.path.join(self.models_root, self.model_file_name), "wb")
-        f.write(pickle.dumps(self.classifier))
-        f.close()
-        print("Classifier saved!")
+            print("Saving classifier to local folder")
+            model_path = os.path.join(self.models_root, self.model_file_name)
+            tmp_path = f"{model_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pickle.dumps(classifier))
+            os.replace(tmp_path, model_path) # The other workers reload it as soon as it changes (see Classifier.refresh)
+            print("Classifier saved!")
+            self.publish({"classifier": classifier, "labels": self.load_labels()})
 
-    def recognize(self, frame):        
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        boxes = face_recognition.face_locations(img=rgb, model="hog")
+    def find_faces(self, detection):
+        """
+        The faces are detected with the HOG detector of face_recognition instead of the Haar cascade.
+        """
+        boxes = face_recognition.face_locations(img=detection.small_rgb, model="hog")
+        return detection.to_frame([(left, top, right - left, bottom - top) for (top, right, bottom, left) in boxes]) # face_recognition boxes are (top, right, bottom, left)
+
+    def identify(self, frame, model=None, detection=None):
+        if model is None: _, model = self.current_model()
+        classifier = model["classifier"]
+        if detection is None: detection = self.detect(frame)
+
+        rgb = detection.rgb
+        faces = list(detection.faces)
+        boxes = [(y, x + w, y + h, x) for (x, y, w, h) in faces]
 
         frame_encodings = face_recognition.face_encodings(face_image=rgb, known_face_locations=boxes)
         name = None
         confidence = 1
 
-        if frame_encodings:
-            predictions = self.classifier.predict_proba([frame_encodings[0]]).ravel()
+        if frame_encodings and classifier is None: # Nobody has been enrolled yet
+            name = "unknown"
+        elif frame_encodings:
+            predictions = classifier.predict_proba([frame_encodings[0]]).ravel()
             maxPred = np.argmax(predictions)
             confidence = predictions[maxPred]
 
             if confidence > self.THRESHOLD:
-                name = self.classifier.predict([frame_encodings[0]])[0]
+                name = classifier.predict([frame_encodings[0]])[0]
             else:
                 name = "unknown"
             print(name)
             print(confidence)
             print(f"Predictions: {predictions}")
         
-                
-        return frame, name, confidence
+
+        return faces, name, confidence
 
 if __name__ == "__main__":
     def test_with_cam():
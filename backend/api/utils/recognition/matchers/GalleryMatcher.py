@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class GalleryMatcher:
+    """
+    Exact cosine matcher over a gallery of feature vectors.
+    The templates are kept as a contiguous, L2-normalized float32 matrix (one row per template) with a separate label index,
+    so a probe is scored against the whole gallery with a single matrix product.
+    """
+    def __init__(self, labels=None, vectors=None) -> None:
+        self.labels = np.array([])
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        if labels is not None and vectors is not None:
+            self.set_gallery(labels, vectors)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Builds the matcher from an iterable of (label, feature_vector) pairs, e.g. the old object-dtype gallery array.
+        """
+        pairs = list(pairs)
+        if len(pairs) == 0:
+            return cls()
+        labels, vectors = zip(*pairs)
+        return cls(labels, vectors)
+
+    @staticmethod
+    def normalize(vectors):
+        """
+        Returns the vectors as a contiguous float32 matrix whose rows have unit L2 norm.
+        """
+        matrix = np.ascontiguousarray(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1 # Avoid dividing by zero for null vectors
+        return matrix / norms
+
+    def set_gallery(self, labels, vectors):
+        """
+        Replaces the whole gallery.
+        """
+        self.set_normalized(labels, self.normalize(vectors))
+
+    def set_normalized(self, labels, matrix):
+        """
+        Replaces the whole gallery with a matrix whose rows are already L2-normalized, without copying it (e.g. a memory-mapped gallery).
+        """
+        labels = np.asarray(labels)
+        if len(labels) != len(matrix):
+            raise ValueError(f"The gallery has {len(matrix)} vectors but {len(labels)} labels.")
+        self.labels = labels
+        self.matrix = matrix
+
+    def add(self, labels, vectors):
+        """
+        Appends new templates to the gallery.
+        """
+        if len(self) == 0:
+            self.set_gallery(labels, vectors)
+            return
+        self.set_gallery(np.concatenate([self.labels, np.asarray(labels)]), np.vstack([self.matrix, self.normalize(vectors)]))
+
+    def similarities(self, probes):
+        """
+        Returns the (n_probes, n_templates) matrix of cosine similarities between the probes and the gallery.
+        """
+        probes = self.normalize(probes)
+        return probes @ self.matrix.T
+
+    def search(self, probe, k=1):
+        """
+        Returns the k most similar templates to the probe as a list of (label, similarity), sorted by decreasing similarity.
+        """
+        if len(self) == 0:
+            return []
+        scores = self.similarities(probe)[0]
+        k = min(k, len(scores))
+        if k < len(scores):
+            best = np.argpartition(-scores, k - 1)[:k] # Top-k in linear time, only those are sorted
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return list(zip(self.labels[best].tolist(), scores[best].tolist()))
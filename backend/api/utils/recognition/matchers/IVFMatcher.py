@@ -0,0 +1,157 @@
+import os
+import json
+import uuid
+import hashlib
+import numpy as np
+
+from .GalleryMatcher import GalleryMatcher
+
+
+class IVFMatcher(GalleryMatcher):
+    """
+    Approximate cosine matcher based on an inverted file index (IVF).
+    The gallery is partitioned into n_lists clusters with spherical k-means, and a probe is only scored against the templates
+    of the n_probe clusters whose centroids are the most similar to it.
+    Knobs:
+    n_lists - number of clusters (None means about sqrt(gallery size)); more lists means smaller lists to scan
+    n_probe - number of clusters scanned for each probe; higher means better recall but higher latency
+    """
+    def __init__(self, labels=None, vectors=None, n_lists=None, n_probe=8, n_iter=10, seed=0) -> None:
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.assignments = np.array([], dtype=np.int32)
+        self.lists = []
+        super().__init__(labels, vectors)
+
+    def set_gallery(self, labels, vectors):
+        super().set_gallery(labels, vectors)
+        self.train()
+
+    def add(self, labels, vectors):
+        """
+        Appends new templates to the gallery, assigning them to the existing clusters without retraining them.
+        """
+        if len(self) == 0 or len(self.centroids) == 0:
+            self.set_gallery(labels, vectors)
+            return
+        GalleryMatcher.set_gallery(self, np.concatenate([self.labels, np.asarray(labels)]), np.vstack([self.matrix, self.normalize(vectors)]))
+        new_assignments = self.assign(self.matrix[len(self.assignments):])
+        self.set_assignments(np.concatenate([self.assignments, new_assignments]))
+
+    def train(self):
+        """
+        Clusters the gallery with spherical k-means and builds the inverted lists.
+        """
+        n_templates = len(self.matrix)
+        if n_templates == 0:
+            self.centroids = np.empty((0, 0), dtype=np.float32)
+            self.set_assignments(np.array([], dtype=np.int32))
+            return
+        n_lists = self.n_lists or int(np.sqrt(n_templates))
+        n_lists = max(1, min(n_lists, n_templates))
+        rng = np.random.default_rng(self.seed)
+
+        # Train on a sample of the gallery, 256 points per list are enough to place the centroids
+        sample_size = min(n_templates, 256 * n_lists)
+        sample = self.matrix[rng.choice(n_templates, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+        for _ in range(self.n_iter):
+            sample_assignments = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(n_lists):
+                members = sample[sample_assignments == list_id]
+                if len(members) != 0: # Empty clusters keep their old centroid
+                    centroids[list_id] = members.sum(axis=0)
+            centroids = self.normalize(centroids)
+        self.centroids = centroids
+        self.set_assignments(self.assign(self.matrix))
+
+    def assign(self, vectors, batch_size=4096):
+        """
+        Returns the id of the most similar centroid for each (normalized) vector.
+        """
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch_size):
+            batch = vectors[start:start + batch_size]
+            assignments[start:start + batch_size] = np.argmax(batch @ self.centroids.T, axis=1)
+        return assignments
+
+    def set_assignments(self, assignments):
+        """
+        Stores the cluster of each template and rebuilds the inverted lists (the row indices of the templates of each cluster).
+        """
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def search(self, probe, k=1):
+        """
+        Returns the approximate k most similar templates to the probe as a list of (label, similarity), sorted by decreasing similarity.
+        """
+        if len(self) == 0:
+            return []
+        probe = self.normalize(probe)[0]
+        n_probe = min(self.n_probe, len(self.centroids))
+        centroid_scores = self.centroids @ probe
+        probed_lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        candidates = np.concatenate([self.lists[i] for i in probed_lists])
+        if len(candidates) == 0:
+            return []
+        scores = self.matrix[candidates] @ probe
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return list(zip(self.labels[candidates[best]].tolist(), scores[best].tolist()))
+
+    def save_index(self, path):
+        """
+        Saves the trained index (centroids and template assignments) on the file system, with the hash of the gallery it was built for.
+        The gallery itself is not saved, since it's stored separately.
+        """
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp" # Several processes may rebuild the index at the same time
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, assignments=self.assignments, n_lists=len(self.centroids), gallery_hash=self.gallery_hash())
+        os.replace(tmp_path, path)
+
+    def gallery_hash(self):
+        """
+        Returns the SHA-1 of the gallery (labels and vectors).
+        """
+        sha1 = hashlib.sha1(json.dumps([str(label) for label in self.labels]).encode("utf-8"))
+        sha1.update(np.ascontiguousarray(self.matrix, dtype=np.float32).data)
+        return sha1.hexdigest()
+
+    def load_index(self, path):
+        """
+        Loads a previously saved index for the current gallery, returns False if it doesn't exist or it was built for another gallery.
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            centroids, assignments = data["centroids"], data["assignments"]
+            gallery_hash = str(data["gallery_hash"]) if "gallery_hash" in data else None
+        if len(assignments) != len(self.matrix) or (len(centroids) != 0 and centroids.shape[1] != self.matrix.shape[1]):
+            return False
+        if gallery_hash != self.gallery_hash(): # Same size, but other templates
+            return False
+        self.centroids = centroids.astype(np.float32)
+        self.set_assignments(assignments)
+        return True
+
+    @classmethod
+    def from_gallery(cls, matcher, index_path=None, **params):
+        """
+        Builds the index on top of an exact matcher's gallery, reusing the index saved in index_path if it matches the gallery,
+        otherwise the index is trained and saved there.
+        """
+        ivf = cls(**params)
+        GalleryMatcher.set_normalized(ivf, matcher.labels, matcher.matrix) # Shares the matrix of the exact matcher
+        if index_path is not None and ivf.load_index(index_path):
+            return ivf
+        ivf.train()
+        if index_path is not None:
+            ivf.save_index(index_path)
+        return ivf
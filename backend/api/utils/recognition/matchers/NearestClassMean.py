@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class NearestClassMean:
+    """
+    Nearest class mean classifier with the same interface of the sklearn classifiers used here (fit, predict, predict_proba, classes_).
+    Fitting only averages the encodings of each class, so refitting it takes linear time, and partial_fit adds new samples
+    without going through the old ones again.
+    The probabilities are a softmax over the negative squared distances from the class means, with an extra "nobody" class placed at
+    reject_distance from every face: its probability is dropped, so rows sum to less than 1 when the face is far from every enrolled person.
+    """
+    def __init__(self, temperature=0.05, reject_distance=0.6) -> None:
+        self.temperature = temperature
+        self.reject_distance = reject_distance # 0.6 is the usual tolerance between face_recognition encodings of the same person
+        self.classes_ = np.array([])
+        self.sums = np.empty((0, 0))
+        self.counts = np.array([])
+        self.means = np.empty((0, 0))
+
+    def fit(self, X, y):
+        self.classes_ = np.array([])
+        self.sums = np.empty((0, 0))
+        self.counts = np.array([])
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        classes = np.union1d(self.classes_, np.unique(y)) if len(self.classes_) else np.unique(y)
+        sums = np.zeros((len(classes), X.shape[1]))
+        counts = np.zeros(len(classes))
+        if len(self.classes_): # Keep the statistics of the already known classes
+            old_indices = np.searchsorted(classes, self.classes_)
+            sums[old_indices] = self.sums
+            counts[old_indices] = self.counts
+        indices = np.searchsorted(classes, y)
+        np.add.at(sums, indices, X)
+        np.add.at(counts, indices, 1)
+        self.classes_, self.sums, self.counts = classes, sums, counts
+        self.means = sums / counts[:, None]
+        return self
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        distances = ((X[:, None, :] - self.means[None, :, :]) ** 2).sum(axis=2)
+        logits = -np.hstack([distances, np.full((len(X), 1), self.reject_distance ** 2)]) / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return probabilities[:, :-1]
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
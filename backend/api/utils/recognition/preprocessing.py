@@ -0,0 +1,88 @@
+'''
+Preprocessing of the sample images: each photo is replaced by the crop of the face it contains.
+The functions are at module level, and only depend on OpenCV, NumPy and PIL, so they can also run inside the worker processes
+of Classifier.preprocess_images without loading the classifiers (and their models) there.
+'''
+import os
+import cv2
+import numpy as np
+from PIL import Image
+
+FRONTAL_FACE_CASCADE = "haarcascade_frontalface_default.xml"
+PROFILE_FACE_CASCADE = "haarcascade_profileface.xml"
+
+# Outcomes of preprocess_image
+PROCESSED = "processed"
+NO_FACE = "no_face"
+UNREADABLE = "unreadable"
+SKIPPED = "skipped"
+
+# Cascades of the current worker process, created once by init_worker
+worker_cascades = None
+
+def load_cascades():
+    return (
+        cv2.CascadeClassifier(cv2.data.haarcascades + FRONTAL_FACE_CASCADE),
+        cv2.CascadeClassifier(cv2.data.haarcascades + PROFILE_FACE_CASCADE),
+    )
+
+def init_worker():
+    """
+    Initializer of the worker processes: each worker has its own cascade instances.
+    """
+    global worker_cascades
+    worker_cascades = load_cascades()
+
+def is_image_preprocessed(file_name):
+    return "processed" in file_name
+
+def processed_path(path):
+    """
+    Returns the path of the crop which replaces the image once it's preprocessed.
+    """
+    root, file = os.path.split(path)
+    return os.path.join(root, f"{file.split('.')[0]}_processed.jpg")
+
+def preprocess_image(path, frontal_face_cascade, side_face_cascade, size):
+    """
+    Detects a frontal (or, if missing, profile) face inside the image, crops it, resizes it to the given size and saves it in the same
+    directory, deleting the original image. Images without faces are deleted.
+    It returns the outcome: PROCESSED, NO_FACE, UNREADABLE or SKIPPED (already preprocessed).
+    """
+    root, file = os.path.split(path)
+    if is_image_preprocessed(file):
+        return SKIPPED
+
+    # load the image
+    imgtest = cv2.imread(path, cv2.IMREAD_COLOR)
+    try:
+        img_gray = cv2.cvtColor(imgtest, cv2.COLOR_BGR2GRAY)
+    except:
+        print(f"---Photo {file} skipped because it can't be read---\n")
+        return UNREADABLE
+    image_array = np.array(imgtest, "uint8")
+
+    # get the faces detected in the image
+    faces = frontal_face_cascade.detectMultiScale(img_gray, scaleFactor=1.1, minNeighbors=5)
+    if len(faces) == 0:
+        faces = side_face_cascade.detectMultiScale(img_gray, scaleFactor=1.1, minNeighbors=5)
+        if len(faces) == 0:
+            print(f"---Photo {file} skipped because it doesn't contain any face---\n")
+            os.remove(path)
+            return NO_FACE
+
+    # replace the image with only the face (if there are more faces, the last one is kept)
+    new_path = processed_path(path)
+    for (x_, y_, w, h) in faces:
+        # detected face region, resized to the target size
+        roi = image_array[y_: y_ + h, x_: x_ + w]
+        resized_image = np.array(cv2.resize(roi, size), "uint8")
+        Image.fromarray(resized_image).save(new_path)
+    if os.path.exists(path): os.remove(path)
+    return PROCESSED
+
+def preprocess_image_in_worker(path, size):
+    """
+    Same as preprocess_image, using the cascades of the worker process.
+    """
+    return preprocess_image(path, *worker_cascades, size)
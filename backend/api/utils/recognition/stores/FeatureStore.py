@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+from bsproject.paths import MODELS_ROOT
+
+
+def file_hash(path):
+    """
+    Returns the SHA-1 of the content of the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def array_hash(array):
+    """
+    Returns the SHA-1 of an image given as an array (its shape and type included), e.g. the dataset images of the evaluation.
+    """
+    array = np.ascontiguousarray(array)
+    sha1 = hashlib.sha1(f"{array.dtype.str}{array.shape}".encode("utf-8"))
+    sha1.update(array.data)
+    return sha1.hexdigest()
+
+
+class FeatureTable:
+    """
+    The features computed by one extractor (with some parameters) for the face images, keyed by the hash of the image.
+    The vectors are float32 rows appended to vectors.bin and read through a memory map, while index.json maps each image hash to its row
+    (-1 for the images where the extractor didn't find any face, so they aren't processed again).
+    The new features are kept in memory until save, which appends them under a lock file, so several processes can share the table.
+    The features of the images which their owners don't use anymore are dropped by prune, which compacts the rows into a new vectors file.
+    """
+    def __init__(self, path, extractor, params) -> None:
+        self.path = path
+        self.extractor = extractor
+        self.params = params
+        self.vectors_path = os.path.join(path, "vectors.bin")
+        self.index_path = os.path.join(path, "index.json")
+        self.lock_path = os.path.join(path, "lock")
+        self.LOCK_TIMEOUT = 30. # Seconds after which a lock file is considered left by a crashed process
+        self.lock = threading.RLock()
+        self.rows = {} # image hash -> row in vectors.bin, -1 if the image has no face
+        self.owners = {} # owner -> image hashes it uses (see prune)
+        self.dim = None
+        self.count = 0 # Rows of vectors.bin described by the index
+        self.vectors = None # Memory map of the rows
+        self.index_mtime = None
+        self.pending = {} # image hash -> vector (None if the image has no face), not saved yet
+        os.makedirs(self.path, exist_ok=True)
+        self.reload()
+
+    def reload(self):
+        """
+        Reads the index again if it was changed (e.g. by another process) since it was loaded.
+        """
+        with self.lock:
+            try:
+                mtime = os.stat(self.index_path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime == self.index_mtime:
+                return
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            self.rows = index["rows"]
+            self.owners = index.get("owners", {})
+            self.vectors_path = os.path.join(self.path, index.get("vectors", "vectors.bin")) # Changed by prune
+            self.dim = index["dim"]
+            self.count = index["count"]
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim)) if self.count else None
+            self.index_mtime = mtime
+
+    def __contains__(self, key):
+        return key in self.pending or key in self.rows
+
+    def __len__(self):
+        return len(self.rows) + len([key for key in self.pending if key not in self.rows])
+
+    def get(self, key):
+        """
+        Returns the vector of the image (a read-only view of the memory map), None if it has no face or isn't in the table.
+        """
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            row = self.rows.get(key, -1)
+            return None if row < 0 else self.vectors[row]
+
+    def put(self, key, vector):
+        with self.lock:
+            self.pending[key] = None if vector is None else np.asarray(vector, dtype=np.float32).ravel()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the vector of the image, calling compute() (which returns the vector or None) only if it isn't in the table yet.
+        """
+        if key not in self:
+            self.put(key, compute())
+        return self.get(key)
+
+    @contextmanager
+    def file_lock(self):
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if time.monotonic() > deadline: # Left by a crashed process
+                    try:
+                        os.remove(self.lock_path)
+                    except FileNotFoundError:
+                        pass
+                    deadline = time.monotonic() + self.LOCK_TIMEOUT
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(self.lock_path)
+
+    def save(self):
+        """
+        Appends the new features to the table on the file system, if there are any.
+        """
+        with self.lock:
+            if not self.pending: return
+            with self.file_lock():
+                self.reload() # Another process may have saved in the meantime
+                pending = {key: vector for key, vector in self.pending.items() if key not in self.rows}
+                vectors = [vector for vector in pending.values() if vector is not None]
+                dim = self.dim if self.dim is not None else (len(vectors[0]) if vectors else None)
+                if any(len(vector) != dim for vector in vectors):
+                    raise ValueError(f"The features of {self.extractor} must all have {dim} values")
+                rows = dict(self.rows)
+                count = self.count
+                if vectors:
+                    with open(self.vectors_path, "ab") as f:
+                        if f.tell() != count * dim * 4: # Rows left by a save which didn't complete
+                            f.truncate(count * dim * 4)
+                            f.seek(0, os.SEEK_END)
+                        f.write(np.array(vectors, dtype=np.float32).tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                for key, vector in pending.items():
+                    if vector is None:
+                        rows[key] = -1
+                    else:
+                        rows[key] = count
+                        count += 1
+                self.write_index(os.path.basename(self.vectors_path), dim, count, rows, self.owners) # The new rows are visible only once they're completely written
+                self.pending = {}
+                self.reload()
+
+    def prune(self, live_keys, owner):
+        """
+        Declares the images whose features the owner (e.g. the training of a classifier) uses now, and drops the features of the ones
+        it used before but not anymore (e.g. the samples deleted since the last training), unless another owner still uses them,
+        so the table doesn't keep growing. The features nobody declared (e.g. the ones of the evaluation datasets) are never dropped.
+        The new features are saved first. The kept rows are written to a new vectors file which the index points to,
+        because the old one may still be mapped by other processes (and can't be replaced while it is on Windows): it's removed
+        as soon as possible, here or at a later prune.
+        """
+        with self.lock:
+            self.save()
+            with self.file_lock():
+                self.reload()
+                owners = {name: set(keys) for name, keys in self.owners.items()}
+                used = owners.get(owner, set())
+                owners[owner] = {key for key in live_keys if key in self.rows}
+                still_used = set().union(*(keys for name, keys in owners.items() if name != owner), owners[owner])
+                dropped = used - still_used
+                if not dropped:
+                    if owners[owner] != used:
+                        self.write_index(os.path.basename(self.vectors_path), self.dim, self.count, self.rows, owners)
+                        self.reload()
+                    self.remove_unused_vectors()
+                    return
+                kept = sorted(row for key, row in self.rows.items() if key not in dropped and row >= 0)
+                new_rows = {row: new_row for new_row, row in enumerate(kept)}
+                rows = {key: new_rows.get(row, -1) for key, row in self.rows.items() if key not in dropped}
+                vectors_path = os.path.join(self.path, f"vectors.{time.time_ns():020d}.bin")
+                with open(vectors_path, "wb") as f:
+                    if kept: f.write(np.ascontiguousarray(self.vectors[kept]).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.write_index(os.path.basename(vectors_path), self.dim, len(kept), rows, owners)
+                self.reload()
+                self.remove_unused_vectors()
+
+    def write_index(self, vectors_name, dim, count, rows, owners):
+        tmp_path = f"{self.index_path}.tmp"
+        index = {
+            "extractor": self.extractor, "params": self.params, "vectors": vectors_name, "dim": dim, "count": count, "rows": rows,
+            "owners": {name: sorted(keys) for name, keys in owners.items()},
+        }
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def remove_unused_vectors(self):
+        """
+        Removes the vectors files replaced by a prune, except the ones still mapped on Windows.
+        """
+        current = os.path.basename(self.vectors_path)
+        for name in os.listdir(self.path):
+            if name != current and re.match(r"^vectors(\.\d+)?\.bin$", name):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except (PermissionError, FileNotFoundError):
+                    pass
+
+
+class FeatureStore:
+    """
+    Content-addressed store of the features of the face images, shared by the training and the evaluation of all the classifiers,
+    so no image is processed twice by the same extractor.
+    The features are keyed by (image hash, extractor name, extractor parameters): each extractor with some parameters has its own
+    FeatureTable, in the directory <extractor>_<hash of the parameters>.
+    """
+    def __init__(self, root=os.path.join(MODELS_ROOT, "features")) -> None:
+        self.root = root
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def table_path(self, extractor, params):
+        params_hash = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, f"{re.sub(r'[^A-Za-z0-9-]', '_', extractor)}_{params_hash}")
+
+    def table(self, extractor, params=None):
+        """
+        Returns the table of the extractor with the given parameters (a dict), up to date with the file system.
+        """
+        params = params or {}
+        path = self.table_path(extractor, params)
+        with self.lock:
+            table = self.tables.get(path)
+            if table is None:
+                table = self.tables[path] = FeatureTable(path, extractor, params)
+        table.reload()
+        return table
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+def get_feature_store(root=os.path.join(MODELS_ROOT, "features")):
+    """
+    Returns the feature store in the given directory, shared by the whole process.
+    """
+    with stores_lock:
+        if root not in stores:
+            stores[root] = FeatureStore(root)
+        return stores[root]
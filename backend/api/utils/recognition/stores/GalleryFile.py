@@ -0,0 +1,106 @@
+import os
+import re
+import json
+import time
+import struct
+import numpy as np
+
+
+class GalleryFile:
+    """
+    Compact on-disk format of a gallery: a float32 matrix (one row per template) with its label table, in a single file.
+    The matrix is opened with np.memmap, so loading the gallery doesn't deserialize it, and all the worker processes
+    which load the same gallery share its pages in the OS page cache.
+    Layout: a fixed header (HEADER), the label table as UTF-8 JSON ({"labels": [...], "columns": {name: [...]}}, where the columns
+    are optional extra values for each row), then the row-major matrix, aligned to ALIGNMENT bytes.
+    A mapped file can't be replaced or removed on Windows, so each save writes a new version (<name>.<stamp>.bin next to path)
+    and then switches the pointer file (<name>.current) to it. The older versions are removed once they aren't mapped anymore:
+    the removal is tried again at each save, keeping the previous KEEP_VERSIONS ones for the processes which are about to open them.
+    """
+    MAGIC = b"FACEGAL\0"
+    VERSION = 1
+    HEADER = struct.Struct("<8sIIQQQQ") # magic, version, dimension, rows, table offset, table length, matrix offset
+    ALIGNMENT = 64
+    KEEP_VERSIONS = 1
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.stem = os.path.splitext(path)[0]
+        self.pointer_path = f"{self.stem}.current"
+
+    def exists(self):
+        return os.path.exists(self.pointer_path) or os.path.exists(self.path)
+
+    def current_path(self):
+        """
+        Returns the path of the current version, the unversioned path if the gallery was saved before the versions existed.
+        """
+        try:
+            with open(self.pointer_path, "r") as f:
+                return os.path.join(os.path.dirname(self.path), f.read().strip())
+        except FileNotFoundError:
+            return self.path
+
+    def versions(self):
+        directory, prefix = os.path.split(self.stem)
+        pattern = re.compile(rf"^{re.escape(prefix)}\.\d+-\d+\.bin$")
+        return sorted(os.path.join(directory or ".", name) for name in os.listdir(directory or ".") if pattern.match(name))
+
+    def write(self, labels, vectors, columns=None):
+        """
+        Saves the gallery as a new version, which becomes the current one once it's completely written.
+        """
+        labels = [str(label) for label in labels]
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)).reshape(len(labels), -1) if labels else np.empty((0, 0), dtype=np.float32)
+        table = json.dumps({"labels": labels, "columns": columns or {}}).encode("utf-8")
+        table_offset = self.HEADER.size
+        matrix_offset = -(-(table_offset + len(table)) // self.ALIGNMENT) * self.ALIGNMENT
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, matrix.shape[1], len(matrix), table_offset, len(table), matrix_offset)
+        version_path = f"{self.stem}.{time.time_ns():020d}-{os.getpid()}.bin" # Sorted by time, unique even if several workers save together
+        with open(version_path, "wb") as f:
+            f.write(header)
+            f.write(table)
+            f.write(b"\0" * (matrix_offset - table_offset - len(table)))
+            f.write(matrix.tobytes())
+        tmp_path = f"{self.pointer_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(os.path.basename(version_path))
+        os.replace(tmp_path, self.pointer_path) # The pointer is never mapped, so it can be replaced on every platform
+        self.remove_old_versions(version_path)
+
+    def remove_old_versions(self, current):
+        old_versions = [path for path in self.versions() if path != current]
+        old_versions = old_versions[:max(len(old_versions) - self.KEEP_VERSIONS, 0)]
+        if os.path.exists(self.path): old_versions.append(self.path)
+        for path in old_versions:
+            try:
+                os.remove(path)
+            except (PermissionError, FileNotFoundError): # Still mapped by a loaded model (on Windows), removed by a later save
+                pass
+
+    def read(self):
+        """
+        Returns (labels, matrix, columns) of the current version: the labels as an array, the matrix memory-mapped (read-only) and the extra columns.
+        """
+        try:
+            return self.read_version(self.current_path())
+        except FileNotFoundError: # Removed after being replaced while the pointer was read
+            return self.read_version(self.current_path())
+
+    def read_version(self, path):
+        with open(path, "rb") as f:
+            magic, version, dim, rows, table_offset, table_length, matrix_offset = self.HEADER.unpack(f.read(self.HEADER.size))
+            if magic != self.MAGIC:
+                raise ValueError(f"{path} is not a gallery file")
+            if version > self.VERSION:
+                raise ValueError(f"{path} has version {version}, the newest supported is {self.VERSION}")
+            f.seek(table_offset)
+            table = json.loads(f.read(table_length).decode("utf-8"))
+        labels = np.array(table["labels"], dtype=str)
+        if len(labels) != rows:
+            raise ValueError(f"{path} has {rows} rows but {len(labels)} labels")
+        if rows == 0 or dim == 0:
+            matrix = np.empty((rows, dim), dtype=np.float32)
+        else:
+            matrix = np.memmap(path, dtype=np.float32, mode="r", offset=matrix_offset, shape=(rows, dim))
+        return labels, matrix, table["columns"]
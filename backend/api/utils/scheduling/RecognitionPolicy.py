@@ -0,0 +1,102 @@
+from abc import ABC, abstractmethod
+
+
+class RecognitionPolicy(ABC):
+    """
+    Decides when a tracked face has to be recognized (see FaceTracker.Track).
+    """
+    @abstractmethod
+    def should_recognize(self, track, frame_number, load):
+        """
+        Returns True if the classifier has to run for the track at this frame.
+        load - the fraction of the inference pool in use, between 0 and 1
+        """
+        pass
+
+
+class FixedIntervalPolicy(RecognitionPolicy):
+    """
+    Recognizes every track every interval frames, whatever its state: the behaviour of the old DELTA_RECOGNITION counter.
+    """
+    def __init__(self, interval=5) -> None:
+        self.interval = interval
+
+    def should_recognize(self, track, frame_number, load):
+        return track.last_recognition is None or frame_number - track.last_recognition >= self.interval
+
+
+class AdaptivePolicy(RecognitionPolicy):
+    """
+    Recognizes new faces immediately, and every MIN_INTERVAL frames until their votes decide the identity, then waits longer and longer as the result stays the same:
+    - a known face is verified again after BASE_INTERVAL frames, doubled at every confirmation up to MAX_INTERVAL
+    - an unknown face backs off the same way, but while it moves the interval is halved (a different pose may be recognized), never below BASE_INTERVAL
+    - a fast moving known face is verified again at the BASE_INTERVAL, since the tracker may have swapped faces
+    - the intervals are stretched when the inference pool is busy, up to (1 + LOAD_FACTOR) times
+    So once the identity is decided, no face is recognized more often than every BASE_INTERVAL frames.
+    """
+    def __init__(self) -> None:
+        self.MIN_INTERVAL = 2
+        self.BASE_INTERVAL = 5
+        self.MAX_INTERVAL = 60
+        self.MOTION_THRESHOLD = 0.15 # Displacement of the face between two frames, as a fraction of its width
+        self.LOAD_FACTOR = 2.
+
+    def interval(self, track, load):
+        backoff = min(self.BASE_INTERVAL * 2 ** track.stability, self.MAX_INTERVAL)
+        if track.label is None:
+            interval = self.MIN_INTERVAL # Still collecting the votes
+        elif track.label.lower() == "unknown":
+            interval = max(backoff // 2, self.BASE_INTERVAL) if track.motion >= self.MOTION_THRESHOLD else backoff
+        elif track.motion >= self.MOTION_THRESHOLD:
+            interval = self.BASE_INTERVAL
+        else:
+            interval = backoff
+        return interval * (1 + self.LOAD_FACTOR * min(load, 1.))
+
+    def should_recognize(self, track, frame_number, load):
+        if track.last_recognition is None:
+            return True
+        return frame_number - track.last_recognition >= self.interval(track, load)
+
+
+class RecognitionScheduler:
+    """
+    Applies a policy to the tracks of a stream, and counts the inferences saved compared to
+    recognizing every baseline_interval frames (the old fixed DELTA_RECOGNITION).
+    """
+    def __init__(self, policy=None, baseline_interval=5, load=None) -> None:
+        self.policy = policy or AdaptivePolicy()
+        self.baseline_interval = baseline_interval
+        self.load = load or (lambda: 0.) # Returns the current server load, between 0 and 1
+        self.frames = 0
+        self.inferences = 0
+        self.identifications = [] # Inferences needed by each face to get its identity
+
+    def due(self, tracks, frame_number):
+        """
+        Returns the tracks the policy wants to recognize at this frame.
+        """
+        self.frames += 1
+        if not tracks:
+            return []
+        load = self.load()
+        return [track for track in tracks if self.policy.should_recognize(track, frame_number, load)]
+
+    def recognized(self):
+        self.inferences += 1
+
+    def identified(self, inferences):
+        self.identifications.append(inferences)
+
+    def saved_inferences(self):
+        return self.frames // self.baseline_interval - self.inferences
+
+    def stats(self):
+        return {
+            "POLICY": type(self.policy).__name__,
+            "FRAMES": self.frames,
+            "INFERENCES": self.inferences,
+            "BASELINE_INFERENCES": self.frames // self.baseline_interval,
+            "SAVED_INFERENCES": self.saved_inferences(),
+            "INFERENCES_PER_IDENTITY": sum(self.identifications) / len(self.identifications) if self.identifications else None,
+        }
@@ -0,0 +1,175 @@
+import json
+import numpy as np
+from ..encoding.encoding import b64str_to_opencvimg, opencvimg_to_b64_str, jpeg_bytes_to_opencvimg, opencvimg_to_jpeg_bytes, pack_frame_message
+from ..user_info.user_info import get_user_info, get_profile_pic
+from ..tracking.FaceTracker import FaceTracker
+from ..scheduling.RecognitionPolicy import RecognitionScheduler
+
+# Returned by FrameSession.analyze when the received frame has to be sent back as it is
+INPUT_FRAME = object()
+
+
+class FrameSession:
+    """
+    State of a webcam stream (one per WebSocket connection) and processing of its frames.
+    It's shared by the sync and async consumers, and it's not thread safe: the frames of a session must be processed one at a time.
+    Frames can be received as base64 JPEG strings (text messages) or raw JPEG bytes (binary messages): the reply uses the same mode.
+    With metadata_only the frames are never sent back: the reply only has the face boxes, and the client draws the overlay itself.
+    The policy decides when the tracked faces are recognized (by default AdaptivePolicy), load returns the server load it can take into account.
+    """
+    def __init__(self, classifier, metadata_only=False, policy=None, load=None) -> None:
+        self.count = 0
+        self.classifier = classifier
+        self.metadata_only = metadata_only
+        self.tracker = FaceTracker()
+        self.DELTA_RECOGNITION = 5 # Frames between the identity reports
+        self.MAX_UNMATCHED_ATTEMPTS = 5 # A track still without identity after this many recognitions that didn't find its face is unknown
+        self.scheduler = RecognitionScheduler(policy, baseline_interval=self.DELTA_RECOGNITION, load=load)
+        # Pin the current model: it's loaded from disk only the first time, then shared by all the connections
+        self.model_version, self.model = self.classifier.current_model()
+
+    def pinned_model(self):
+        """
+        Returns the pinned model, moving the pin to the latest version if a training published a new one.
+        """
+        if self.classifier.latest_version() != self.model_version:
+            self.model_version, self.model = self.classifier.current_model()
+        return self.model
+
+    def process(self, text_data):
+        """
+        Processes a frame (a base64 JPEG) and returns the reply to send (a JSON string), None if there's nothing to reply.
+        """
+        if text_data == "null":
+            return None
+        identity_data, frame = self.analyze(b64str_to_opencvimg(text_data))
+        if frame is INPUT_FRAME:
+            identity_data["FRAME"] = text_data
+        elif frame is not None:
+            identity_data["FRAME"] = opencvimg_to_b64_str(frame)
+        return json.dumps(identity_data)
+
+    def process_bytes(self, bytes_data):
+        """
+        Processes a frame (raw JPEG bytes) and returns the binary reply to send (see encoding.pack_frame_message).
+        """
+        identity_data, frame = self.analyze(jpeg_bytes_to_opencvimg(bytes_data))
+        if frame is INPUT_FRAME:
+            jpeg_bytes = bytes_data # Sent back as it is, without encoding it again
+        elif frame is not None:
+            jpeg_bytes = opencvimg_to_jpeg_bytes(frame)
+        else:
+            jpeg_bytes = None
+        return pack_frame_message(identity_data, jpeg_bytes)
+
+    def analyze(self, img):
+        """
+        Tracks the faces in the decoded frame (recognizing the new ones), and returns the identity data and the frame to send back:
+        the annotated frame, INPUT_FRAME to send back the received frame, or None to send no frame.
+        """
+        self.count += 1
+        identity_data = {}
+        # {
+        #   STATE: "UNKNOWN", "KNOWN", "NO FACE" 
+        #   FRAME: str (missing with metadata_only)
+        #   FACES: [[x, y, w, h], ...] (the first one is the recognized face)
+        #   FRAME_SIZE: [width, height] (the boxes refer to it)
+        #   RECOGNITION_PHASE: boolean (If the identity is reported: every DELTA_RECOGNITION frames, or when a face is recognized)
+        #   INFERENCE: boolean (If the classifier ran on this frame, when the scheduling policy asked for it)
+        #   TRACK_ID: int | None (The tracked face the identity refers to)
+        #   USER_INFO: None | 
+        # {
+        #     ID: int,
+        #     NAME: str,
+        #     SURNAME: str,
+        #     CF: str,
+        #     COST: int
+        #     PROFILE_IMG: str
+        # }
+        #   SIMILARITY: str
+        #   EVIDENCE: float (Accumulated score of the identity across the recognitions of the face)
+        #     
+        # }
+
+        # If ID is None, then it means there is no face
+        # If ID is "unknown", then the face isn't recognized
+        # Otherwise the ID will be the ID of the recognized user
+
+        identity_data["FRAME_SIZE"] = [img.shape[1], img.shape[0]]
+        self.detection = None
+        tracks = self.tracker.update(img, self.detect)
+        due = self.scheduler.due(tracks, self.count)
+        recognized = len(due) != 0
+        if recognized:
+            self.recognize_tracks(img, due)
+        identity_data["INFERENCE"] = recognized # If the classifier ran on this frame
+
+        # The biggest face is the one the reply refers to
+        tracks = sorted(tracks, key=lambda track: track.area(), reverse=True)
+        faces = [track.box for track in tracks]
+        primary = tracks[0] if tracks else None
+        identity_data["FACES"] = [[int(v) for v in face] for face in faces]
+        identity_data["FACE_PRESENT"] = primary is not None
+        identity_data["TRACK_ID"] = primary.id if primary is not None else None
+        # The identity is reported every DELTA_RECOGNITION frames (and when it's recognized), even if it comes from the track
+        identity_data["RECOGNITION_PHASE"] = (recognized or self.count % self.DELTA_RECOGNITION == 0) and (primary is None or primary.label is not None)
+        id = primary.label if primary is not None else None
+        if identity_data["RECOGNITION_PHASE"]:
+            if id is None:
+                identity_data["STATE"] = "NO FACE"
+                return identity_data, None if self.metadata_only else INPUT_FRAME
+            if id.lower() == "unknown":
+                identity_data["STATE"] = "UNKNOWN"
+                return identity_data, None
+            identity_data["STATE"] = "KNOWN"
+            identity_data["USER_INFO"] = primary.user_info
+            identity_data["SIMILARITY"] = np.float64(primary.similarity)
+            identity_data["EVIDENCE"] = primary.evidence
+        if self.metadata_only:
+            return identity_data, None # Nothing to draw nor to encode
+        return identity_data, self.classifier.annotate(img, faces, id)
+
+    def detect(self, img, around=None):
+        """
+        Runs the detection stage for the tracker, keeping the result so a recognition on the same frame doesn't scan it again.
+        """
+        self.detection = self.classifier.detect(img, around)
+        return self.detection.faces
+
+    def recognize_tracks(self, img, tracks):
+        """
+        Runs the classifier on the frame and adds the result to the votes of the track of the recognized face,
+        which takes the identity once the votes are enough (see VoteAggregator).
+        All the due tracks count as attempted, so the classifier runs at most once per frame.
+        The tracks the result never refers to (e.g. the classifier doesn't find the tracked face) become unknown after MAX_UNMATCHED_ATTEMPTS,
+        otherwise they would stay without identity, and never be reported.
+        """
+        faces, id, similarity = self.classifier.identify(img, self.pinned_model(), self.detection)
+        self.scheduler.recognized()
+        track = self.tracker.find(tuple(faces[0])) if id is not None else None
+        for due in tracks:
+            due.last_recognition = self.count
+            if due is track: continue
+            due.unmatched += 1
+            if due.label is None and due.unmatched >= self.MAX_UNMATCHED_ATTEMPTS:
+                due.label = "unknown"
+        if track is None:
+            return
+        track.unmatched = 0
+        track.stability = track.stability + 1 if track.label is not None and id.lower() == track.label.lower() else 0 # The classifiers spell "unknown" differently
+        track.votes.add(id, similarity)
+        decision = track.votes.identity()
+        if decision is None:
+            return # Not enough evidence: the track keeps its previous identity, if any
+        label, track.evidence = decision
+        if track.label is None:
+            self.scheduler.identified(track.votes.decided_after)
+        if id == label:
+            track.similarity = similarity
+        if label == track.label:
+            return # Confirmed, the user info is already cached
+        track.label, track.user_info = label, None
+        if label.lower() != "unknown":
+            # Fetched once per track, instead of at every reply
+            track.user_info = get_user_info(label)
+            track.user_info["PROFILE_IMG"] = get_profile_pic(label)
@@ -0,0 +1,58 @@
+from collections import deque
+
+
+class VoteAggregator:
+    """
+    Combines the last recognition results of a face, instead of trusting each one alone: every result adds its similarity to the score
+    of its label, and older results weigh less (exponential decay). A label becomes the identity once its score reaches THRESHOLD
+    and beats the runner up by MARGIN, so a single low confidence frame can't flip it.
+    The "unknown" results weigh less, so they hardly outvote a known label, but they have their own threshold, so an unknown face
+    is decided as fast as a known one.
+    """
+    def __init__(self, window=8, decay=0.8, threshold=1.6, margin=0.5) -> None:
+        self.results = deque(maxlen=window) # (label, weight), the newest last
+        self.DECAY = decay
+        self.THRESHOLD = threshold # With the default decay, two consecutive results at 0.9 are enough
+        self.MARGIN = margin
+        self.UNKNOWN_WEIGHT = 0.5 # Weight of an "unknown" result, which has no meaningful similarity
+        self.UNKNOWN_THRESHOLD = 0.8 # Two consecutive "unknown" results are enough, like two known results at 0.9
+        self.count = 0 # Results added so far
+        self.decided_after = None # Results needed for the first identity
+
+    def add(self, label, similarity):
+        """
+        Adds a recognition result (label None means that no face was found, and it's ignored).
+        """
+        if label is None:
+            return
+        if label.lower() == "unknown":
+            label, weight = "unknown", self.UNKNOWN_WEIGHT
+        else:
+            weight = 1. if similarity is None else float(similarity)
+        self.results.append((label, weight))
+        self.count += 1
+        if self.decided_after is None and self.identity() is not None:
+            self.decided_after = self.count
+
+    def scores(self):
+        """
+        Returns the accumulated score of each label: {label: score}.
+        """
+        scores = {}
+        for age, (label, weight) in enumerate(reversed(self.results)):
+            scores[label] = scores.get(label, 0.) + weight * self.DECAY ** age
+        return scores
+
+    def identity(self):
+        """
+        Returns (label, score) of the final identity, None if the evidence isn't enough yet.
+        """
+        ranking = sorted(self.scores().items(), key=lambda item: item[1], reverse=True)
+        if not ranking:
+            return None
+        label, score = ranking[0]
+        runner_up = ranking[1][1] if len(ranking) > 1 else 0.
+        threshold = self.UNKNOWN_THRESHOLD if label == "unknown" else self.THRESHOLD
+        if score < threshold or score - runner_up < self.MARGIN:
+            return None
+        return label, score
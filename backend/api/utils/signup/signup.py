@@ -5,28 +5,22 @@ This function takes a username (string), a password (string) and a role (enum('s
 Also, the password isn't hashed in the db (it is not safe but we don't need the system to be safe since
 the system won't go live).
 '''
-import mysql.connector as sql
-from bsproject import settings
-
-def dbconnector():
-    DBconf = settings.DATABASES.get("mysql")
-    return sql.connect(host=DBconf.get("DB_HOST"), username=DBconf.get("DB_USERNAME"), passwd=DBconf.get("DB_PASSWORD"), database=DBconf.get("DB_NAME"))
+from ..dbconnector import dbconnector as db
 
 def signup(email, password, role, name, surname, cf, isee):
     if email == "" or password == "" or (role not in ["student", "admin"]) or name == "" or surname == "" or len(cf) != 16 or not isee.isnumeric():
         return ValueError("Unable to add a new user, please check the input values.")
-    conn = dbconnector()
-    cursor = conn.cursor()
+    pool = db.get_pool()
     try:
-        query_one = "INSERT INTO users (email, password, role) VALUES('{}', '{}', '{}')".format(email, password, role)
-        cursor.execute(query_one)
-        lastid = cursor.lastrowid
-        query_two = "INSERT INTO users_info (id, name, surname, cf, isee) VALUES('{}', '{}', '{}', '{}', '{}')".format(lastid, name, surname, cf, isee)
-        cursor.execute(query_two)
-        conn.commit()
+        # Both the inserts in the same transaction: committed together, or rolled back by the pool
+        with pool.cursor() as cursor:
+            query_one = "INSERT INTO users (email, password, role) VALUES(%s, %s, %s)"
+            cursor.execute(pool.prepare(query_one), (email, password, role))
+            lastid = cursor.lastrowid
+            query_two = "INSERT INTO users_info (id, name, surname, cf, isee) VALUES(%s, %s, %s, %s, %s)"
+            cursor.execute(pool.prepare(query_two), (lastid, name, surname, cf, isee))
         return "User added to DB!"
     except SystemError as err:
-        conn.rollback()
         return err
 
 #Type the values here:
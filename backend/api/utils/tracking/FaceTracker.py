@@ -0,0 +1,143 @@
+import itertools
+import cv2
+from ..session.VoteAggregator import VoteAggregator
+
+def iou(box_a, box_b):
+    """
+    Intersection over union of two (x, y, w, h) boxes.
+    """
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.
+    intersection = w * h
+    return intersection / float(aw * ah + bw * bh - intersection)
+
+
+class Track:
+    """
+    A face followed across the frames, with the identity recognized for it (if any).
+    """
+    def __init__(self, track_id, box, template) -> None:
+        self.id = track_id
+        self.box = box # (x, y, w, h) in the last frame
+        self.template = template # Grayscale patch of the face, searched in the next frames
+        self.confidence = 1. # Correlation of the last match, 1 right after a detection
+        self.label = None # None if not identified yet, "unknown" if it's not recognized, otherwise the recognized label
+        self.similarity = None
+        self.votes = VoteAggregator() # Recognition results of the face, which decide the label
+        self.evidence = None # Score of the label
+        self.user_info = None # Cached by whoever recognizes the track
+        self.last_recognition = None # Frame number of the last recognition attempt
+        self.stability = 0 # How many consecutive recognitions confirmed the label
+        self.unmatched = 0 # Consecutive recognition attempts whose result wasn't this face
+        self.motion = 0. # Displacement since the previous frame, as a fraction of the face width
+
+    def move(self, box):
+        """
+        Moves the track to the new box, updating its motion.
+        """
+        (x, y, w, h), (new_x, new_y, new_w, new_h) = self.box, box
+        displacement = ((x + w / 2 - new_x - new_w / 2) ** 2 + (y + h / 2 - new_y - new_h / 2) ** 2) ** 0.5
+        self.motion = displacement / max(w, 1)
+        self.box = box
+
+    def area(self):
+        return self.box[2] * self.box[3]
+
+
+class FaceTracker:
+    """
+    Follows the faces of a webcam stream (one tracker per connection) by template matching in a window around their last position,
+    which is much cheaper than running the face detector on the whole frame.
+    The detector is run again only when a track's correlation drops, or every REDETECT_INTERVAL frames to find the faces that entered the frame.
+    """
+    def __init__(self) -> None:
+        self.MIN_CONFIDENCE = 0.6 # Below this normalized correlation the track is considered lost
+        self.TEMPLATE_REFRESH_CONFIDENCE = 0.85 # The template follows the face (e.g. pose changes) only when the match is reliable, to avoid drifting
+        self.SEARCH_MARGIN = 0.5 # Search window around the last box, as a fraction of its size
+        self.REDETECT_INTERVAL = 15
+        self.IOU_THRESHOLD = 0.3 # Minimum overlap to consider a detection the same face of a track
+        self.tracks = []
+        self.frames_since_detection = 0
+        self.detected = False # If the detector ran on the last frame
+        self.track_ids = itertools.count(1)
+
+    def update(self, frame, detect):
+        """
+        Moves the tracks to the given frame (BGR), and returns them.
+        detect is the face detector, called with the frame when needed and returning the (x, y, w, h) boxes. When the tracks are lost
+        it's also given the box around them (around=...), so the detector can search only there.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.frames_since_detection += 1
+        for track in self.tracks:
+            self.follow(track, gray)
+        full_scan = not self.tracks or self.frames_since_detection >= self.REDETECT_INTERVAL # Looking for new faces too
+        self.detected = full_scan or any(track.confidence < self.MIN_CONFIDENCE for track in self.tracks)
+        if self.detected:
+            boxes = detect(frame) if full_scan else detect(frame, around=self.bounding_box())
+            self.match_detections(gray, [tuple(int(v) for v in box) for box in boxes])
+            self.frames_since_detection = 0
+        return self.tracks
+
+    def bounding_box(self):
+        """
+        Returns the (x, y, w, h) box which contains all the tracks.
+        """
+        x0 = min(track.box[0] for track in self.tracks)
+        y0 = min(track.box[1] for track in self.tracks)
+        x1 = max(track.box[0] + track.box[2] for track in self.tracks)
+        y1 = max(track.box[1] + track.box[3] for track in self.tracks)
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def follow(self, track, gray):
+        """
+        Searches the track's template around its last box, updating the box and the confidence.
+        """
+        x, y, w, h = track.box
+        margin_x, margin_y = int(w * self.SEARCH_MARGIN), int(h * self.SEARCH_MARGIN)
+        x0, y0 = max(x - margin_x, 0), max(y - margin_y, 0)
+        x1, y1 = min(x + w + margin_x, gray.shape[1]), min(y + h + margin_y, gray.shape[0])
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < h or window.shape[1] < w: # The face went out of the frame
+            track.confidence = 0.
+            return
+        scores = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+        _, best_score, _, (best_x, best_y) = cv2.minMaxLoc(scores)
+        track.move((x0 + best_x, y0 + best_y, w, h))
+        track.confidence = best_score
+        if best_score >= self.TEMPLATE_REFRESH_CONFIDENCE:
+            track.template = self.crop(gray, track.box)
+
+    def match_detections(self, gray, boxes):
+        """
+        Replaces the tracks with the detected faces: a detection overlapping a track keeps its id and identity, the others start new tracks.
+        """
+        tracks = []
+        unmatched = list(self.tracks)
+        for box in boxes:
+            best = max(unmatched, key=lambda track: iou(track.box, box), default=None)
+            if best is not None and iou(best.box, box) >= self.IOU_THRESHOLD:
+                unmatched.remove(best)
+                best.move(box)
+                best.template, best.confidence = self.crop(gray, box), 1.
+                tracks.append(best)
+            else:
+                tracks.append(Track(next(self.track_ids), box, self.crop(gray, box)))
+        self.tracks = tracks # The unmatched tracks are lost
+
+    def find(self, box):
+        """
+        Returns the track that best overlaps the box, None if there isn't any.
+        """
+        best = max(self.tracks, key=lambda track: iou(track.box, box), default=None)
+        if best is None or iou(best.box, box) < self.IOU_THRESHOLD:
+            return None
+        return best
+
+    def crop(self, gray, box):
+        x, y, w, h = box
+        return gray[y:y+h, x:x+w].copy()
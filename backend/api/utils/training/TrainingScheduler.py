@@ -0,0 +1,205 @@
+import time
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+import multiprocessing
+from ..recognition.ClassifierRegistry import get_classifier
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+def run_training(classifier_class, dirs):
+    """
+    Preprocesses the new samples and trains a new instance of the classifier: used to train in a separate process.
+    """
+    classifier = classifier_class()
+    classifier.preprocess_images(dirs=dirs)
+    classifier.train()
+
+class TrainingJob:
+    """
+    A training run, shared by all the enrollments coalesced into it.
+    """
+    def __init__(self, id) -> None:
+        self.id = id
+        self.state = QUEUED
+        self.dirs = set() # Sample directories to preprocess before training
+        self.after = [] # Futures which must be done before the job starts (e.g. the preprocessing of the uploaded samples)
+        self.enrollments = 0 # Number of enrollments coalesced into this job
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.future = Future() # Done when the job ends, with its final state
+
+    def to_dict(self):
+        return {
+            "ID": self.id,
+            "STATE": self.state,
+            "ENROLLMENTS": self.enrollments,
+            "SUBMITTED_AT": self.submitted_at,
+            "STARTED_AT": self.started_at,
+            "FINISHED_AT": self.finished_at,
+            "ERROR": self.error,
+        }
+
+class TrainingScheduler:
+    """
+    Runs the preprocessing and training of a classifier in background, one run at a time, instead of blocking the request worker.
+    The enrollments submitted while a job is still queued are coalesced into it, so a burst of enrollments causes a single training run.
+    When the training ends, the new model is published into the live classifier.
+    classifier - the live classifier, by default the one in use (see ClassifierRegistry), built when the first training starts
+    use_process - if True the training runs in a separate process (with its own instance of the classifier), otherwise in a thread
+    coalesce_delay - seconds to wait after the first enrollment of a job before starting it, to collect the following ones
+    on_trained - optional callable, called with the preprocessed directories (None for all) after each successful training
+    """
+    def __init__(self, classifier=None, use_process=False, coalesce_delay=2.0, max_history=100, on_trained=None) -> None:
+        self.classifier = classifier
+        self.on_trained = on_trained
+        self.use_process = use_process
+        self.coalesce_delay = coalesce_delay
+        self.max_history = max_history
+        self.condition = threading.Condition()
+        self.jobs = OrderedDict()
+        self.queued_job = None
+        self.running_job = None
+        self.preprocessing = set() # Preprocessing of uploaded samples, submitted while no job was running and not finished yet
+        self.removed = [] # Deleted samples to drop from the model, before the next job starts
+        self.next_id = 1
+        self.worker = None
+
+    def live_classifier(self):
+        if self.classifier is None:
+            self.classifier = get_classifier()
+        return self.classifier
+
+    def submit(self, dir=None, after=()):
+        """
+        Requests a training run (after preprocessing dir, if given) and returns the job that will perform it.
+        after - futures the job waits for before starting, so the caller doesn't have to block until they're done
+        """
+        with self.condition:
+            if self.queued_job is None:
+                self.queued_job = TrainingJob(self.next_id)
+                self.next_id += 1
+                self.jobs[self.queued_job.id] = self.queued_job
+                while len(self.jobs) > self.max_history:
+                    self.jobs.popitem(last=False)
+            job = self.queued_job
+            if dir is not None: job.dirs.add(dir)
+            job.after.extend(after)
+            job.enrollments += 1
+            self.start_worker()
+            self.condition.notify()
+            return job
+
+    def remove_samples(self, paths):
+        """
+        Drops the given sample images (already deleted from the samples directory) from the model in background,
+        taking turns with the training runs, so the request doesn't wait for the training lock.
+        """
+        with self.condition:
+            self.removed.extend(paths)
+            self.start_worker()
+            self.condition.notify()
+
+    def order_preprocessing(self, submit):
+        """
+        Orders the preprocessing of an uploaded sample with the training jobs, since a job preprocesses the same files:
+        submit is called with the futures the preprocessing has to wait for (the running job, if any) and returns its future.
+        A preprocessing submitted while no job runs is waited for by the next job before it starts.
+        """
+        with self.condition:
+            after = [] if self.running_job is None else [self.running_job.future]
+            future = submit(after)
+            if not after:
+                self.preprocessing.add(future)
+                future.add_done_callback(self.preprocessing_done)
+            return future
+
+    def preprocessing_done(self, future):
+        with self.condition:
+            self.preprocessing.discard(future)
+
+    def start_worker(self):
+        # Called holding the condition
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="training-scheduler", daemon=True)
+            self.worker.start()
+
+    def get(self, job_id):
+        """
+        Returns the status of the job as a dictionary, None if it doesn't exist.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return None if job is None else job.to_dict()
+
+    def latest(self):
+        """
+        Returns the status of the last submitted job, None if there isn't any.
+        """
+        with self.condition:
+            if not self.jobs: return None
+            return next(reversed(self.jobs.values())).to_dict()
+
+    def job_due(self):
+        return self.queued_job is not None and time.time() >= self.queued_job.submitted_at + self.coalesce_delay
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.removed and not self.job_due():
+                    timeout = None if self.queued_job is None else self.queued_job.submitted_at + self.coalesce_delay - time.time()
+                    self.condition.wait(timeout)
+                removed, self.removed = self.removed, []
+                job = None
+                if not removed:
+                    job = self.queued_job
+                    self.queued_job = None # The next enrollments go into a new job
+            if removed:
+                self.drop_samples(removed)
+                continue
+            with self.condition:
+                # From now on the uploaded samples are preprocessed after this job, the ones already in progress before it
+                self.running_job = job
+                after = job.after + list(self.preprocessing)
+                job.after = []
+            wait(after) # Their errors don't matter here, the samples which aren't preprocessed yet are preprocessed by the job
+            with self.condition:
+                job.state = RUNNING
+                job.started_at = time.time()
+                dirs = sorted(job.dirs) or None # None preprocesses every directory with new images
+            try:
+                self.train(dirs)
+                if self.on_trained is not None: self.on_trained(dirs)
+                job.state = DONE
+            except Exception as e:
+                traceback.print_exc()
+                job.error = str(e)
+                job.state = FAILED
+            job.finished_at = time.time()
+            with self.condition:
+                self.running_job = None
+            job.future.set_result(job.state)
+
+    def drop_samples(self, paths):
+        try:
+            self.live_classifier().remove_samples(paths)
+        except Exception:
+            traceback.print_exc() # They are dropped anyway by the next rebuild of the model
+
+    def train(self, dirs):
+        classifier = self.live_classifier()
+        if self.use_process:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                executor.submit(run_training, type(classifier), dirs).result()
+            # Swap the model saved by the other process into the live classifier
+            classifier.reload()
+        else:
+            # The training publishes the new model into the live classifier by itself
+            classifier.preprocess_images(dirs=dirs)
+            classifier.train()
@@ -0,0 +1,99 @@
+import os
+import cv2
+import base64
+from bsproject.paths import SAMPLES_ROOT, THUMBNAILS_ROOT
+
+
+class PhotoStore:
+    """
+    Access to the sample photos of the users, in their original size or in smaller variants (see SIZES).
+    The variants are JPEGs cached on disk (cache_root/<user id>/<size>/<photo name>.jpg) and made again when the photo is newer than them.
+    """
+    SUPPORTED_EXTENSIONS = {".jpeg": "image/jpeg", ".jpg": "image/jpeg", ".png": "image/png"}
+    FULL = "full"
+
+    def __init__(self, samples_root=SAMPLES_ROOT, cache_root=os.path.join(THUMBNAILS_ROOT, "samples")) -> None:
+        self.samples_root = samples_root
+        self.cache_root = cache_root
+        self.SIZES = {"thumb": 128, "medium": 256} # Longest side of each variant, in pixels
+        self.QUALITY = 85 # JPEG quality of the variants
+
+    def list(self, user_id):
+        """
+        Returns the names of the user's photos sorted by name, None if the user has no samples directory.
+        """
+        sample_dir = os.path.join(self.samples_root, str(user_id))
+        if not os.path.isdir(sample_dir):
+            return None
+        return sorted(
+            entry.name for entry in os.scandir(sample_dir)
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in self.SUPPORTED_EXTENSIONS
+        )
+
+    def valid_name(self, name):
+        """
+        True if the name is a plain file name (it can't point outside the user's directory) with a supported extension.
+        """
+        return name not in ("", ".", "..") and os.path.basename(name) == name and os.path.splitext(name)[1].lower() in self.SUPPORTED_EXTENSIONS
+
+    def source_path(self, user_id, name):
+        """
+        Returns the path of the photo, None if it doesn't exist (or the name isn't valid, see valid_name).
+        """
+        if not self.valid_name(name):
+            return None
+        path = os.path.join(self.samples_root, str(user_id), name)
+        return path if os.path.isfile(path) else None
+
+    def get(self, user_id, name, size=FULL):
+        """
+        Returns (path, content type) of the photo in the requested size, None if it doesn't exist or can't be read.
+        """
+        source = self.source_path(user_id, name)
+        if source is None:
+            return None
+        if size == self.FULL:
+            return source, self.SUPPORTED_EXTENSIONS[os.path.splitext(name)[1].lower()]
+        variant = self.variant_path(user_id, name, size)
+        if not os.path.exists(variant) or os.path.getmtime(variant) < os.path.getmtime(source):
+            if not self.make_variant(source, variant, self.SIZES[size]):
+                return None
+        return variant, "image/jpeg"
+
+    def variant_path(self, user_id, name, size):
+        return os.path.join(self.cache_root, str(user_id), size, f"{name}.jpg")
+
+    def make_variant(self, source, variant, side):
+        image = cv2.imread(source, cv2.IMREAD_COLOR)
+        if image is None:
+            return False
+        scale = side / max(image.shape[:2])
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        _, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.QUALITY])
+        os.makedirs(os.path.dirname(variant), exist_ok=True)
+        tmp_path = f"{variant}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(jpeg.tobytes())
+        os.replace(tmp_path, variant)
+        return True
+
+    def data_url(self, user_id, name, size=FULL):
+        """
+        Returns the photo as a base64 data URL, None if it doesn't exist.
+        """
+        photo = self.get(user_id, name, size)
+        if photo is None:
+            return None
+        path, content_type = photo
+        with open(path, "rb") as f:
+            return f"data:{content_type};base64," + base64.b64encode(f.read()).decode("utf-8")
+
+    def remove(self, user_id, name):
+        """
+        Removes the cached variants of a deleted photo.
+        """
+        for size in self.SIZES:
+            variant = self.variant_path(user_id, name, size)
+            if os.path.exists(variant):
+                os.remove(variant)
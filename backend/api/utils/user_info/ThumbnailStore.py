@@ -0,0 +1,63 @@
+import os
+import cv2
+import base64
+from bsproject.paths import SAMPLES_ROOT, THUMBNAILS_ROOT
+
+
+class ThumbnailStore:
+    """
+    Profile thumbnail of each user, saved as a small JPEG (THUMBNAILS_ROOT/<user id>.jpg) when their samples change,
+    so reading it only costs a file read and a base64 encoding, without decoding any image.
+    The thumbnail is made from the first sample of the user (by file name).
+    """
+    def __init__(self, root=THUMBNAILS_ROOT, samples_root=SAMPLES_ROOT) -> None:
+        self.root = root
+        self.samples_root = samples_root
+        self.SIZE = 128 # Side of the thumbnail, in pixels
+        self.QUALITY = 85 # JPEG quality
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, user_id):
+        return os.path.join(self.root, f"{user_id}.jpg")
+
+    def get(self, user_id):
+        """
+        Returns the thumbnail as a base64 JPEG data URL, None if the user has no samples.
+        The thumbnails of the users enrolled before the store existed are made the first time they're requested.
+        """
+        path = self.path(user_id)
+        if not os.path.exists(path) and not self.build(user_id):
+            return None
+        try:
+            with open(path, "rb") as f:
+                jpeg_bytes = f.read()
+        except FileNotFoundError: # Removed in the meantime
+            return None
+        return "data:image/jpeg;base64," + base64.b64encode(jpeg_bytes).decode("utf-8")
+
+    def build(self, user_id):
+        """
+        (Re)makes the thumbnail of the user from their samples, or removes it if they have none. Returns True if it was made.
+        """
+        sample_dir = os.path.join(self.samples_root, str(user_id))
+        files = sorted(os.listdir(sample_dir)) if os.path.isdir(sample_dir) else []
+        for file in files:
+            image = cv2.imread(os.path.join(sample_dir, file), cv2.IMREAD_COLOR)
+            if image is None: # Not an image
+                continue
+            scale = self.SIZE / max(image.shape[:2])
+            if scale < 1:
+                image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            _, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.QUALITY])
+            path = self.path(user_id)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(jpeg.tobytes())
+            os.replace(tmp_path, path)
+            return True
+        self.remove(user_id)
+        return False
+
+    def remove(self, user_id):
+        if os.path.exists(self.path(user_id)):
+            os.remove(self.path(user_id))
@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class UserCache:
+    """
+    In-process cache of the data of the users (e.g. profile and profile picture), so a user recognized again and again
+    at the till doesn't cost a query and a disk read each time.
+    The entries expire after ttl seconds (the data can be changed by other processes too), and the least recently used ones
+    are evicted beyond max_size. The entries are keyed by (user id, kind of data), and invalidate drops all the ones of a user.
+    """
+    def __init__(self, max_size=256, ttl=300.) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() # (user id, kind) -> (value, expiration time), the least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id, kind, load):
+        """
+        Returns the cached value, calling load() to compute it if it's missing or expired.
+        The loaded value isn't cached if it's an exception (e.g. user not found).
+        """
+        key = (str(user_id), kind)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+                self.expirations += 1
+            self.misses += 1
+        value = load() # Outside of the lock, other users don't wait for this query
+        if isinstance(value, Exception):
+            return value
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, user_id):
+        """
+        Drops the cached data of the user, e.g. after their photos or profile changed.
+        """
+        user_id = str(user_id)
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "SIZE": len(self.entries),
+                "MAX_SIZE": self.max_size,
+                "TTL": self.ttl,
+                "HITS": self.hits,
+                "MISSES": self.misses,
+                "HIT_RATE": self.hits / requests if requests else None,
+                "EVICTIONS": self.evictions,
+                "EXPIRATIONS": self.expirations,
+            }
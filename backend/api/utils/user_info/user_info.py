@@ -1,12 +1,40 @@
 from ..isee_to_cost_calculator import cost_calculator
 from ..dbconnector import dbconnector as db
-import os
-from ..encoding.encoding import opencvimg_to_b64_str
-import imghdr
-from matplotlib.image import imread
-from bsproject.settings import SAMPLES_ROOT
+from bsproject.settings import USER_CACHE_SIZE, USER_CACHE_TTL
+from .UserCache import UserCache
+from .ThumbnailStore import ThumbnailStore
+
+# Shared by the requests and the WebSocket connections of this process
+user_cache = UserCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+thumbnails = ThumbnailStore()
 
 def get_user_info(user_id):
+    """
+    Returns the profile of the user (with the computed cost), cached. The returned dictionary can be modified by the caller.
+    """
+    info = user_cache.get(user_id, "info", lambda: load_user_info(user_id))
+    return dict(info) if isinstance(info, dict) else info
+
+def get_profile_pic(id):
+    """
+    Returns the profile picture of the user (the thumbnail of the first sample, as a base64 string), cached.
+    """
+    return user_cache.get(id, "profile_pic", lambda: thumbnails.get(id))
+
+def invalidate_user(user_id):
+    """
+    Drops the cached data of the user: to call when their profile changes.
+    """
+    user_cache.invalidate(user_id)
+
+def refresh_user(user_id):
+    """
+    Makes the thumbnail of the user again and drops their cached data: to call when their samples change.
+    """
+    thumbnails.build(user_id)
+    user_cache.invalidate(user_id)
+
+def load_user_info(user_id):
     output_data = {
         "ID": "",
         "NAME": "",
@@ -17,11 +45,8 @@ def get_user_info(user_id):
 
     if user_id is None:
         return ValueError("You must specify the ID of the user.")
-    conn = db.dbconnector()
-    cursor = conn.cursor()
-    query = "SELECT id, name, surname, cf, isee FROM users_info WHERE id='{}'".format(user_id)
-    cursor.execute(query)
-    ret = tuple(cursor.fetchall())
+    query = "SELECT id, name, surname, cf, isee FROM users_info WHERE id=%s"
+    ret = db.query(query, (user_id,))
     if not ret:
         return ValueError("User not found.")
     else:
@@ -32,16 +57,3 @@ def get_user_info(user_id):
         output_data["CF"] = ret[3]
         output_data["COST"] = cost_calculator.cost_calculator(ret[4])
         return output_data
-
-def get_profile_pic(id):
-    supported_types = ['jpeg', 'jpg', 'png']
-    sample_path = os.path.join(SAMPLES_ROOT, id)
-    output_data = []
-    if os.path.exists(sample_path):
-        for file in os.listdir(sample_path):
-            img_path = os.path.join(sample_path, file)
-            if imghdr.what(img_path) in supported_types:
-                img = opencvimg_to_b64_str(imread(img_path))
-                output_data.append([file, img])
-    output_data.sort(key=lambda x: x[0])
-    return output_data[0][-1]
\ No newline at end of file
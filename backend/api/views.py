@@ -1,21 +1,39 @@
 #Define all the API here by creating a new function with the name of the API
 from django.conf import settings
-from django.http import JsonResponse, QueryDict
+from django.http import JsonResponse, QueryDict, FileResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.http.multipartparser import MultiPartParserError
+from django.core.exceptions import SuspiciousOperation
 from .utils.dbconnector import dbconnector as db
 from .utils.isee_to_cost_calculator import cost_calculator
-import imghdr
 import json
 import os
-from .utils.encoding.encoding import b64str_to_opencvimg, opencvimg_to_b64_str
-from matplotlib.image import imread
+from urllib.parse import urlencode
+from .utils.encoding.encoding import b64str_to_opencvimg
 import cv2
 
-from .utils.http.ResponseThen import ResponseThen
+from .utils.training.TrainingScheduler import TrainingScheduler
+from .utils.recognition.ClassifierRegistry import get_classifier
+from .utils.user_info import user_info
+from .utils.user_info.PhotoStore import PhotoStore
+from .utils.enrollment.SampleWriter import SampleWriter, SampleCounter
+from .utils.enrollment.SampleUploadHandler import SampleUploadHandler
+from .utils.enrollment.SamplePreprocessor import SamplePreprocessor
 
-from bsproject.settings import CLASSIFIER
+photo_store = PhotoStore()
+sample_counter = SampleCounter() # Shared by all the uploads, so two of them never get the same index
+sample_preprocessor = SamplePreprocessor()
 
-classifier = CLASSIFIER
+def invalidate_trained_users(dirs):
+    """
+    The preprocessing replaced the samples of the trained users (the directories are named after their id), so their thumbnail has to be made again.
+    """
+    if dirs is None:
+        dirs = [entry.path for entry in os.scandir(settings.SAMPLES_ROOT) if entry.is_dir()] if os.path.isdir(settings.SAMPLES_ROOT) else []
+    for dir in dirs:
+        user_info.refresh_user(os.path.basename(dir))
+
+training_scheduler = TrainingScheduler(on_trained=invalidate_trained_users) # Uses the classifier in use, built only when the first training starts
 
 def api(request, *args, **kwargs):
     return JsonResponse({'message': 'Test Api'})
@@ -47,11 +65,8 @@ def login(request, *args, **kwargs):
         if input_data["EMAIL"] == "" or input_data["PASSWORD"] == "":
             return JsonResponse({"message": "Parameters not valid."}, status=400)
         else:
-            conn = db.dbconnector()
-            cursor = conn.cursor()
-            query = "SELECT users.id, email, role, name, surname, cf, isee FROM users, users_info WHERE email='{}' AND password='{}' AND users.id=users_info.id".format(input_data["EMAIL"], input_data["PASSWORD"])
-            cursor.execute(query)
-            ret = tuple(cursor.fetchall())
+            query = "SELECT users.id, email, role, name, surname, cf, isee FROM users, users_info WHERE email=%s AND password=%s AND users.id=users_info.id"
+            ret = db.query(query, (input_data["EMAIL"], input_data["PASSWORD"]))
             if not ret:
                 return JsonResponse({"message": "User not found."}, status=404)
             else:
@@ -85,20 +100,12 @@ def get_user_info(request, *args, **kargs):
         if req_data is None or not req_data.isnumeric():
             return JsonResponse({"message": "ID not specified in the request."}, status=400)
         input_data["ID"] = req_data
-        conn = db.dbconnector()
-        cursor = conn.cursor()
-        query = "SELECT id, name, surname, cf, isee FROM users_info WHERE id='{}'".format(input_data["ID"])
-        cursor.execute(query)
-        ret = tuple(cursor.fetchall())
-        if not ret:
+        ret = user_info.get_user_info(input_data["ID"]) # Cached, the same profile is read by the recognition
+        if isinstance(ret, ValueError):
             return JsonResponse({"message": "User not found."}, status=404)
         else:
-            ret = ret[0]
-            output_data["ID"] = ret[0]
-            output_data["NAME"] = ret[1]
-            output_data["SURNAME"] = ret[2]
-            output_data["CF"] = ret[3]
-            output_data["COST"] = cost_calculator.cost_calculator(ret[4])
+            for key in output_data:
+                output_data[key] = ret[key]
             return JsonResponse({"message": "OK", "data": json.dumps(output_data)}, status=200)
     return JsonResponse({"message": "Request not valid."}, status=400)
 
@@ -123,11 +130,8 @@ def get_attendance_list(request, *args, **kargs):
         if req_data is None or not req_data.isnumeric():
             return JsonResponse({"message": "ID not specified in the request."}, status=400)
         input_data["ID"] = req_data
-        conn = db.dbconnector()
-        cursor = conn.cursor()
-        query = "SELECT * FROM users_attendance WHERE user_id='{}'".format(input_data["ID"])
-        cursor.execute(query)
-        ret = tuple(cursor.fetchall())
+        query = "SELECT * FROM users_attendance WHERE user_id=%s"
+        ret = db.query(query, (input_data["ID"],))
         if not ret:
             return JsonResponse({"message": "OK", "data": []}, status=200)
         else:
@@ -167,42 +171,103 @@ def add_attendance(request, *args, **kargs):
         if input_data["USER_ID"] == "" or input_data["PAID"] == "":
             return JsonResponse({"message": "Parameters not valid."}, status=400)
         else:
-            conn = db.dbconnector()
             try:
-                cursor = conn.cursor()
-                query = "INSERT INTO users_attendance(attendance_id, user_id, paid, date) VALUES (DEFAULT, '{}', '{}', current_timestamp())".format(input_data["USER_ID"], input_data["PAID"])
-                cursor.execute(query)
-                conn.commit()
+                query = "INSERT INTO users_attendance(attendance_id, user_id, paid, date) VALUES (DEFAULT, %s, %s, current_timestamp())"
+                db.execute(query, (input_data["USER_ID"], input_data["PAID"])) # Rolled back by the pool if it fails
                 return JsonResponse({"message": "OK"}, status=200) 
             except SystemError as err:
-                conn.rollback()
                 return JsonResponse({"message": err}, status=500)
     return JsonResponse({"message": "Request not valid."}, status=400)
 
+'''
+API get_photo_list: Get the photos of the user
+Type: GET Request
+Inputs:
+-id (integer): the id of the user;
+-page (integer, optional): the page to return, starting from 1 (all the photos if not specified);
+-page_size (integer, optional): the number of photos of each page (default 20);
+-size (string, optional): "full" (default), "medium" or "thumb", the smaller sizes are cached on the server;
+-inline (string, optional): "true" (default) to send the photos as base64 data URLs, "false" to send the URLs of get_photo;
+Output:
+-List([name, photo]): the photos of the page, sorted by name, together with total (number of photos), page and page_size
+'''
 @csrf_exempt
 def get_photo_list(request, *args, **kargs):
-    supported_types = ['jpeg', 'jpg', 'png']
     input_data = {
-        "ID": ""
+        "ID": "",
+        "PAGE": None,
+        "PAGE_SIZE": 20,
+        "SIZE": PhotoStore.FULL,
+        "INLINE": True
     }
 
     output_data = []
 
     if request.method == "GET":
-        req_data = request.GET.get("id")
-        if req_data is None or not req_data.isnumeric():
+        req_data = request.GET
+        if req_data.get("id") is None or not req_data.get("id").isnumeric():
             return JsonResponse({"message": "ID not specified in the request."}, status=400)
-        input_data["ID"] = req_data
-        sample_path = os.path.join(settings.SAMPLES_ROOT, input_data["ID"])
-        if os.path.exists(sample_path):
-            for file in os.listdir(sample_path):
-                img_path = os.path.join(sample_path, file)
-                if imghdr.what(img_path) in supported_types:
-                    img = opencvimg_to_b64_str(imread(img_path))
-                    output_data.append([file, img])
-            return JsonResponse({"message": "OK", "data": json.dumps(output_data)}, status=200)
-        else:
+        input_data["ID"] = req_data.get("id")
+        for key in ["page", "page_size"]:
+            if req_data.get(key) is not None:
+                if not req_data.get(key).isnumeric() or int(req_data.get(key)) < 1:
+                    return JsonResponse({"message": f"{key} not valid."}, status=400)
+                input_data[key.upper()] = int(req_data.get(key))
+        input_data["SIZE"] = req_data.get("size", PhotoStore.FULL)
+        if input_data["SIZE"] != PhotoStore.FULL and input_data["SIZE"] not in photo_store.SIZES:
+            return JsonResponse({"message": "size not valid."}, status=400)
+        input_data["INLINE"] = req_data.get("inline", "true").lower() != "false"
+
+        names = photo_store.list(input_data["ID"])
+        if names is None:
             return JsonResponse({"message": "The specified user has no photos."}, status=404)
+        total = len(names)
+        if input_data["PAGE"] is not None:
+            start = (input_data["PAGE"] - 1) * input_data["PAGE_SIZE"]
+            names = names[start:start + input_data["PAGE_SIZE"]]
+        # Only the photos of the page are read
+        for name in names:
+            if input_data["INLINE"]:
+                img = photo_store.data_url(input_data["ID"], name, input_data["SIZE"])
+                if img is None: continue
+            else:
+                img = request.build_absolute_uri(f"get_photo?{urlencode({'id': input_data['ID'], 'name': name, 'size': input_data['SIZE']})}")
+            output_data.append([name, img])
+        return JsonResponse({
+            "message": "OK",
+            "data": json.dumps(output_data),
+            "total": total,
+            "page": input_data["PAGE"],
+            "page_size": input_data["PAGE_SIZE"] if input_data["PAGE"] is not None else total
+        }, status=200)
+    return JsonResponse({"message": "Request not valid."}, status=400)
+
+'''
+API get_photo: Get a photo of the user as an image (streamed, not base64)
+Type: GET Request
+Inputs:
+-id (integer): the id of the user;
+-name (string): the name of the photo;
+-size (string, optional): "full" (default), "medium" or "thumb";
+'''
+@csrf_exempt
+def get_photo(request, *args, **kargs):
+    if request.method == "GET":
+        req_data = request.GET
+        if req_data.get("id") is None or not req_data.get("id").isnumeric():
+            return JsonResponse({"message": "ID not specified in the request."}, status=400)
+        if req_data.get("name") is None:
+            return JsonResponse({"message": "Photo name not specified in the request."}, status=400)
+        size = req_data.get("size", PhotoStore.FULL)
+        if size != PhotoStore.FULL and size not in photo_store.SIZES:
+            return JsonResponse({"message": "size not valid."}, status=400)
+        photo = photo_store.get(req_data.get("id"), req_data.get("name"), size)
+        if photo is None:
+            return JsonResponse({"message": "Photo not found."}, status=404)
+        path, content_type = photo
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+        response["Cache-Control"] = "private, max-age=60"
+        return response
     return JsonResponse({"message": "Request not valid."}, status=400)
 
 @csrf_exempt
@@ -220,9 +285,14 @@ def delete_photo(request, *args, **kargs):
             return JsonResponse({"message": "Sample name to delete not specified in the request."}, status=400)
         input_data["ID"] = req_data.get("id")
         input_data["NAME"] = req_data.get("name")
-        sample_path = os.path.join(settings.SAMPLES_ROOT, input_data["ID"], input_data["NAME"])
-        if os.path.exists(sample_path):
+        if not photo_store.valid_name(input_data["NAME"]):
+            return JsonResponse({"message": "Sample name not valid."}, status=400)
+        sample_path = photo_store.source_path(input_data["ID"], input_data["NAME"])
+        if sample_path is not None:
             os.remove(sample_path)
+            training_scheduler.remove_samples([sample_path]) # Dropped from the model in background
+            user_info.refresh_user(input_data["ID"]) # The profile picture may be the deleted photo
+            photo_store.remove(input_data["ID"], input_data["NAME"])
             return JsonResponse({"message": "OK"}, status=200)
         else:
             return JsonResponse({"message": "The photo which has to be deleted, doesn't exist."}, status=404)
@@ -232,33 +302,84 @@ def delete_photo(request, *args, **kargs):
 @csrf_exempt 
 def upload_photo_enrollment(request, *args, **kargs):
     """
-    Takes the list of photos that the user made in order to enroll himself and trains the model.
+    Takes the photos that the user made in order to enroll himself and trains the model.
+    The photos can be sent as the files of a multipart body, or as a single image body (Content-Type image/jpeg or image/png),
+    with the id of the user in the query string (?id=<id>): they're written into the samples while they arrive, and each one
+    is preprocessed as soon as it's saved. The older clients send them as a JSON list of base64 strings (fields 'photoList' and 'id').
     """
     if request.method == "POST":
-        req_data = request.POST
-        if req_data is None:
-            return JsonResponse({"message": "Photo data not specified in the request in the field 'data'."}, status=400)
-        photo_list = json.loads(req_data.get("photoList"))
-        id = request.POST.get("id")
-        os.makedirs(f"{settings.SAMPLES_ROOT}/{id}", exist_ok=True)
-        for index, img in enumerate(photo_list):
-            opencv_img = b64str_to_opencvimg(img)
-            img_path = os.path.join(settings.SAMPLES_ROOT, id)
-            os.makedirs(img_path, exist_ok=True)
-            processed_images = os.listdir(os.path.join(settings.SAMPLES_ROOT, id))
-            # print(f"Processed images: {processed_images}")
-            starting_index = 0
-            while True:
-                is_in_index = [str(starting_index) in img for img in processed_images]
-                # print(f"Starting index: {starting_index}, {is_in_index}")
-                if any(is_in_index): starting_index += 1
-                else: break
+        id = request.GET.get("id")
+        streamed = id is not None
+        if not streamed:
+            id = request.POST.get("id")
+        if id is None or not id.isnumeric():
+            return JsonResponse({"message": "ID not valid."}, status=400)
+
+        classifier = get_classifier()
+        size = (classifier.image_width, classifier.image_height)
+        preprocessing = []
+        def preprocess(path):
+            # A running training job preprocesses the same files, so the sample waits for it
+            preprocessing.append(training_scheduler.order_preprocessing(lambda after: sample_preprocessor.submit(path, size, after)))
+        writer = SampleWriter(id, counter=sample_counter, on_sample=preprocess)
+        skipped = 0
+        if not streamed:
+            photo_list = request.POST.get("photoList")
+            if photo_list is None:
+                return JsonResponse({"message": "Photo data not specified in the request in the field 'photoList'."}, status=400)
+            for img in json.loads(photo_list):
+                _, jpeg = cv2.imencode(".jpeg", b64str_to_opencvimg(img))
+                writer.save(jpeg.tobytes())
+        elif request.content_type == "multipart/form-data":
+            handler = SampleUploadHandler(writer, request)
+            request.upload_handlers = [handler]
+            try:
+                request.FILES # Reads the body, the photos are streamed into the samples by the handler
+            except (MultiPartParserError, SuspiciousOperation): # Malformed body, or over the limits of the settings (e.g. DATA_UPLOAD_MAX_NUMBER_FILES)
+                writer.discard()
+                sample_preprocessor.then(writer.remove_saved) # The photos saved before the error are dropped once they're preprocessed
+                return JsonResponse({"message": "Multipart body not valid."}, status=400)
+            skipped = len(handler.skipped)
+        elif request.content_type in SampleUploadHandler.CONTENT_TYPES:
+            writer.open(SampleUploadHandler.CONTENT_TYPES[request.content_type])
+            for chunk in iter(lambda: request.read(64 * 1024), b""):
+                writer.write(chunk)
+            writer.close()
+        else:
+            return JsonResponse({"message": "Content type not supported."}, status=415)
 
-            cv2.imwrite(os.path.join(img_path, f"image_{starting_index}.jpeg"), opencv_img)
-                
-        def train_pipeline():
-            classifier.preprocess_images()
-            classifier.train()
+        if not writer.saved:
+            return JsonResponse({"message": "No photo uploaded."}, status=400)
+        user_info.invalidate_user(id)
+        # The training job preprocesses the samples which aren't yet, so it starts after the ones in progress here, without blocking the response
+        job = training_scheduler.submit(os.path.join(settings.SAMPLES_ROOT, id), after=preprocessing)
+        output_data = {
+            "SAVED": len(writer.saved),
+            "SKIPPED": skipped,
+            "PREPROCESSING": len(preprocessing) # Samples queued for preprocessing, the training job starts once they're done
+        }
+        return JsonResponse({"message": "Photo uploaded correctly", "job_id": job.id, "data": json.dumps(output_data)}, status=200)
 
-        json_response = JsonResponse({"message": "Photo uploaded correctly"}, status=200)
-        return ResponseThen(json_response, train_pipeline)
+@csrf_exempt
+def get_training_status(request, *args, **kargs):
+    """
+    Returns the status of a training job (the one with the given id, or the last one if the id isn't specified).
+    """
+    if request.method == "GET":
+        req_data = request.GET.get("id")
+        if req_data is not None and not req_data.isnumeric():
+            return JsonResponse({"message": "ID not valid."}, status=400)
+        job = training_scheduler.latest() if req_data is None else training_scheduler.get(int(req_data))
+        if job is None:
+            return JsonResponse({"message": "Training job not found."}, status=404)
+        return JsonResponse({"message": "OK", "data": json.dumps(job)}, status=200)
+    return JsonResponse({"message": "Request not valid."}, status=400)
+
+@csrf_exempt
+def get_user_cache_stats(request, *args, **kargs):
+    """
+    Returns the hit/miss metrics of the cache of the users' profiles.
+    """
+    if request.method == "GET":
+        return JsonResponse({"message": "OK", "data": json.dumps(user_info.user_cache.stats())}, status=200)
+    return JsonResponse({"message": "Request not valid."}, status=400)
@@ -6,6 +6,10 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 #Media Folder (where to store samples)
 SAMPLES_ROOT =  os.path.join(BASE_DIR, 'samples')
 SAMPLES_URL = '/samples/'
+# Profile thumbnails of the users (see api.utils.user_info.ThumbnailStore)
+THUMBNAILS_ROOT = os.path.join(BASE_DIR, 'thumbnails')
+# Counters of the sample indices and photos being uploaded (see api.utils.enrollment.SampleWriter)
+ENROLLMENT_ROOT = os.path.join(BASE_DIR, 'enrollment')
 
 # Model dolfer
 MODELS_ROOT = os.path.join(BASE_DIR, "api", "utils", "recognition", "saved_models")
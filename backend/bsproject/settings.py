@@ -14,10 +14,6 @@ import os
 import dotenv
 from pathlib import Path
 
-from api.utils.recognition.classifiers.LBPHF import LBPHF
-from api.utils.recognition.classifiers.SVC import SVC
-from api.utils.recognition.classifiers.DeepFace import DeepFaceClassifier
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 #Media Folder (where to store samples)
@@ -28,11 +24,27 @@ SAMPLES_URL = '/samples/'
 MODELS_ROOT = os.path.join(BASE_DIR, "api", "utils", "recognition", "saved_models")
 LABELS_ROOT = os.path.join(BASE_DIR, "api", "utils", "recognition", "pickles")  
 
-# Choose the used classifier between LBPHF(), SVC() and VGGFACE()
-CLASSIFIER = LBPHF()
+# Number of threads which process the frames of the async WebSocket consumer (ws/async-socket-server/), shared by all the connections
+INFERENCE_WORKERS = 4
 
 dotenv.read_dotenv(BASE_DIR / '.env')
 
+# Choose the used classifier between LBPHF, SVC and VGGFACE (CLASSIFIER environment variable, or .env)
+# It's imported and built only when it's used for the first time (see api.utils.recognition.ClassifierRegistry)
+CLASSIFIER_NAME = os.environ.get("CLASSIFIER", "LBPHF")
+
+# Serving mode with several ASGI workers: the classifier is loaded only by the inference server (manage.py run_inference_server),
+# and the workers send it the faces to recognize (see api.utils.inference.InferenceServer). Address as host:port or the path of a Unix socket,
+# unset to load the classifier in each worker
+INFERENCE_SERVER = os.environ.get("INFERENCE_SERVER")
+# Secret shared by the server and the workers, required: the connections carry pickled objects, so whoever knows it can run code in the server
+INFERENCE_SERVER_AUTHKEY = os.environ.get("INFERENCE_SERVER_AUTHKEY")
+# The server only listens on the loopback interface (or a Unix socket), unless this is set to 1
+INFERENCE_SERVER_ALLOW_REMOTE = os.environ.get("INFERENCE_SERVER_ALLOW_REMOTE", "0") == "1"
+# Batching of the inference server: maximum number of requests in a batch, and how long (in seconds) a batch waits for more requests
+INFERENCE_BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", 8))
+INFERENCE_BATCH_WAIT = float(os.environ.get("INFERENCE_BATCH_WAIT", 0.005))
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.1/howto/deployment/checklist/
 
@@ -113,6 +125,13 @@ DATABASES = {
     }
 }
 
+# Maximum number of MySQL connections of each process (see api.utils.dbconnector.dbconnector.ConnectionPool)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+
+# Cache of the profiles of the recognized users (see api.utils.user_info.UserCache): maximum number of entries and their lifetime in seconds
+USER_CACHE_SIZE = 256
+USER_CACHE_TTL = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
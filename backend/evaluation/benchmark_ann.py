@@ -0,0 +1,60 @@
+'''
+Compares the exact gallery scan (GalleryMatcher) with the approximate IVF index (IVFMatcher) as the gallery grows.
+Run it from the backend folder with: python -m evaluation.benchmark_ann
+The gallery is synthetic: each identity has a random VGG-Face sized centre and its templates are noisy copies of it,
+and the probes are new noisy copies of enrolled identities.
+'''
+from api.utils.recognition.matchers.GalleryMatcher import GalleryMatcher
+from api.utils.recognition.matchers.IVFMatcher import IVFMatcher
+import numpy as np
+import pandas as pd
+import time
+import os
+
+GALLERY_SIZES = [1000, 5000, 20000, 50000] # Number of templates in the gallery
+TEMPLATES_PER_IDENTITY = 5
+DIMENSION = 2622 # Size of the VGG-Face feature vectors
+NOISE = 0.5 # Intra-identity noise, relative to the norm of the identity centre
+N_PROBES = 200
+N_PROBE_LISTS = [1, 4, 8, 16, 32] # Values of the IVF n_probe knob to compare
+RESULTS_PATH = "./evaluation/benchmark_ann.csv"
+
+def make_gallery(size, rng):
+    n_identities = max(1, size // TEMPLATES_PER_IDENTITY)
+    centres = rng.standard_normal((n_identities, DIMENSION), dtype=np.float32)
+    labels = np.arange(size) % n_identities
+    templates = centres[labels] + NOISE * rng.standard_normal((size, DIMENSION), dtype=np.float32)
+    probe_labels = rng.choice(n_identities, N_PROBES)
+    probes = centres[probe_labels] + NOISE * rng.standard_normal((N_PROBES, DIMENSION), dtype=np.float32)
+    return labels, templates, probes
+
+def run(matcher, probes):
+    '''
+    Returns the top-1 label for each probe and the mean latency (ms) of a single search.
+    '''
+    start = time.perf_counter()
+    results = [matcher.search(probe, k=1)[0][0] for probe in probes]
+    return np.array(results), (time.perf_counter() - start) * 1000 / len(probes)
+
+rng = np.random.default_rng(0)
+rows = []
+for size in GALLERY_SIZES:
+    labels, templates, probes = make_gallery(size, rng)
+    exact = GalleryMatcher(labels, templates)
+    exact_results, exact_latency = run(exact, probes)
+    rows.append({"gallery_size": size, "mode": "exact", "n_probe": None, "build_s": 0, "recall@1": 1.0, "latency_ms": exact_latency})
+
+    start = time.perf_counter()
+    ivf = IVFMatcher.from_gallery(exact)
+    build_time = time.perf_counter() - start
+    for n_probe in N_PROBE_LISTS:
+        ivf.n_probe = n_probe
+        ivf_results, ivf_latency = run(ivf, probes)
+        recall = np.mean(ivf_results == exact_results) # Recall@1 with respect to the exact scan
+        rows.append({"gallery_size": size, "mode": "ivf", "n_probe": n_probe, "build_s": build_time, "recall@1": recall, "latency_ms": ivf_latency})
+    print(pd.DataFrame(rows[-len(N_PROBE_LISTS) - 1:]).to_string(index=False))
+
+results = pd.DataFrame(rows)
+os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+results.to_csv(RESULTS_PATH, index=False)
+print(f"Results saved in {RESULTS_PATH}")
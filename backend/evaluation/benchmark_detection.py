@@ -0,0 +1,72 @@
+'''
+Latency of the recognition step of each classifier, before and after the shared detection stage (Classifier.detect).
+Run it from the backend folder with: python -m evaluation.benchmark_detection
+- "separate": the faces are located and then identify scans the frame again, as the tracker and the recognition did before
+- "shared": the detection is run once and identify reuses it
+each one with the detector at different DETECTION_SCALE and DETECTION_MAX_WIDTH values.
+The frames are webcam sized: LFW photos (scaled to the frame height) pasted on a 640x480 or 1920x1080 background.
+'''
+from api.utils.recognition.classifiers.LBPHF import LBPHF
+from api.utils.recognition.classifiers.SVC import SVC
+from api.utils.recognition.classifiers.DeepFace import DeepFaceClassifier
+from sklearn.datasets import fetch_lfw_people
+import numpy as np
+import pandas as pd
+import time
+import cv2
+import os
+
+N_FRAMES = 50
+FRAME_SIZES = [(480, 640), (1080, 1920)] # Height, width
+DETECTION_SETTINGS = [(1., None), (0.75, None), (0.5, None), (1., 640)] # (DETECTION_SCALE, DETECTION_MAX_WIDTH)
+RESULTS_PATH = "./evaluation/benchmark_detection.csv"
+
+def make_frames(images, frame_size, rng):
+    frames = []
+    for image in images:
+        frame = np.full((*frame_size, 3), 127, dtype=np.uint8)
+        factor = frame_size[0] / 480 # The face takes the same portion of the frame at every resolution
+        image = cv2.cvtColor(cv2.resize(image, None, fx=factor, fy=factor), cv2.COLOR_RGB2BGR) # LFW is RGB, the frames are BGR like the webcam ones
+        h, w = image.shape[:2]
+        y, x = rng.integers(0, frame_size[0] - h), rng.integers(0, frame_size[1] - w)
+        frame[y:y+h, x:x+w] = image
+        frames.append(frame)
+    return frames
+
+def run(classifier, model, frames, shared):
+    '''
+    Returns the mean latency (ms) of a frame and the fraction of frames where a face was found.
+    '''
+    found = 0
+    start = time.perf_counter()
+    for frame in frames:
+        if shared:
+            detection = classifier.detect(frame)
+            faces, _, _ = classifier.identify(frame, model, detection)
+        else:
+            classifier.locate_faces(frame)
+            faces, _, _ = classifier.identify(frame, model)
+        found += len(faces) != 0
+    return (time.perf_counter() - start) * 1000 / len(frames), found / len(frames)
+
+rng = np.random.default_rng(0)
+lfw_people = fetch_lfw_people(color=True, resize=1., slice_=None)
+images = np.array(lfw_people.images[rng.choice(len(lfw_people.images), N_FRAMES, replace=False)] * 255, dtype='uint8') # The pixels are floats in [0, 1]
+rows = []
+for classifier_class in [LBPHF, SVC, DeepFaceClassifier]:
+    classifier = classifier_class()
+    _, model = classifier.current_model()
+    for frame_size in FRAME_SIZES:
+        frames = make_frames(images, frame_size, rng)
+        for scale, max_width in DETECTION_SETTINGS:
+            classifier.DETECTION_SCALE, classifier.DETECTION_MAX_WIDTH = scale, max_width
+            for shared in [False, True]:
+                latency, face_rate = run(classifier, model, frames, shared)
+                rows.append({"classifier": classifier.name, "frame_width": frame_size[1], "detection": "shared" if shared else "separate",
+                             "scale": scale, "max_width": max_width, "latency_ms": latency, "face_rate": face_rate})
+    print(pd.DataFrame(rows[-2 * len(DETECTION_SETTINGS) * len(FRAME_SIZES):]).to_string(index=False))
+
+results = pd.DataFrame(rows)
+os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+results.to_csv(RESULTS_PATH, index=False)
+print(f"Results saved in {RESULTS_PATH}")
@@ -1,5 +1,6 @@
 from tqdm import tqdm
 import numpy as np
+from api.utils.recognition.matchers.GalleryMatcher import GalleryMatcher
 
 #All similarities are store in an array with the following structure: [(label_i, [label_j, similarities_ij]), (label_n, [label_m, similarities_nm]), ...]
 def compute_similarities(probe_set, gallery_set, similarity_function: callable):
@@ -13,6 +14,17 @@ def compute_similarities(probe_set, gallery_set, similarity_function: callable):
         all_similarities.append(np.array([label_i, row_similarities], dtype=object))
     return all_similarities
 
+#Same output as compute_similarities with the cosine similarity, but every probe is scored against the whole gallery with a single matrix product
+def compute_similarities_matcher(probe_set, gallery_set):
+    matcher = GalleryMatcher.from_pairs(gallery_set)
+    probe_labels = [label_i for (label_i, _) in probe_set]
+    similarity_matrix = matcher.similarities([template_i for (_, template_i) in probe_set])
+    all_similarities = []
+    for label_i, similarities in zip(tqdm(probe_labels, "Computing similarities"), similarity_matrix): #for every row (probe)
+        row_similarities = [np.array([label_j, similarity]) for label_j, similarity in zip(matcher.labels, similarities)]
+        all_similarities.append(np.array([label_i, row_similarities], dtype=object))
+    return all_similarities
+
 def compute_similarities_svc(probe_set, model):
 
     def inverse_softmax(array):
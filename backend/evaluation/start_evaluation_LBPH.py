@@ -12,6 +12,7 @@ import face_recognition
 import matplotlib.pyplot as plt
 import cv2
 from scipy.stats import pearsonr
+from api.utils.recognition.stores.FeatureStore import get_feature_store, array_hash
 
 def extract_histogram(img):
     tmp_model = cv2.face.LBPHFaceRecognizer_create(
@@ -60,8 +61,6 @@ else:
 ######## Defining the paths where results will be saved ######## 
 SAVED_ARRAYS_PATH = f"./evaluation/saved_arrays_lbph_lfw_{MIN_FACES}" if DATASET == "LFW" else "./evaluation/saved_arrays_lbph_olivetti"
 PLOTS = os.path.join(SAVED_ARRAYS_PATH, "lfw_plots") if DATASET == "LFW" else os.path.join(SAVED_ARRAYS_PATH, "olivetti_plots")
-GALLERY_SET = os.path.join(SAVED_ARRAYS_PATH, "gallery_set.npy")
-PROBE_SET = os.path.join(SAVED_ARRAYS_PATH, "probe_set.npy")
 SIMILARITIES_PATH = os.path.join(SAVED_ARRAYS_PATH, "similarities.npy")
 IDENTIFICATION_METRICS = os.path.join(SAVED_ARRAYS_PATH, "identification_metrics.csv")
 VERIFICATION_METRICS = os.path.join(SAVED_ARRAYS_PATH, "verification_metrics.csv")
@@ -90,22 +89,15 @@ if not os.path.exists(PLOTS):
     os.mkdir(PLOTS)
     
 ######## Build feature vectors ########
-gallery_set = []
-probe_set = []
+# The histograms are shared with the other runs through the feature store, keyed by the hash of each image
+features = get_feature_store().table("LBPH-histogram", {"radius": 1, "neighbors": 8, "grid_x": 8, "grid_y": 8, "normalized": True})
 
-if os.path.exists(GALLERY_SET):
-    gallery_set = np.load(GALLERY_SET)
-else:
-    for gallery_template in tqdm(X_train, desc="Extracting gallery set feature vectors"):
-        gallery_set.append(extract_histogram(gallery_template))
-    np.save(GALLERY_SET, np.array(gallery_set))
+def represent(template):
+    return features.get_or_compute(array_hash(template), lambda: extract_histogram(template))
 
-if os.path.exists(PROBE_SET):
-    probe_set = np.load(PROBE_SET)
-else:
-    for probe_template in tqdm(X_test, desc="Extracting probe set feature vectors"):
-        probe_set.append(extract_histogram(probe_template))
-    np.save(PROBE_SET, np.array(probe_set))
+gallery_set = [represent(gallery_template) for gallery_template in tqdm(X_train, desc="Extracting gallery set feature vectors")]
+probe_set = [represent(probe_template) for probe_template in tqdm(X_test, desc="Extracting probe set feature vectors")]
+features.save()
 
 # Each element is of type (label, feature_vector)
 gallery_data = np.array([(y_train[i], gallery_set[i]) for i in range(len(gallery_set))])
@@ -11,6 +11,7 @@ from sklearn.svm import SVC
 import pickle
 import face_recognition
 import cv2
+from api.utils.recognition.stores.FeatureStore import get_feature_store, array_hash
 
 DATASET = "LFW" # Dataset ot use: LFW or OLIVETTI
 MIN_FACES = 10
@@ -32,26 +33,33 @@ else:
 
 _, WIDTH, HEIGHT, _ = X.shape
 
+# The encodings are shared with the other runs (and the training) through the feature store, keyed by the hash of each image
+features = get_feature_store().table("face_recognition", {"model": "hog" if DATASET == "LFW" else "whole_image", "num_jitters": 1})
+
+def encode(template):
+    if DATASET == "LFW":
+        boxes = face_recognition.face_locations(template)
+    else:
+        boxes = [(0, WIDTH, HEIGHT, 0)]
+    encoding = face_recognition.face_encodings(template, boxes)
+    return encoding[0] if len(encoding) else None
+
 def represent(templates):
     feature_vectors = []
     missed_index = []
     for index, template in enumerate(tqdm(templates, desc="Extracting feature vectors")):
-        if DATASET == "LFW":
-            boxes = face_recognition.face_locations(template)
-        else:
-            boxes = [(0, WIDTH, HEIGHT, 0)]
-        encoding = face_recognition.face_encodings(template, boxes)
-        if len(encoding) == 0:
+        encoding = features.get_or_compute(array_hash(template), lambda: encode(template))
+        if encoding is None:
             missed_index.append(index)
         else:
-            feature_vectors.append(encoding[0])
+            feature_vectors.append(encoding)
+    features.save()
     return np.array(missed_index), np.array(feature_vectors)
 
 ######## Defining the paths where results will be saved ######## 
 SAVED_ARRAYS_PATH = f"./evaluation/saved_arrays_svc_lfw_{MIN_FACES}" if DATASET == "LFW" else "./evaluation/saved_arrays_svc_olivetti"
 PLOTS = os.path.join(SAVED_ARRAYS_PATH, "lfw_plots") if DATASET == "LFW" else os.path.join(SAVED_ARRAYS_PATH, "olivetti_plots")
 MODEL = os.path.join(SAVED_ARRAYS_PATH, "model.pickle")
-FEATURE_VECTORS_PATH = os.path.join(SAVED_ARRAYS_PATH, "feature_vectors.pickles")
 PROBE_SET = os.path.join(SAVED_ARRAYS_PATH, "probe_set.npy")
 SIMILARITIES_PATH = os.path.join(SAVED_ARRAYS_PATH, "similarities.npy")
 IDENTIFICATION_METRICS = os.path.join(SAVED_ARRAYS_PATH, "identification_metrics.csv")
@@ -69,13 +77,9 @@ def get_similarity_between_two(img1, img2):
 ######## Build feature vectors ########
 model = SVC(kernel='linear', probability=True, random_state=4)
 
-if os.path.exists(FEATURE_VECTORS_PATH):
-    X, y = pickle.load(open(FEATURE_VECTORS_PATH, "rb"))
-else:
-    missed_index, X = represent(X)
-    if len(missed_index) != 0:
-        y = np.delete(y, missed_index)
-    pickle.dump(tuple((X,y)), open(FEATURE_VECTORS_PATH, "wb"))
+missed_index, X = represent(X)
+if len(missed_index) != 0:
+    y = np.delete(y, missed_index)
 
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.33, random_state=0)
 
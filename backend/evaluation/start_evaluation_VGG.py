@@ -1,16 +1,16 @@
-from .evaluation import compute_similarities, open_set_identification_eval, verification_eval, verification_mul_eval
+from .evaluation import compute_similarities_matcher, open_set_identification_eval, verification_eval, verification_mul_eval
 from deepface import DeepFace
 from sklearn.datasets import fetch_lfw_people, fetch_olivetti_faces
 import numpy as np
 from .plots import save_plots
 from tqdm import tqdm
-from scipy.spatial.distance import cosine
 import os
 import pandas as pd
 from sklearn.model_selection import train_test_split
 import cv2
 import face_recognition
 import matplotlib.pyplot as plt
+from api.utils.recognition.stores.FeatureStore import get_feature_store, array_hash
 
 DATASET = "LFW" #Dataset ot use: LFW or OLIVETTI
 MIN_FACES = 7
@@ -35,8 +35,6 @@ X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.33, random
 ######## Defining the paths where results will be saved ######## 
 SAVED_ARRAYS_PATH = f"./evaluation/saved_arrays_vgg_lfw_{MIN_FACES}" if DATASET == "LFW" else "./evaluation/saved_arrays_vgg_olivetti"
 PLOTS = os.path.join(SAVED_ARRAYS_PATH, "lfw_plots") if DATASET == "LFW" else os.path.join(SAVED_ARRAYS_PATH, "olivetti_plots")
-GALLERY_SET = os.path.join(SAVED_ARRAYS_PATH, "gallery_set.npy")
-PROBE_SET = os.path.join(SAVED_ARRAYS_PATH, "probe_set.npy")
 SIMILARITIES_PATH = os.path.join(SAVED_ARRAYS_PATH, "similarities.npy")
 IDENTIFICATION_METRICS = os.path.join(SAVED_ARRAYS_PATH, "identification_metrics.csv")
 VERIFICATION_METRICS = os.path.join(SAVED_ARRAYS_PATH, "verification_metrics.csv")
@@ -47,14 +45,15 @@ if not os.path.exists(SAVED_ARRAYS_PATH):
 if not os.path.exists(PLOTS):
     os.mkdir(PLOTS)
 
-def get_similarity_between_two(img1, img2):
-    return 1 - cosine(img1, img2)
     
 ######## Build the VGG Face model ########
 model = DeepFace.build_model('VGG-Face')
+# The feature vectors are shared with the other runs through the feature store, keyed by the hash of each image. The faces are already
+# cropped here, so they're embedded without detection: the training detects them first, so its vectors are in another table
+features = get_feature_store().table("VGG-Face", {"detector_backend": "skip"})
 
 # Localize faces and remove the unlocalized ones, only for the LFW dataset
-if DATASET == "LFW" and not os.path.exists(GALLERY_SET) and not os.path.exists(PROBE_SET):
+if DATASET == "LFW" and len(features) == 0:
     new_X = []
     new_Y = []
     for index, template in enumerate(tqdm(X, desc="Localizing faces")):
@@ -68,22 +67,12 @@ if DATASET == "LFW" and not os.path.exists(GALLERY_SET) and not os.path.exists(P
     X = new_X
     y = new_Y
 
-gallery_set = []
-probe_set = []
+def represent(template):
+    return features.get_or_compute(array_hash(template), lambda: DeepFace.represent(template, model=model, detector_backend="skip"))
 
-if os.path.exists(GALLERY_SET):
-    gallery_set = np.load(GALLERY_SET)
-else:
-    for gallery_template in tqdm(X_train, desc="Extracting gallery set feature vectors"):
-        gallery_set.append(DeepFace.represent(gallery_template, model=model, detector_backend="skip"))
-    np.save(GALLERY_SET, np.array(gallery_set))
-
-if os.path.exists(PROBE_SET):
-    probe_set = np.load(PROBE_SET)
-else:
-    for probe_template in tqdm(X_test, desc="Extracting probe set feature vectors"):
-        probe_set.append(DeepFace.represent(probe_template, model=model, detector_backend="skip"))
-    np.save(PROBE_SET, np.array(probe_set))
+gallery_set = [represent(gallery_template) for gallery_template in tqdm(X_train, desc="Extracting gallery set feature vectors")]
+probe_set = [represent(probe_template) for probe_template in tqdm(X_test, desc="Extracting probe set feature vectors")]
+features.save()
 
 # Each element is of type (label, feature_vector)
 gallery_data = np.array([(y_train[i], gallery_set[i]) for i in range(len(gallery_set))])
@@ -93,7 +82,7 @@ probe_data = np.array([(y_test[i], probe_set[i]) for i in range(len(probe_set))]
 if os.path.exists(SIMILARITIES_PATH):
     all_similarities = np.load(SIMILARITIES_PATH, allow_pickle=True)
 else:
-    all_similarities = compute_similarities(probe_data, gallery_data, get_similarity_between_two)
+    all_similarities = compute_similarities_matcher(probe_data, gallery_data)
     np.save(SIMILARITIES_PATH, np.array(all_similarities))
 
 ####### Load evaluation data if present - Deep Face ########
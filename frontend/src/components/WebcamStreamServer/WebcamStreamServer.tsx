@@ -8,6 +8,19 @@ type WebcamStreamCaptureProps = {
 	style?: React.CSSProperties
 	resolution: Resolution
 }
+
+type FaceOverlay = {
+	faces: Array<[number, number, number, number]> // [x, y, width, height] in frame pixels
+	frameSize: [number, number] // [width, height] of the frame the boxes refer to
+	label?: string
+}
+
+/**
+ * If true, the server only sends the face boxes and the recognition result, and the overlay is drawn here on the live webcam.
+ * Otherwise the server sends back every frame with the overlay already drawn on it.
+ */
+const METADATA_ONLY = true
+
 /**
  * Webcam components that handles the video recording
  * @param param0
@@ -17,6 +30,7 @@ const WebcamStreamServer = ({ style, resolution }: WebcamStreamCaptureProps) =>
 	const webcamRef = useRef<any>(null)
 	const [connected, setConnected] = useState<boolean>(false)
 	const [imgSrc, setImgSrc] = useState<any>(null)
+	const [overlay, setOverlay] = useState<FaceOverlay | null>(null)
 	const [photoInterval, setPhotoInterval] = useState<any>(null)
 	let { socket, setSocket } = useContext(AdminContext)
 
@@ -25,14 +39,23 @@ const WebcamStreamServer = ({ style, resolution }: WebcamStreamCaptureProps) =>
 	const periodicScreenshot = async () => {
 		const photoInterval = setInterval(async () => {
 			if (webcamRef.current === null) return
-			const screenshot: string = webcamRef.current.getScreenshot()
-			socket?.send(screenshot)
+			const screenshot: string = METADATA_ONLY ? captureScaledScreenshot() : webcamRef.current.getScreenshot()
+			if (screenshot) socket?.send(screenshot)
 		}, 1000 / FPS)
 		setPhotoInterval(photoInterval)
 	}
 
+	// The visible webcam is bigger than the frames to send, so the screenshot is scaled to the height of the resolution
+	const captureScaledScreenshot = (): string => {
+		const video = webcamRef.current.video
+		if (!video || video.videoHeight === 0) return ""
+		const height = parseInt(resolution) || video.videoHeight
+		const width = Math.round((height * video.videoWidth) / video.videoHeight)
+		return webcamRef.current.getScreenshot({ width, height })
+	}
+
 	useEffect(() => {
-		setSocket(new WebSocket(`ws://127.0.0.1:8000/ws/socket-server/`))
+		setSocket(new WebSocket(`ws://127.0.0.1:8000/ws/socket-server/${METADATA_ONLY ? "?mode=meta" : ""}`))
 		return () => {
 			socket?.close()
 			setSocket(undefined)
@@ -44,6 +67,12 @@ const WebcamStreamServer = ({ style, resolution }: WebcamStreamCaptureProps) =>
 		socket?.addEventListener("close", () => setConnected(false))
 		socket?.addEventListener("message", (e: any) => {
 			const data = JSON.parse(e.data)
+			if (METADATA_ONLY) {
+				if (data["FACES"] === undefined) return
+				const userInfo = data["USER_INFO"]
+				setOverlay({ faces: data["FACES"], frameSize: data["FRAME_SIZE"], label: userInfo ? `${userInfo["NAME"]} ${userInfo["SURNAME"]}` : undefined })
+				return
+			}
 			const frame = data["FRAME"]
 			setImgSrc(frame)
 		})
@@ -57,6 +86,29 @@ const WebcamStreamServer = ({ style, resolution }: WebcamStreamCaptureProps) =>
 		}
 	}, [connected])
 
+	if (METADATA_ONLY) {
+		return (
+			<div className="webcam-stream-server">
+				<Webcam mirrored audio={false} ref={webcamRef} screenshotFormat="image/jpeg" style={style} />
+				{overlay && connected && (
+					// Same scaling of the video (object-fit: cover), so the boxes stay on the faces
+					<svg className="webcam-stream-server__overlay" viewBox={`0 0 ${overlay.frameSize[0]} ${overlay.frameSize[1]}`} preserveAspectRatio="xMidYMid slice" style={{ borderRadius: style?.borderRadius }}>
+						{overlay.faces.map(([x, y, w, h], index) => (
+							<g key={index}>
+								<rect x={x} y={y} width={w} height={h} fill="none" stroke="#0000ff" strokeWidth={2} />
+								{index === 0 && overlay.label && (
+									<text x={x} y={y} fill="#ffffff" fontSize={Math.max(12, h / 8)}>
+										{overlay.label}
+									</text>
+								)}
+							</g>
+						))}
+					</svg>
+				)}
+			</div>
+		)
+	}
+
 	return (
 		<>
 			{imgSrc && connected && <img alt="stremed-video" src={imgSrc} style={{ ...style, zIndex: 5 }} />}
@@ -120,11 +120,11 @@ const ConfirmUpload = ({ photoList, setPhotoList }: ConfirmUploadProps) => {
 	const [uploadComplete, setUploadComplete] = useState<boolean>(false)
 
 	const handleUploadPhoto = async () => {
-		//Make the api request to upload the photos
+		//Make the api request to upload the photos, sent as image files (the screenshots are data URLs) so the server can save them while they arrive
 		let formData = new FormData()
-		formData.append("photoList", JSON.stringify(photoList))
-		formData.append("id", ReactSession.get("USER_ID"))
-		await axios.post("http://localhost:8000/api/upload_photo_enrollment", formData)
+		const photos = await Promise.all(photoList.map((photo) => fetch(photo).then((response) => response.blob())))
+		photos.forEach((photo, index) => formData.append("photos", photo, `photo_${index}.jpeg`))
+		await axios.post("http://localhost:8000/api/upload_photo_enrollment", formData, { params: { id: ReactSession.get("USER_ID") } })
 		setUploadComplete(true)
 	}
 
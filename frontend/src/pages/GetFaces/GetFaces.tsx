@@ -7,8 +7,11 @@ import { BackButton, ProfileIconName } from '../../components';
 import { ImBin } from 'react-icons/im';
 import './GetFaces.scss'
 
+const PAGE_SIZE = 20
+
 function GetFaces() {
-    const [ userPhoto, setUserPhoto ] = useState([])
+    const [ userPhoto, setUserPhoto ] = useState<Array<[string, string]>>([])
+    const [ totalPhotos, setTotalPhotos ] = useState<number>(0)
     const navigate = useNavigate();
 
     const firstLetterUppercase = (str: string) => {
@@ -22,13 +25,23 @@ function GetFaces() {
         })
     }
 
-    const refreshPhoto = () => {
-        axios.get('http://localhost:8000/api/get_photo_list', { params: { id: ReactSession.get('USER_ID') } })
+    // The photos are loaded a page at a time, as resized images served by URL instead of base64 strings
+    const loadPhotoPage = (page: number) => {
+        return axios.get('http://localhost:8000/api/get_photo_list', { params: { id: ReactSession.get('USER_ID'), page: page, page_size: PAGE_SIZE, size: 'medium', inline: false } })
         .then(function(response) {
-            setUserPhoto(JSON.parse(response.data.data));
+            setTotalPhotos(response.data.total);
+            return JSON.parse(response.data.data);
         })
     }
 
+    const refreshPhoto = () => {
+        loadPhotoPage(1).then((photos) => setUserPhoto(photos))
+    }
+
+    const loadMorePhoto = () => {
+        loadPhotoPage(Math.floor(userPhoto.length / PAGE_SIZE) + 1).then((photos) => setUserPhoto((userPhoto) => userPhoto.concat(photos)))
+    }
+
 	useEffect (() => {
         ReactSession.setStoreType("sessionStorage");
 		if (ReactSession.get("USER_EMAIL") === undefined)
@@ -52,13 +65,18 @@ function GetFaces() {
                         <p>Your Photos</p>
                     </div>
                     <div className='photoContainerItems'>
-                        {userPhoto.length > 0 ? userPhoto.map((item: String, index: number) => (
-                            <div className='photoItem' key={index}>
-                                <img src={item[1]} alt={'user'+index}></img>
+                        {userPhoto.length > 0 ? userPhoto.map((item: [string, string], index: number) => (
+                            <div className='photoItem' key={item[0]}>
+                                <img src={item[1]} alt={'user'+index} loading='lazy'></img>
                                 <button onClick={() => deletePhoto(ReactSession.get('USER_ID'), item[0])}><ImBin /></button>
                             </div>
                         )) : 'You have no photo!'}
                     </div>
+                    {userPhoto.length < totalPhotos && (
+                        <div className='photoItem'>
+                            <button onClick={loadMorePhoto}>Load more</button>
+                        </div>
+                    )}
                 </div>
             </div>
         </div>
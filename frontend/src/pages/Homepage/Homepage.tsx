@@ -36,7 +36,7 @@ function Homepage() {
 			navigate("/login")
 		} else {
 			if (ReactSession.get("USER_ROLE") === "student") {
-				axios.get("http://localhost:8000/api/get_photo_list", { params: { id: ReactSession.get("USER_ID") } }).then(function (response) {
+				axios.get("http://localhost:8000/api/get_photo_list", { params: { id: ReactSession.get("USER_ID"), page: 1, page_size: 1, size: "thumb", inline: false } }).then(function (response) {
 					setUserPhoto(JSON.parse(response.data.data))
 				})
 				axios.get("http://localhost:8000/api/get_attendance_list", { params: { id: ReactSession.get("USER_ID") } }).then(function (response) {